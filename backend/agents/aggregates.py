@@ -0,0 +1,266 @@
+"""
+Rolling epidemiological aggregates of completed diagnoses.
+
+Every /diagnose answer and completed chat diagnosis is counted, as it
+completes, in three rolling windows:
+
+    window   bucket     buckets
+    minute   1 s        60
+    hour     1 min      60
+    day      15 min     96
+
+Counters are kept per group (lugar x estacion, normalized as the Bayesian
+network sees them: Corrientes/Otro and Verano/Invierno): diagnoses, each
+deterministic code, alarm-sign activations (GRAVE_* codes), agent errors and
+the sums of the three posterior probabilities. Each window is a ring of
+buckets plus running totals, so memory is fixed and a query only reads the
+totals, whatever the traffic volume.
+
+With several workers, set CODEX_AGGREGATES_DIR to a directory shared by all of
+them: each worker writes its rings there every CODEX_AGGREGATES_SNAPSHOT_SECONDS
+(default 5), and a query merges the snapshots of the other workers with its
+own live counters. Snapshots of stopped workers keep counting until their
+buckets fall out of the day window.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+CODES = ("DENGUE", "COVID", "DUAL", "GRAVE_DENGUE", "GRAVE_COVID", "GRAVE_INDETERMINADO")
+FIELDS = ("count",) + CODES + ("error", "alarm", "probabilistic", "dengue_sum", "covid_sum", "both_sum")
+_FIELD = {name: i for i, name in enumerate(FIELDS)}
+
+LUGARES = ("Corrientes", "Otro")
+ESTACIONES = ("Verano", "Invierno")
+GROUPS = [(lugar, estacion) for lugar in LUGARES for estacion in ESTACIONES]
+
+# name -> (bucket width in seconds, number of buckets)
+WINDOWS = {"minute": (1, 60), "hour": (60, 60), "day": (900, 96)}
+
+
+def group_index(patient: dict) -> int:
+    lugar = 0 if patient.get("lugar") == "Corrientes" else 1
+    estacion = 0 if patient.get("estacion") == "Verano" else 1
+    return lugar * len(ESTACIONES) + estacion
+
+
+def observation(results: dict) -> np.ndarray:
+    """Counter increments for one diagnosis ({"deterministic": ..., "probabilistic": ...})"""
+    row = np.zeros(len(FIELDS))
+    row[_FIELD["count"]] = 1
+    det = results.get("deterministic") or {}
+    code = det.get("codigo")
+    if "error" in det or code not in _FIELD:
+        row[_FIELD["error"]] = 1
+    else:
+        row[_FIELD[code]] = 1
+        row[_FIELD["alarm"]] = code.startswith("GRAVE_")
+    prob = results.get("probabilistic") or {}
+    if "error" not in prob and prob.get("dengue_probability") is not None:
+        row[_FIELD["probabilistic"]] = 1
+        row[_FIELD["dengue_sum"]] = prob["dengue_probability"]
+        row[_FIELD["covid_sum"]] = prob["covid_probability"]
+        row[_FIELD["both_sum"]] = prob["both_probability"]
+    return row
+
+
+class RollingWindow:
+    """Ring of `buckets` buckets of `width` seconds with running totals per group"""
+
+    def __init__(self, width: int, buckets: int):
+        self.width = width
+        self.buckets = buckets
+        self.slots = np.zeros((buckets, len(GROUPS), len(FIELDS)))
+        self.ids = np.full(buckets, -1, dtype=np.int64)  # absolute bucket held by each slot
+        self.totals = np.zeros((len(GROUPS), len(FIELDS)))
+        self.current = -1
+
+    def advance(self, now: float) -> int:
+        """Expire the buckets that left the window; returns the current bucket"""
+        bucket = int(now // self.width)
+        if bucket > self.current:
+            for b in range(max(self.current + 1, bucket - self.buckets + 1), bucket + 1):
+                slot = b % self.buckets
+                self.slots[slot] = 0
+                self.ids[slot] = b
+            self.current = bucket
+            # Recomputed (at most once per bucket) rather than subtracted, so sums do not drift
+            self.totals = self.slots.sum(axis=0)
+        return self.current  # a clock step backwards counts in the current bucket
+
+    def add(self, now: float, group: int, row: np.ndarray):
+        bucket = self.advance(now)
+        self.slots[bucket % self.buckets, group] += row
+        self.totals[group] += row
+
+
+def _merge_snapshot(slots: np.ndarray, ids: np.ndarray, width: int, now: float) -> np.ndarray:
+    """Totals of a snapshot's buckets that are still inside the window"""
+    bucket = int(now // width)
+    live = (ids > bucket - len(ids)) & (ids <= bucket)
+    return slots[live].sum(axis=0)
+
+
+class EpiAggregates:
+    def __init__(self, directory: Optional[str] = None, snapshot_interval: float = 5.0):
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.windows = {name: RollingWindow(*spec) for name, spec in WINDOWS.items()}
+        self.observed = 0
+        self._lock = threading.Lock()
+        self._remote_lock = threading.Lock()
+        self._remote: Dict[str, Tuple[float, dict]] = {}  # path -> (mtime, arrays)
+        self._remote_checked = 0.0
+        self._stop = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.path = os.path.join(directory, f"aggregates-{os.getpid()}.npz")
+
+    def observe(self, patient: dict, results: dict, now: Optional[float] = None):
+        """Count one completed diagnosis"""
+        row = observation(results)
+        group = group_index(patient)
+        now = time.time() if now is None else now
+        with self._lock:
+            for window in self.windows.values():
+                window.add(now, group, row)
+            self.observed += 1
+
+    def _arrays(self) -> dict:
+        return {
+            key: value
+            for name, window in self.windows.items()
+            for key, value in ((f"{name}_slots", window.slots.copy()), (f"{name}_ids", window.ids.copy()))
+        }
+
+    def write_snapshot(self):
+        """Write this worker's rings atomically to the shared directory"""
+        if not self.directory:
+            return
+        with self._lock:
+            now = time.time()
+            for window in self.windows.values():
+                window.advance(now)
+            arrays = self._arrays()
+        tmp = f"{self.path}.tmp.npz"
+        np.savez(tmp, **arrays)
+        os.replace(tmp, self.path)
+
+    def _remote_snapshots(self, now: float) -> List[dict]:
+        """Other workers' snapshots, rescanned at most once per second"""
+        if not self.directory:
+            return []
+        with self._remote_lock:
+            return self._scan_snapshots(now)
+
+    def _scan_snapshots(self, now: float) -> List[dict]:
+        if now - self._remote_checked >= 1.0:
+            self._remote_checked = now
+            oldest = now - max(width * n for width, n in WINDOWS.values())
+            seen = set()
+            for entry in os.scandir(self.directory):
+                if (not entry.name.startswith("aggregates-") or not entry.name.endswith(".npz")
+                        or ".tmp" in entry.name or entry.path == self.path):
+                    continue
+                mtime = entry.stat().st_mtime
+                if mtime < oldest:
+                    continue  # every bucket has expired
+                seen.add(entry.path)
+                cached = self._remote.get(entry.path)
+                if cached is None or cached[0] != mtime:
+                    try:
+                        with np.load(entry.path) as data:
+                            self._remote[entry.path] = (mtime, {k: data[k] for k in data.files})
+                    except (OSError, ValueError, KeyError):
+                        continue  # being replaced; picked up on the next scan
+            for path in set(self._remote) - seen:
+                del self._remote[path]
+        return [arrays for _, arrays in self._remote.values()]
+
+    def query(self, window: Optional[str] = None, now: Optional[float] = None) -> dict:
+        """Counters per group and overall for one window, or all of them"""
+        now = time.time() if now is None else now
+        names = [window] if window else list(WINDOWS)
+        with self._lock:
+            totals = {}
+            for name in names:
+                self.windows[name].advance(now)
+                totals[name] = self.windows[name].totals.copy()
+        remote = self._remote_snapshots(now)
+        for name in names:
+            width = WINDOWS[name][0]
+            for arrays in remote:
+                totals[name] += _merge_snapshot(arrays[f"{name}_slots"], arrays[f"{name}_ids"], width, now)
+        return {
+            "generated_at": now,
+            "workers": 1 + len(remote),
+            "windows": {
+                name: {
+                    "seconds": WINDOWS[name][0] * WINDOWS[name][1],
+                    "bucket_seconds": WINDOWS[name][0],
+                    "total": _summarize(totals[name].sum(axis=0)),
+                    "groups": [
+                        dict(lugar=lugar, estacion=estacion, **_summarize(totals[name][g]))
+                        for g, (lugar, estacion) in enumerate(GROUPS)
+                    ],
+                }
+                for name in names
+            },
+        }
+
+    def _snapshot_loop(self):
+        while not self._stop.wait(self.snapshot_interval):
+            try:
+                self.write_snapshot()
+            except OSError as e:
+                print(f"Aggregates snapshot failed: {e}")
+
+    def start(self):
+        """Start the snapshot thread when a shared directory is configured (idempotent)"""
+        if not self.directory or (self._writer is not None and self._writer.is_alive()):
+            return
+        self._stop.clear()
+        self._writer = threading.Thread(target=self._snapshot_loop, name="aggregates-snapshot", daemon=True)
+        self._writer.start()
+
+    def stop(self):
+        if self._writer is None:
+            return
+        self._stop.set()
+        self._writer.join(timeout=self.snapshot_interval)
+        self._writer = None
+        try:
+            self.write_snapshot()
+        except OSError as e:
+            print(f"Aggregates snapshot failed: {e}")
+
+
+def _summarize(row: np.ndarray) -> dict:
+    count = int(row[_FIELD["count"]])
+    with_probabilities = row[_FIELD["probabilistic"]]
+
+    def average(field):
+        return round(float(row[_FIELD[field]] / with_probabilities), 2) if with_probabilities else None
+
+    return {
+        "count": count,
+        "classifications": {code: int(row[_FIELD[code]]) for code in CODES},
+        "alarms": int(row[_FIELD["alarm"]]),
+        "errors": int(row[_FIELD["error"]]),
+        "avg_probability": {
+            "dengue": average("dengue_sum"),
+            "covid": average("covid_sum"),
+            "both": average("both_sum"),
+        },
+    }
+
+
+aggregates = EpiAggregates(
+    directory=os.environ.get("CODEX_AGGREGATES_DIR") or None,
+    snapshot_interval=float(os.environ.get("CODEX_AGGREGATES_SNAPSHOT_SECONDS", 5.0)),
+)
@@ -0,0 +1,493 @@
+"""
+Append-only audit log of diagnoses.
+
+Request handlers never touch the disk: `push` stores a compact record (a
+tuple, see RECORD_FIELDS) in a bounded in-memory ring buffer and returns. A
+background writer thread drains the buffer in batches into one of two sinks:
+- SQLiteAuditSink: a table in a WAL-mode SQLite file, shared by every worker
+  on a host;
+- JSONLAuditSink: one JSON object per line in segments rotated by size, one
+  series of segments per worker process.
+
+Backpressure, when the buffer is full (CODEX_AUDIT_POLICY):
+- "drop": the record is discarded and counted;
+- "block": the caller waits up to CODEX_AUDIT_BLOCK_SECONDS for room, then
+  drops (async handlers wait in the threadpool, not on the event loop);
+- "spill": the record is appended to a local overflow file, which the writer
+  feeds back into the sink once the buffer has drained. Spill files are named
+  after the worker's pid; at start a worker also writes the spill files left
+  by workers that are no longer running, claiming each one by rename to a
+  name unique to the claiming AuditLog, so that no file is written twice.
+
+Durability (CODEX_AUDIT_FSYNC):
+- "always": every batch is fsynced before the next one is written;
+- "interval": at most one fsync every CODEX_AUDIT_FSYNC_SECONDS;
+- "never": left to the operating system.
+For SQLite these map to synchronous=FULL, and to synchronous=NORMAL with
+periodic WAL checkpoints or synchronous=OFF.
+
+Enabled with CODEX_AUDIT=sqlite or CODEX_AUDIT=jsonl; CODEX_AUDIT_PATH is the
+SQLite file or the JSONL directory.
+"""
+
+import json
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+from backend.agents.probabilistic import VERSION_MODELO
+
+# Input bitmask: one bit per field, first field = most significant bit
+INPUT_FIELDS = (
+    "fiebre", "tos", "dolor_garganta", "dolor_retroocular", "mialgia", "anosmia",
+    "asma", "hipertension", "viaje_brasil", "contacto_dengue",
+    "dolor_abdominal_intenso", "sangrado_mucosas", "disnea",
+)
+INPUT_BITS = INPUT_FIELDS + ("lugar=Corrientes", "estacion=Verano")
+
+RECORD_FIELDS = (
+    "ts", "source", "input_mask", "temperature", "kb_version", "model_version",
+    "deterministic_code", "dengue_probability", "covid_probability", "both_probability",
+    "deterministic_seconds", "probabilistic_seconds", "total_seconds", "error",
+)
+
+POLICIES = ("drop", "block", "spill")
+# <prefix><pid>.jsonl, plus .draining while its writer feeds it back into the
+# sink, or .recovering-<pid>-<token> once claimed by an AuditLog after a restart
+SPILL_NAME = re.compile(
+    r"^(?P<prefix>.*?)(?P<pid>\d+)\.jsonl"
+    r"(?:\.draining|\.recovering-(?P<claimer>\d+)(?:-(?P<token>[0-9a-f]+))?)?$"
+)
+# Claim tokens of the AuditLog instances of this process
+_claim_tokens = set()
+FSYNC_POLICIES = ("always", "interval", "never")
+
+
+def input_mask(patient: dict) -> int:
+    """Patient inputs as a bitmask over INPUT_BITS"""
+    mask = 0
+    for field in INPUT_FIELDS:
+        mask = (mask << 1) | bool(patient.get(field))
+    mask = (mask << 1) | (patient.get("lugar") == "Corrientes")
+    return (mask << 1) | (patient.get("estacion") == "Verano")
+
+
+def diagnosis_record(source: str, patient: dict, results: dict, timings: Dict[str, float],
+                     total_seconds: float) -> tuple:
+    """Compact audit record of one diagnosis ({"deterministic": ..., "probabilistic": ...})"""
+    det = results.get("deterministic") or {}
+    prob = results.get("probabilistic") or {}
+    errors = [f"{name}: {result['error']}" for name, result in results.items()
+              if isinstance(result, dict) and "error" in result]
+    return (
+        time.time(), source, input_mask(patient), patient.get("temperatura"),
+        det.get("kb_version"), VERSION_MODELO, det.get("codigo"),
+        prob.get("dengue_probability"), prob.get("covid_probability"), prob.get("both_probability"),
+        timings.get("deterministic"), timings.get("probabilistic"), total_seconds,
+        "; ".join(errors) or None,
+    )
+
+
+class RingBuffer:
+    """Fixed-capacity FIFO over a preallocated list; not thread-safe"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._slots: List[Optional[tuple]] = [None] * capacity
+        self._head = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def full(self) -> bool:
+        return self._size == self.capacity
+
+    def push(self, item: tuple):
+        self._slots[(self._head + self._size) % self.capacity] = item
+        self._size += 1
+
+    def pop_batch(self, n: int) -> List[tuple]:
+        n = min(n, self._size)
+        batch = []
+        for _ in range(n):
+            batch.append(self._slots[self._head])
+            self._slots[self._head] = None
+            self._head = (self._head + 1) % self.capacity
+        self._size -= n
+        return batch
+
+
+class SQLiteAuditSink:
+    """Audit records as rows of the `audit` table in a WAL-mode SQLite file"""
+
+    SYNCHRONOUS = {"always": "FULL", "interval": "NORMAL", "never": "OFF"}
+
+    def __init__(self, path: str, fsync: str = "interval"):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA synchronous={self.SYNCHRONOUS[fsync]}")
+        columns = ", ".join(RECORD_FIELDS)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS audit (id INTEGER PRIMARY KEY, {columns})")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS audit_ts ON audit(ts)")
+        self._insert = (f"INSERT INTO audit ({columns}) "
+                        f"VALUES ({', '.join('?' * len(RECORD_FIELDS))})")
+
+    def write(self, batch: Sequence[tuple]):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany(self._insert, batch)
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def sync(self):
+        # With synchronous=NORMAL the WAL is fsynced by checkpoints
+        self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        self.conn.close()
+
+    def describe(self) -> dict:
+        return {"type": "sqlite", "path": self.path}
+
+
+class JSONLAuditSink:
+    """
+    Audit records as JSON lines in `directory`, in segments named
+    audit-<pid>-<timestamp>-<n>.jsonl that rotate after `segment_bytes`.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024, fsync: str = "interval"):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.segments = 0
+        self._file = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self):
+        self.segments += 1
+        name = f"audit-{os.getpid()}-{time.strftime('%Y%m%dT%H%M%S')}-{self.segments}.jsonl"
+        self.path = os.path.join(self.directory, name)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, batch: Sequence[tuple]):
+        if self._file is None:
+            self._open()
+        self._file.write("".join(
+            json.dumps(dict(zip(RECORD_FIELDS, record)), ensure_ascii=False) + "\n" for record in batch
+        ))
+        self._file.flush()
+        if self._file.tell() >= self.segment_bytes:
+            self.close()
+
+    def sync(self):
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            if self.fsync != "never":
+                self.sync()
+            self._file.close()
+            self._file = None
+
+    def describe(self) -> dict:
+        return {"type": "jsonl", "directory": self.directory, "segments": self.segments}
+
+
+class AuditLog:
+    def __init__(self, sink=None, capacity: int = 65536, policy: str = "drop", batch_size: int = 512,
+                 flush_interval: float = 0.5, fsync: str = "interval", fsync_interval: float = 1.0,
+                 block_timeout: float = 1.0, spill_path: Optional[str] = None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown audit policy: {policy}")
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown audit fsync policy: {fsync}")
+        self.sink = sink
+        self.policy = policy
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.block_timeout = block_timeout
+        self.spill_path = spill_path
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.blocked = 0
+        self.failed = 0
+        self.batches = 0
+        self.syncs = 0
+        self._ring = RingBuffer(capacity)
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)     # writer: a batch is waiting
+        self._not_full = threading.Condition(self._lock)  # producers: room in the ring
+        self._spill_file = None
+        self._token = secrets.token_hex(4)  # names this instance's claims on spill files
+        _claim_tokens.add(self._token)
+        self._stopping = False
+        self._writer: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.sink is not None
+
+    def push(self, record: tuple) -> bool:
+        """Queue a record for writing; returns False if it was dropped"""
+        if self.sink is None:
+            return False
+        with self._lock:
+            ring = self._ring
+            if ring.full():
+                if self.policy == "spill":
+                    return self._spill(record)
+                if self.policy == "block":
+                    self.blocked += 1
+                    self._not_full.wait_for(lambda: not ring.full(), self.block_timeout)
+                if ring.full():
+                    self.dropped += 1
+                    return False
+            ring.push(record)
+            if len(ring) == self.batch_size:
+                self._ready.notify()
+            return True
+
+    async def push_async(self, record: tuple) -> bool:
+        """push() for async handlers: a blocking wait runs in the threadpool"""
+        if self.policy == "block" and self._ring.full():
+            from fastapi.concurrency import run_in_threadpool
+            return await run_in_threadpool(self.push, record)
+        return self.push(record)
+
+    def _spill(self, record: tuple) -> bool:
+        # Called with the lock held
+        try:
+            if self._spill_file is None:
+                self._spill_file = open(self.spill_path, "a", encoding="utf-8")
+            self._spill_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._spill_file.flush()
+        except OSError:
+            self.dropped += 1
+            return False
+        self.spilled += 1
+        return True
+
+    def _drain_spill(self):
+        """Feed spilled records back into the sink, once the ring is empty"""
+        draining = f"{self.spill_path}.draining"
+        with self._lock:
+            if len(self._ring) or self._spill_file is None:
+                return
+            self._spill_file.close()
+            self._spill_file = None
+            os.replace(self.spill_path, draining)
+        self._write_file(draining)
+
+    def _write_file(self, path: str):
+        """
+        Write the records of a spill file to the sink, then remove it. Lines
+        that cannot be decoded are counted as failed and skipped, so the file
+        is always removed and never replayed.
+        """
+        with open(path, encoding="utf-8") as f:
+            batch = []
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # torn last line of a crashed process
+                try:
+                    batch.append(tuple(json.loads(line)))
+                except (ValueError, TypeError) as e:
+                    self.failed += 1
+                    print(f"Audit spill line skipped in {path}: {e}")
+                    continue
+                if len(batch) == self.batch_size:
+                    self._write(batch)
+                    batch = []
+            if batch:
+                self._write(batch)
+        os.remove(path)
+
+    def _write(self, batch: List[tuple]):
+        try:
+            self.sink.write(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"Audit write failed, {len(batch)} records lost: {e}")
+            return
+        self.written += len(batch)
+        self.batches += 1
+        if self.fsync == "always":
+            self._sync()
+
+    def _sync(self):
+        try:
+            self.sink.sync()
+            self.syncs += 1
+        except Exception as e:
+            print(f"Audit fsync failed: {e}")
+
+    def _run(self):
+        last_sync = time.monotonic()
+        unsynced = False
+        while True:
+            with self._lock:
+                if not self._stopping and len(self._ring) < self.batch_size:
+                    self._ready.wait(self.flush_interval)
+                batch = self._ring.pop_batch(self.batch_size)
+                stopping = self._stopping
+                if batch:
+                    self._not_full.notify_all()
+            if batch:
+                self._write(batch)
+                unsynced = True
+            if self.spill_path is not None and self._spill_file is not None:
+                self._drain_spill()
+            now = time.monotonic()
+            if (self.fsync == "interval" and unsynced
+                    and (now - last_sync >= self.fsync_interval or stopping)):
+                self._sync()
+                last_sync, unsynced = now, False
+            if stopping and not batch and len(self._ring) == 0:
+                return
+
+    def _leftover_spills(self) -> List[str]:
+        """
+        Spill files of this pid and of workers that are no longer running,
+        oldest records first (.draining before the live file of the same pid)
+        """
+        directory, name = os.path.split(os.path.abspath(self.spill_path))
+        match = SPILL_NAME.match(name)
+        if match is None:
+            return [p for p in (f"{self.spill_path}.draining", self.spill_path) if os.path.exists(p)]
+        leftovers = []
+        for entry in os.listdir(directory):
+            found = SPILL_NAME.match(entry)
+            if found is None or found["prefix"] != match["prefix"]:
+                continue
+            owner = int(found["claimer"] or found["pid"])
+            if owner != os.getpid():
+                if _pid_alive(owner):
+                    continue  # a running worker's spill, or one it is recovering
+            elif found["token"] in _claim_tokens and found["token"] != self._token:
+                continue  # being recovered by another AuditLog of this process
+            order = 0 if entry.endswith(".draining") or found["claimer"] else 1
+            leftovers.append((int(found["pid"]), order, os.path.join(directory, entry)))
+        return [path for _, _, path in sorted(leftovers)]
+
+    def _recover_spills(self):
+        """
+        Write leftover spill files to the sink. Each one is first renamed to a
+        claim unique to this instance (pid and token); the rename is atomic, so
+        of several AuditLogs listing the same file only one writes it.
+        """
+        for path in self._leftover_spills():
+            claimed = f"{path.rsplit('.jsonl', 1)[0]}.jsonl.recovering-{os.getpid()}-{self._token}"
+            with self._lock:
+                if path == self.spill_path and self._spill_file is not None:
+                    continue  # spilled by this log before start: the writer drains it
+                try:
+                    os.rename(path, claimed)
+                except FileNotFoundError:
+                    continue  # claimed by another AuditLog first
+            self._write_file(claimed)
+
+    def start(self):
+        """Start the background writer (idempotent); leftover spill files are written first"""
+        if self.sink is None or (self._writer is not None and self._writer.is_alive()):
+            return
+        if self.spill_path is not None:
+            self._recover_spills()
+        self._stopping = False
+        self._writer = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._writer.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Flush what is buffered, then stop the writer and close the sink"""
+        if self._writer is None:
+            return
+        with self._lock:
+            self._stopping = True
+            self._ready.notify()
+        self._writer.join(timeout=timeout)
+        self._writer = None
+        if self.spill_path is not None and self._spill_file is not None:
+            self._drain_spill()
+        if self.fsync != "never":
+            self._sync()
+        self.sink.close()
+        _claim_tokens.discard(self._token)
+
+    def stats(self) -> dict:
+        with self._lock:
+            buffered = len(self._ring)
+        return {
+            "enabled": self.enabled,
+            "sink": self.sink.describe() if self.sink is not None else None,
+            "policy": self.policy,
+            "fsync": self.fsync,
+            "capacity": self._ring.capacity,
+            "buffered": buffered,
+            "written": self.written,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "blocked": self.blocked,
+            "failed": self.failed,
+            "batches": self.batches,
+            "syncs": self.syncs,
+        }
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        return True  # no harmless probe: only this pid's spill files are recovered
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def create_audit_log() -> AuditLog:
+    """
+    Build the audit log configured by the CODEX_AUDIT_* environment variables
+    (disabled unless CODEX_AUDIT is "sqlite" or "jsonl").
+    """
+    backend = os.environ.get("CODEX_AUDIT", "").lower()
+    path = os.environ.get("CODEX_AUDIT_PATH")
+    fsync = os.environ.get("CODEX_AUDIT_FSYNC", "interval")
+    if backend == "sqlite":
+        path = path or "codex_audit.db"
+        sink = SQLiteAuditSink(path, fsync)
+        spill_path = f"{path}.spill-{os.getpid()}.jsonl"
+    elif backend == "jsonl":
+        path = path or "audit"
+        sink = JSONLAuditSink(path, int(os.environ.get("CODEX_AUDIT_SEGMENT_BYTES", 64 * 1024 * 1024)), fsync)
+        spill_path = os.path.join(path, f"spill-{os.getpid()}.jsonl")
+    elif backend in ("", "0", "off", "none"):
+        return AuditLog()
+    else:
+        raise ValueError(f"Unknown audit backend: {backend}")
+    return AuditLog(
+        sink,
+        capacity=int(os.environ.get("CODEX_AUDIT_CAPACITY", 65536)),
+        policy=os.environ.get("CODEX_AUDIT_POLICY", "drop"),
+        batch_size=int(os.environ.get("CODEX_AUDIT_BATCH", 512)),
+        flush_interval=float(os.environ.get("CODEX_AUDIT_FLUSH_SECONDS", 0.5)),
+        fsync=fsync,
+        fsync_interval=float(os.environ.get("CODEX_AUDIT_FSYNC_SECONDS", 1.0)),
+        block_timeout=float(os.environ.get("CODEX_AUDIT_BLOCK_SECONDS", 1.0)),
+        spill_path=spill_path,
+    )
+
+
+audit_log = create_audit_log()
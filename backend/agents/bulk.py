@@ -0,0 +1,420 @@
+"""
+Streaming bulk scoring of patient files.
+
+Records are read from CSV or JSONL in chunks, mapped onto the PatientData
+fields and scored by both agents with their batch entry points (one matrix
+product for the deterministic scores, one table lookup for the posteriors per
+chunk). Chunks can be spread over worker processes; at most `2 * processes`
+chunks are in flight and results are emitted in input order, so memory stays
+constant whatever the size of the file.
+
+Every result carries the 0-based `index` of its input record. A run that was
+interrupted can be resumed by starting at the index after the last one written
+(`resume_offset` reads it back from a partial output file).
+
+CLI:
+    python -m backend.agents.bulk consultas.csv -o resultados.ndjson --processes 4
+    python -m backend.agents.bulk consultas.csv -o resultados.ndjson --resume
+"""
+
+import argparse
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from backend.agents.deterministic import run_deterministic_batch
+from backend.agents.probabilistic import VERSION_MODELO, run_probabilistic_batch
+
+# PatientData fields and their types; fields without a default are required
+FIELD_TYPES = {
+    "fiebre": bool, "temperatura": float, "tos": bool, "dolor_garganta": bool,
+    "dolor_retroocular": bool, "mialgia": bool, "anosmia": bool, "asma": bool,
+    "hipertension": bool, "viaje_brasil": bool, "contacto_dengue": bool,
+    "lugar": str, "estacion": str, "dolor_abdominal_intenso": bool,
+    "sangrado_mucosas": bool, "disnea": bool, "language": str,
+}
+DEFAULTS = {
+    "temperatura": None, "dolor_retroocular": False, "mialgia": False, "anosmia": False,
+    "dolor_abdominal_intenso": False, "sangrado_mucosas": False, "disnea": False,
+}
+TRUE_VALUES = {"1", "true", "t", "yes", "y", "si", "sí", "s", "x"}
+FALSE_VALUES = {"0", "false", "f", "no", "n"}
+_BOOLEANS = dict.fromkeys(TRUE_VALUES, True) | dict.fromkeys(FALSE_VALUES, False)
+REQUIRED = [f for f in FIELD_TYPES if f not in DEFAULTS and f != "language"]
+
+INPUT_FORMATS = ("csv", "jsonl")
+OUTPUT_FORMATS = ("ndjson", "csv")
+CSV_COLUMNS = [
+    "index", "error", "codigo", "clasificacion", "accion",
+    "dengue_probability", "covid_probability", "both_probability",
+    "kb_version", "model_version",
+]
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def parse_mapping(pairs: Iterable[str]) -> Dict[str, str]:
+    """["columna=campo", ...] -> {columna: campo}; unknown fields raise ValueError"""
+    mapping = {}
+    for pair in pairs or ():
+        column, sep, field = pair.partition("=")
+        if not sep:
+            column, sep, field = pair.partition(":")
+        if not sep or field not in FIELD_TYPES:
+            raise ValueError(f"Invalid column mapping {pair!r} (expected column=field)")
+        mapping[column] = field
+    return mapping
+
+
+def _coerce(field: str, value):
+    if value is None or value == "":
+        if field in REQUIRED:
+            raise ValueError(f"{field}: missing value")
+        return DEFAULTS.get(field)
+    kind = FIELD_TYPES[field]
+    if kind is bool:
+        if value is True or value is False:
+            return value
+        if isinstance(value, (int, float)) and value in (0, 1):
+            return bool(value)
+        parsed = _BOOLEANS.get(str(value).strip().lower())
+        if parsed is None:
+            raise ValueError(f"{field}: not a boolean: {value!r}")
+        return parsed
+    if kind is float:
+        if isinstance(value, str):
+            value = value.strip().replace(",", ".")
+        return float(value)
+    return str(value).strip()
+
+
+def _columns(record: dict, mapping: Dict[str, str], plans: dict) -> list:
+    # (column, field) pairs for the keys of `record`, resolved once per header
+    keys = tuple(record)
+    plan = plans.get(keys)
+    if plan is None:
+        plan = plans[keys] = [
+            (column, mapping.get(column, column)) for column in keys
+            if mapping.get(column, column) in FIELD_TYPES
+        ]
+    return plan
+
+
+def coerce_patient(raw: dict, mapping: Optional[Dict[str, str]] = None,
+                   plans: Optional[dict] = None) -> dict:
+    """
+    Patient dict with the PatientData fields from one input record. Columns are
+    renamed with `mapping`, unmapped columns that are not PatientData fields are
+    ignored. Empty values of optional fields take their default. Raises
+    ValueError for missing required fields or invalid values.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("Record is not an object")
+    patient = {
+        field: _coerce(field, raw[column])
+        for column, field in _columns(raw, mapping or {}, {} if plans is None else plans)
+    }
+    missing = [f for f in REQUIRED if f not in patient]
+    if missing:
+        raise ValueError(f"Missing fields: {', '.join(missing)}")
+    for field, default in DEFAULTS.items():
+        patient.setdefault(field, default)
+    return patient
+
+
+def read_records(stream: TextIO, fmt: str = "csv") -> Iterator:
+    """Raw records from a text stream, one at a time"""
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "jsonl":
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                # Reported as an error row, the stream goes on
+                yield ValueError(f"Invalid JSON: {e}")
+    else:
+        raise ValueError(f"Unknown input format {fmt!r} (expected one of {INPUT_FORMATS})")
+
+
+def score_chunk(start: int, records: list, mapping: Dict[str, str], lang: str = "es",
+                trace_format: str = "none") -> List[dict]:
+    """Results of one chunk whose first record has index `start`"""
+    results = [None] * len(records)
+    indices, patients, plans = [], [], {}
+    for i, raw in enumerate(records):
+        try:
+            if isinstance(raw, Exception):
+                raise raw
+            patients.append(coerce_patient(raw, mapping, plans))
+            indices.append(i)
+        except (ValueError, TypeError) as e:
+            results[i] = {"index": start + i, "error": str(e)}
+
+    if patients:
+        try:
+            det_results = run_deterministic_batch(patients, lang, trace_format)
+        except Exception as e:
+            det_results = [{"error": str(e)}] * len(patients)
+        try:
+            prob_results = run_probabilistic_batch(patients, lang, trace_format)
+        except Exception as e:
+            prob_results = [{"error": str(e)}] * len(patients)
+        for i, det_result, prob_result in zip(indices, det_results, prob_results):
+            results[i] = {
+                "index": start + i,
+                "deterministic": det_result,
+                "probabilistic": prob_result,
+            }
+    return results
+
+
+def _load_models():
+    """Initializer of worker processes: importing the agents loads their models once"""
+    import backend.agents.deterministic  # noqa: F401
+    import backend.agents.probabilistic  # noqa: F401
+
+
+class Progress:
+    """Rows scored so far and throughput of one bulk job"""
+
+    def __init__(self, start: int = 0):
+        self.start = start
+        self.rows = 0
+        self.errors = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.reported = 0.0  # monotonic time of the last progress report
+
+    @property
+    def next_index(self) -> int:
+        return self.start + self.rows
+
+    def rows_per_second(self) -> float:
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            "start": self.start,
+            "rows": self.rows,
+            "errors": self.errors,
+            "next_index": self.next_index,
+            "rows_per_second": round(self.rows_per_second(), 1),
+            "running": self.finished is None,
+        }
+
+
+# Jobs currently streaming, reported on /diagnose/stats
+_active_jobs: List[Progress] = []
+_jobs_lock = threading.Lock()
+
+
+def active_jobs() -> List[dict]:
+    with _jobs_lock:
+        return [job.snapshot() for job in _active_jobs]
+
+
+def score_records(records: Iterable, mapping: Optional[Dict[str, str]] = None, lang: str = "es",
+                  trace_format: str = "none", chunk_size: int = DEFAULT_CHUNK_SIZE,
+                  processes: int = 0, start: int = 0, progress: Optional[Progress] = None,
+                  on_chunk: Optional[Callable[[Progress], None]] = None) -> Iterator[dict]:
+    """
+    Score `records` chunk by chunk and yield one result per record, in order.
+    The first `start` records are skipped (resume). With `processes > 0` chunks
+    are scored in that many worker processes.
+    """
+    mapping = mapping or {}
+    progress = progress or Progress(start)
+    records = itertools.islice(iter(records), start, None)
+
+    def chunks():
+        offset = start
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if not chunk:
+                return
+            yield offset, chunk
+            offset += len(chunk)
+
+    def emit(results):
+        progress.rows += len(results)
+        progress.errors += sum(1 for r in results if "error" in r)
+        yield from results
+        if on_chunk:
+            on_chunk(progress)
+
+    with _jobs_lock:
+        _active_jobs.append(progress)
+    try:
+        if processes <= 0:
+            for offset, chunk in chunks():
+                yield from emit(score_chunk(offset, chunk, mapping, lang, trace_format))
+        else:
+            with ProcessPoolExecutor(max_workers=processes,
+                                     mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_load_models) as executor:
+                pending = deque()
+                for offset, chunk in chunks():
+                    pending.append(executor.submit(score_chunk, offset, chunk, mapping, lang, trace_format))
+                    if len(pending) >= 2 * processes:
+                        yield from emit(pending.popleft().result())
+                while pending:
+                    yield from emit(pending.popleft().result())
+    finally:
+        progress.finished = time.monotonic()
+        with _jobs_lock:
+            _active_jobs.remove(progress)
+
+
+def flatten(result: dict) -> dict:
+    """One CSV row (CSV_COLUMNS) from a result"""
+    det = result.get("deterministic") or {}
+    prob = result.get("probabilistic") or {}
+    errors = [e for e in (result.get("error"), det.get("error"), prob.get("error")) if e]
+    return {
+        "index": result["index"],
+        "error": "; ".join(errors),
+        "codigo": det.get("codigo", ""),
+        "clasificacion": det.get("clasificacion", ""),
+        "accion": det.get("accion", ""),
+        "dengue_probability": prob.get("dengue_probability", ""),
+        "covid_probability": prob.get("covid_probability", ""),
+        "both_probability": prob.get("both_probability", ""),
+        "kb_version": det.get("kb_version", ""),
+        "model_version": VERSION_MODELO if prob and "error" not in prob else "",
+    }
+
+
+def render(results: Iterable[dict], fmt: str = "ndjson", header: bool = True) -> Iterator[str]:
+    """Serialize results one line at a time"""
+    if fmt == "ndjson":
+        for result in results:
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+    elif fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS, lineterminator="\n")
+        if header:
+            writer.writeheader()
+        for result in results:
+            writer.writerow(flatten(result))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        raise ValueError(f"Unknown output format {fmt!r} (expected one of {OUTPUT_FORMATS})")
+
+
+def resume_offset(path: str, fmt: str = "ndjson") -> int:
+    """
+    Index of the first record missing from a partial output file (0 if the
+    file does not exist). A trailing incomplete line left by an interrupted
+    run is truncated so the file can be appended to.
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        # Read backwards until the last complete line is found
+        block, tail = 4096, b""
+        position = size
+        while position > 0:
+            step = min(block, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+            if tail.count(b"\n") >= 2 or (position == 0 and b"\n" in tail):
+                break
+        end = tail.rfind(b"\n")
+        if end < 0:
+            f.truncate(0)
+            return 0
+        if end != len(tail) - 1:
+            f.truncate(position + end + 1)
+        last = tail[:end].rsplit(b"\n", 1)[-1].decode("utf-8")
+    if fmt == "ndjson":
+        return json.loads(last)["index"] + 1
+    first = next(csv.reader([last]))[0]
+    return int(first) + 1 if first != "index" else 0
+
+
+def _report(progress: Progress, interval: float = 1.0):
+    # At most once per `interval` seconds; interval=0 forces the final report
+    now = time.monotonic()
+    if now - progress.reported < interval:
+        return
+    progress.reported = now
+    print(f"\r{progress.rows} rows ({progress.errors} errors), "
+          f"{progress.rows_per_second():,.0f} rows/s, next index {progress.next_index}",
+          end="", file=sys.stderr, flush=True)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Score a CSV/JSONL file of patients with both agents")
+    parser.add_argument("input", help="input file, or - for stdin")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    parser.add_argument("--input-format", choices=INPUT_FORMATS,
+                        help="default: from the file extension, csv otherwise")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS,
+                        help="default: from the output extension, ndjson otherwise")
+    parser.add_argument("--map", action="append", default=[], metavar="COLUMN=FIELD",
+                        help="map an input column to a PatientData field (repeatable)")
+    parser.add_argument("--language", default="es", choices=("es", "en"))
+    parser.add_argument("--trace-format", default="none", choices=("none", "text", "structured"))
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--processes", type=int, default=0, help="worker processes (0: in process)")
+    parser.add_argument("--start", type=int, default=0, help="index of the first record to score")
+    parser.add_argument("--resume", action="store_true",
+                        help="append to --output, starting after the last record it contains")
+    parser.add_argument("--quiet", action="store_true", help="no progress on stderr")
+    args = parser.parse_args(argv)
+
+    input_format = args.input_format or ("jsonl" if args.input.endswith((".jsonl", ".ndjson")) else "csv")
+    output_format = args.output_format or (
+        "csv" if args.output and args.output.endswith(".csv") else "ndjson")
+    mapping = parse_mapping(args.map)
+
+    start, append = args.start, False
+    if args.resume:
+        if not args.output:
+            parser.error("--resume needs --output")
+        start = max(start, resume_offset(args.output, output_format))
+        append = start > 0 and os.path.exists(args.output)
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8-sig", newline="")
+    target = (open(args.output, "a" if append else "w", encoding="utf-8", newline="")
+              if args.output else sys.stdout)
+    progress = Progress(start)
+    try:
+        results = score_records(
+            read_records(source, input_format), mapping, args.language, args.trace_format,
+            args.chunk_size, args.processes, start, progress,
+            on_chunk=None if args.quiet else _report,
+        )
+        for line in render(results, output_format, header=not append):
+            target.write(line)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+    if not args.quiet:
+        _report(progress, interval=0)
+        print(file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,20 @@
-from typing import Dict, Optional, List
+from functools import lru_cache
+from typing import NamedTuple, Optional, List, Tuple
 from uuid import uuid4
 import json
 import os
+import time
 
-# Session storage (in production, use Redis or DB)
-sessions: Dict[str, dict] = {}
+from backend.agents.aggregates import aggregates
+from backend.agents.audit import audit_log, diagnosis_record
+from backend.agents.knowledge_base import get_kb
+from backend.agents.metrics import CHAT_STEP_SECONDS, timed
+from backend.agents.deterministic import puntaje_en_curso
+from backend.agents.probabilistic import (
+    NODO_DE_CAMPO, POTENCIA_NODO, enfermedad_decidida, ganancias_parciales,
+    posterior_parcial, valor_nodo
+)
+from backend.agents.session_store import create_session_store
 
 # Translations for questions
 TRANSLATIONS = {
@@ -78,31 +88,20 @@ DESC_TRANSLATIONS = {
     }
 }
 
-# Load Knowledge Base
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-KB_PATH = os.path.join(BASE_DIR, 'data', 'reglas_infectologia.json')
-
-def load_kb():
-    try:
-        with open(KB_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Error loading KB: {e}")
-        return {}
-
-KB = load_kb()
-
-def get_dynamic_questions(lang="es"):
-    """Generate questions from JSON descriptions"""
+def get_dynamic_questions(lang="es", kb=None):
+    """Generate questions from JSON descriptions (of `kb`, default the current KB)"""
     t = TRANSLATIONS[lang]
     desc_t = DESC_TRANSLATIONS[lang]
     questions = []
+    if kb is None:
+        kb = get_kb().data
     
     # 1. Differential Diagnosis Questions (Dynamic)
-    if KB and 'reglas_diagnostico_diferencial' in KB:
-        for regla in KB['reglas_diagnostico_diferencial']:
-            # Skip nexo_dengue as it's derived from specific questions
-            if regla['sintoma'] == 'nexo_dengue':
+    if kb and 'reglas_diagnostico_diferencial' in kb:
+        for regla in kb['reglas_diagnostico_diferencial']:
+            # Skip nexo_dengue as it's derived from specific questions, and
+            # compound conditions, which combine facts asked elsewhere
+            if regla['sintoma'] == 'nexo_dengue' or not isinstance(regla['sintoma'], str):
                 continue
             
             # Translate description
@@ -144,7 +143,7 @@ def get_static_start(lang="es"):
             "question": t["temperature"],
             "type": "number",
             "options": None,
-            "condition": lambda data: data.get("fiebre", False)
+            "requires": "fiebre"  # Only asked if this boolean answer is true
         }
     ]
 
@@ -212,141 +211,419 @@ def get_static_context(lang="es"):
         }
     ]
 
-def get_question_flow(lang="es"):
+def get_question_flow(lang="es", kb=None):
     """Build the full question flow for a specific language"""
     return (get_static_start(lang) + 
-            get_dynamic_questions(lang) + 
+            get_dynamic_questions(lang, kb) + 
             get_static_alarms(lang) + 
             get_static_context(lang))
 
-def create_session(lang="es") -> str:
-    """Create a new chat session"""
+class Question(NamedTuple):
+    id: str
+    question: str
+    type: str
+    options: Optional[Tuple[str, ...]]
+    requires: Optional[str] = None
+
+class FlowUnavailable(LookupError):
+    """The question flow of a KB version that is no longer loaded"""
+
+@lru_cache(maxsize=16)
+def _compile_flow(lang: str, kb_version: str) -> Tuple[Question, ...]:
+    """
+    Flow of `lang` at `kb_version`. Only the current KB can be compiled, so an
+    older version is available only while its flow is still cached.
+    """
+    snapshot = get_kb()
+    if snapshot.version != kb_version:
+        raise FlowUnavailable(f"Question flow of KB version {kb_version} is no longer available")
+    return tuple(
+        Question(
+            id=q["id"],
+            question=q["question"],
+            type=q["type"],
+            options=tuple(q["options"]) if q["options"] is not None else None,
+            requires=q.get("requires"),
+        )
+        for q in get_question_flow(lang, snapshot.data)
+    )
+
+def get_flow_template(lang="es") -> Tuple[Question, ...]:
+    """
+    Immutable question flow shared by every session of a language. It is
+    compiled once per language and KB version instead of once per session.
+    Returns (kb_version, flow).
+    """
+    while True:
+        version = get_kb().version
+        try:
+            return version, _compile_flow(lang, version)
+        except FlowUnavailable:
+            continue  # The KB was reloaded in between
+
+# Question ordering. "fixed" asks the flow in order. "adaptive" asks the start
+# and alarm questions first (alarms are always asked), then the questions that
+# map to Bayesian network nodes by expected information gain on the
+# Dengue/COVID posterior given the answers so far, then the rest in flow order.
+CHAT_MODES = ("fixed", "adaptive")
+ALARM_IDS = ("dolor_abdominal_intenso", "sangrado_mucosas", "disnea")
+ADAPTIVE_FIRST = ("fiebre", "temperatura") + ALARM_IDS
+DEFAULT_CHAT_MODE = os.environ.get("CODEX_CHAT_MODE", "fixed")
+
+# Early termination (opt-in): the chat ends as soon as an alarm sign fires, or
+# once every alarm question is answered and the Bayesian posterior is decisive
+# for any answers to the questions left. Skipped findings count as absent.
+DEFAULT_EARLY_STOP = os.environ.get("CODEX_CHAT_EARLY_STOP", "0").lower() in ("1", "true", "yes")
+DECISIVE_THRESHOLD = float(os.environ.get("CODEX_CHAT_DECISIVE_THRESHOLD", 0.95))
+
+class AdaptivePlan(NamedTuple):
+    first: Tuple[int, ...]                # start and alarm questions, in flow order
+    network: Tuple[Tuple[int, str], ...]  # (flow index, network node)
+    rest: Tuple[int, ...]
+
+@lru_cache(maxsize=16)
+def _adaptive_plan(flow: Tuple[Question, ...]) -> AdaptivePlan:
+    first, network, rest = [], [], []
+    for i, question in enumerate(flow):
+        if question.id in ADAPTIVE_FIRST:
+            first.append(i)
+        elif question.id in NODO_DE_CAMPO:
+            network.append((i, NODO_DE_CAMPO[question.id]))
+        else:
+            rest.append(i)
+    return AdaptivePlan(tuple(first), tuple(network), tuple(rest))
+
+@lru_cache(maxsize=16)
+def _alarm_mask(flow: Tuple[Question, ...]) -> int:
+    """Bitmask of the flow indices of the alarm questions"""
+    return sum(1 << i for i, question in enumerate(flow) if question.id in ALARM_IDS)
+
+# Every field the chat can collect, in PatientData order
+ANSWER_FIELDS = (
+    "fiebre", "temperatura", "tos", "dolor_garganta", "dolor_retroocular",
+    "mialgia", "anosmia", "asma", "hipertension", "viaje_brasil",
+    "contacto_dengue", "lugar", "estacion", "dolor_abdominal_intenso",
+    "sangrado_mucosas", "disnea",
+)
+
+class Answers:
+    """Compact answer storage: one slot per field, None while unanswered"""
+    __slots__ = ANSWER_FIELDS
+
+    def __init__(self):
+        for field in ANSWER_FIELDS:
+            setattr(self, field, None)
+
+    def get(self, field, default=None):
+        value = getattr(self, field, None)
+        return default if value is None else value
+
+    def set(self, field, value):
+        setattr(self, field, value)
+
+# History entries: an int is the index of a question asked by the assistant,
+# a str is a user answer and RESULT_ENTRY is the final assistant message.
+RESULT_ENTRY = -1
+
+class ChatSession:
+    __slots__ = ("lang", "kb_version", "flow", "step", "answers", "history", "mode", "asked",
+                 "early_stop", "live")
+
+    def __init__(self, lang: str, kb_version: str, flow: Tuple[Question, ...], mode: str = "fixed",
+                 early_stop: bool = False):
+        self.lang = lang
+        self.kb_version = kb_version  # KB version the flow was compiled from
+        self.flow = flow  # Shared template, never copied per session
+        self.step = 0  # Flow index of the current question
+        self.answers = Answers()
+        self.history = []
+        self.mode = mode
+        self.asked = 0  # Bitmask of answered flow indices
+        self.early_stop = early_stop
+        # Partial evidence index of the answers so far, updated after each answer
+        self.live = None
+
+def encode_session(session: ChatSession) -> str:
+    """Serialize a session; the shared flow is referenced by language and KB version"""
+    return json.dumps({
+        "lang": session.lang,
+        "kb_version": session.kb_version,
+        "step": session.step,
+        "answers": [getattr(session.answers, field) for field in ANSWER_FIELDS],
+        "history": session.history,
+        "mode": session.mode,
+        "asked": session.asked,
+        "early_stop": session.early_stop,
+        "live": session.live,
+    }, ensure_ascii=False, separators=(",", ":"))
+
+def decode_session(raw: str) -> Optional[ChatSession]:
+    """
+    Rebuild a stored session on the flow it was created with. `step` and
+    `asked` are positions in that flow, so a session whose flow can no longer
+    be compiled (the KB was reloaded since, and this worker does not hold the
+    old flow) cannot resume: it is dropped and treated as not found.
+    """
+    state = json.loads(raw)
+    lang = state["lang"]
+    kb_version = state.get("kb_version") or get_kb().version
+    try:
+        flow = _compile_flow(lang, kb_version)
+    except FlowUnavailable:
+        print(f"Chat session dropped: its question flow (KB {kb_version}) is no longer available")
+        return None
+    session = ChatSession(lang, kb_version, flow, state.get("mode", "fixed"), state.get("early_stop", False))
+    session.step = state["step"]
+    session.asked = state.get("asked", 0)
+    live = state.get("live")
+    # Sessions stored before the live state was reduced to the partial index
+    session.live = live[-1] if isinstance(live, list) else live
+    for field, value in zip(ANSWER_FIELDS, state["answers"]):
+        setattr(session.answers, field, value)
+    session.history = state["history"]
+    return session
+
+# Session storage: bounded, with idle TTL and LRU eviction. The backend is
+# chosen with CODEX_SESSION_BACKEND; "sqlite" or "redis" let several uvicorn
+# workers serve the same chats.
+sessions = create_session_store(
+    encode_session, decode_session,
+    ttl_seconds=float(os.environ.get("CODEX_SESSION_TTL", 1800)),
+    max_sessions=int(os.environ.get("CODEX_MAX_SESSIONS", 10000)),
+    sweep_interval=float(os.environ.get("CODEX_SESSION_SWEEP_INTERVAL", 60)),
+)
+
+# Session store round trips of process_answer, timed when metrics are enabled
+_load_session = timed(CHAT_STEP_SECONDS, "load_session")(sessions.get)
+_save_session = timed(CHAT_STEP_SECONDS, "save_session")(sessions.put)
+
+def create_session(lang="es", mode=None, early_stop=None) -> str:
+    """
+    Create a new chat session. `mode` is one of CHAT_MODES (default
+    CODEX_CHAT_MODE); `early_stop` defaults to CODEX_CHAT_EARLY_STOP.
+    """
     session_id = str(uuid4())
-    sessions[session_id] = {
-        "current_step": 0,
-        "data": {},
-        "messages": [],
-        "lang": lang,
-        "question_flow": get_question_flow(lang)
-    }
+    mode = mode if mode in CHAT_MODES else DEFAULT_CHAT_MODE
+    early_stop = DEFAULT_EARLY_STOP if early_stop is None else bool(early_stop)
+    sessions.put(session_id, ChatSession(lang, *get_flow_template(lang), mode, early_stop))
     return session_id
 
+def _question_payload(question: Question) -> dict:
+    return {
+        "question": question.question,
+        "type": question.type,
+        "options": list(question.options) if question.options is not None else None,
+        "question_id": question.id
+    }
+
+def _pending(session: ChatSession, index: int) -> bool:
+    """Question not answered yet and its requirement, if any, met"""
+    question = session.flow[index]
+    return (not session.asked >> index & 1 and
+            (question.requires is None or session.answers.get(question.requires, False)))
+
+@timed(CHAT_STEP_SECONDS, "next_question")
+def _advance_adaptive(session: ChatSession) -> Optional[Question]:
+    flow = session.flow
+    if session.step < len(flow) and _pending(session, session.step):
+        return flow[session.step]
+    plan = _adaptive_plan(flow)
+    step = next((i for i in plan.first if _pending(session, i)), None)
+    if step is None:
+        candidates = [(i, node) for i, node in plan.network if _pending(session, i)]
+        if candidates:
+            # Gains come from a table precomputed over every partial answer state
+            gains = ganancias_parciales(session.answers, session.live)
+            step = max(candidates, key=lambda c: gains.get(c[1], -1.0))[0]
+    if step is None:
+        step = next((i for i in plan.rest if _pending(session, i)), None)
+    if step is None:
+        return None
+    session.step = step
+    return flow[step]
+
+def _advance(session: ChatSession) -> Optional[Question]:
+    """Move past questions whose requirement is not met; return the current one"""
+    if session.history and session.history[-1] == RESULT_ENTRY:
+        return None  # Finished, possibly before the end of the flow
+    if session.mode == "adaptive":
+        return _advance_adaptive(session)
+    flow = session.flow
+    while session.step < len(flow):
+        question = flow[session.step]
+        if question.requires is None or session.answers.get(question.requires, False):
+            return question
+        # Skip this question, move to next
+        session.step += 1
+    return None  # No more questions
+
 def get_next_question(session_id: str) -> Optional[dict]:
     """Get the next question based on current state"""
-    if session_id not in sessions:
+    session = sessions.get(session_id)
+    if session is None:
         return None
     
-    session = sessions[session_id]
-    question_flow = session["question_flow"]
-    current_step = session["current_step"]
-    
-    # Check if we've finished all questions
-    if current_step >= len(question_flow):
-        return None
-    
-    # Get next question, skip if condition not met
-    while current_step < len(question_flow):
-        question = question_flow[current_step]
-        condition = question.get("condition")
-        
-        if condition is None or condition(session["data"]):
-            return {
-                "question": question["question"],
-                "type": question["type"],
-                "options": question["options"],
-                "question_id": question["id"]
-            }
-        
-        # Skip this question, move to next
-        session["current_step"] += 1
-        current_step += 1
-    
-    return None  # No more questions
+    step = session.step
+    question = _advance(session)
+    if session.step != step:
+        sessions.put(session_id, session)
+    return _question_payload(question) if question is not None else None
 
+def _complete_data(answers: Answers) -> dict:
+    """Patient data for the agents; unanswered questions take their defaults"""
+    return {
+        "fiebre": answers.get("fiebre", False),
+        "temperatura": answers.get("temperatura"),
+        "tos": answers.get("tos", False),
+        "dolor_garganta": answers.get("dolor_garganta", False),
+        "dolor_retroocular": answers.get("dolor_retroocular", False),
+        "mialgia": answers.get("mialgia", False),
+        "anosmia": answers.get("anosmia", False),
+        "asma": answers.get("asma", False),
+        "hipertension": answers.get("hipertension", False),
+        "viaje_brasil": answers.get("viaje_brasil", False),
+        "contacto_dengue": answers.get("contacto_dengue", False),
+        "lugar": answers.get("lugar", "Otro"),
+        "estacion": answers.get("estacion", "Verano"),
+        "dolor_abdominal_intenso": answers.get("dolor_abdominal_intenso", False),
+        "sangrado_mucosas": answers.get("sangrado_mucosas", False),
+        "disnea": answers.get("disnea", False)
+    }
+
+@timed(CHAT_STEP_SECONDS, "live_update")
+def _update_live(session: ChatSession, question_id: str) -> dict:
+    """
+    Fold the latest answer into the live feedback. The rule scores are one
+    dot product of the condition vector with the KB weights, and the
+    posterior is read from the partial evidence table, whose index moves by
+    one digit per answered network node.
+    """
+    scores = puntaje_en_curso(_complete_data(session.answers))
+    index = session.live or 0
+    node = NODO_DE_CAMPO.get(question_id)
+    if node is not None:
+        index += (valor_nodo(node, session.answers.get(question_id)) + 1) * POTENCIA_NODO[node]
+    session.live = index
+
+    dengue, covid, both = posterior_parcial(index)
+    return {
+        "dengue_probability": round(dengue * 100, 2),
+        "covid_probability": round(covid * 100, 2),
+        "both_probability": round(both * 100, 2),
+        "score_dengue": scores["score_dengue"],
+        "score_covid": scores["score_covid"],
+        "alarm": scores["alarma"],
+    }
+
+def _stop_reason(session: ChatSession, live: dict) -> Optional[str]:
+    """Why the chat can end now ("alarm" or "decisive"), or None"""
+    if live["alarm"]:
+        return "alarm"
+    alarms = _alarm_mask(session.flow)
+    if session.asked & alarms == alarms and enfermedad_decidida(session.live, DECISIVE_THRESHOLD):
+        return "decisive"
+    return None
+
+@timed(CHAT_STEP_SECONDS, "diagnosis")
+def _diagnose(complete_data: dict, lang: str) -> dict:
+    from backend.agents.pipeline import pipeline
+    started = time.perf_counter()
+    timings = {}
+    diagnosis = pipeline.diagnose_sync(complete_data, lang, timings=timings)
+    aggregates.observe(complete_data, diagnosis)
+    if audit_log.enabled:
+        audit_log.push(diagnosis_record(
+            "chat", complete_data, diagnosis, timings, time.perf_counter() - started
+        ))
+    return diagnosis
+
+@timed(CHAT_STEP_SECONDS, "process_answer")
 def process_answer(session_id: str, answer: str) -> dict:
     """Process user answer and return next question or diagnosis"""
-    if session_id not in sessions:
+    session = _load_session(session_id)
+    if session is None:
         return {"error": "Session not found"}
-    
-    session = sessions[session_id]
-    question_flow = session["question_flow"]
-    current_question = question_flow[session["current_step"]]
+    result = apply_answer(session, answer)
+    if "error" not in result:
+        _save_session(session_id, session)
+    return result
+
+def apply_answer(session: ChatSession, answer: str) -> dict:
+    """
+    Record an answer on a session object and return the next question or the
+    diagnosis. Does not touch the session store, so a caller holding the
+    session (the WebSocket handler) can skip the load. May raise Overloaded,
+    in which case the session is left as it was.
+    """
+    current_question = _advance(session)
+    if current_question is None:
+        return {"error": "Session already completed"}
+    question_step = session.step
+    asked, live_before = session.asked, session.live
     
     # Store the answer
-    question_id = current_question["id"]
+    question_id = current_question.id
+    answers = session.answers
     
     # Convert answer to appropriate type
-    if current_question["type"] == "boolean":
-        session["data"][question_id] = answer.lower() in ["sí", "si", "yes", "true", "1"]
-    elif current_question["type"] == "number":
+    if current_question.type == "boolean":
+        answers.set(question_id, answer.lower() in ["sí", "si", "yes", "true", "1"])
+    elif current_question.type == "number":
         try:
-            session["data"][question_id] = float(answer.replace(",", "."))
+            answers.set(question_id, float(answer.replace(",", ".")))
         except ValueError:
-            session["data"][question_id] = None
-    elif current_question["type"] == "choice":
+            answers.set(question_id, None)
+    elif current_question.type == "choice":
         if question_id == "lugar":
-            session["data"][question_id] = "Corrientes" if "corrientes" in answer.lower() else "Otro"
+            answers.set(question_id, "Corrientes" if "corrientes" in answer.lower() else "Otro")
         elif question_id == "estacion":
-            session["data"][question_id] = "Verano" if "verano" in answer.lower() else "Invierno"
+            answers.set(question_id, "Verano" if "verano" in answer.lower() else "Invierno")
     
-    # Add to message history
-    session["messages"].append({
-        "role": "user",
-        "content": answer
-    })
+    # Add to message history, sharing the option string when the answer is one
+    options = current_question.options or ()
+    session.history.append(options[options.index(answer)] if answer in options else answer)
     
     # Move to next question
-    session["current_step"] += 1
+    session.asked |= 1 << question_step
+    if session.mode != "adaptive":
+        session.step += 1
+    
+    # Update the running scores and posterior, and check for an early end
+    live = _update_live(session, question_id)
+    stop_reason = _stop_reason(session, live) if session.early_stop else None
     
     # Get next question
-    next_q = get_next_question(session_id)
+    next_question = _advance(session) if stop_reason is None else None
     
-    if next_q:
-        session["messages"].append({
-            "role": "assistant",
-            "content": next_q["question"],
-            "options": next_q.get("options")
-        })
+    if next_question is not None:
+        session.history.append(session.step)
         return {
-            "next_question": next_q,
-            "completed": False
+            "next_question": _question_payload(next_question),
+            "completed": False,
+            "live": live
         }
     else:
         # Diagnostic complete, run inference
-        from backend.agents.deterministic import run_deterministic_agent
-        from backend.agents.probabilistic import run_probabilistic_agent
+        from backend.agents.pipeline import Overloaded
         
-        # Ensure all 15 fields have defaults before diagnosis
-        complete_data = {
-            "fiebre": session["data"].get("fiebre", False),
-            "temperatura": session["data"].get("temperatura"),
-            "tos": session["data"].get("tos", False),
-            "dolor_garganta": session["data"].get("dolor_garganta", False),
-            "dolor_retroocular": session["data"].get("dolor_retroocular", False),
-            "mialgia": session["data"].get("mialgia", False),
-            "anosmia": session["data"].get("anosmia", False),
-            "asma": session["data"].get("asma", False),
-            "hipertension": session["data"].get("hipertension", False),
-            "viaje_brasil": session["data"].get("viaje_brasil", False),
-            "contacto_dengue": session["data"].get("contacto_dengue", False),
-            "lugar": session["data"].get("lugar", "Otro"),
-            "estacion": session["data"].get("estacion", "Verano"),
-            "dolor_abdominal_intenso": session["data"].get("dolor_abdominal_intenso", False),
-            "sangrado_mucosas": session["data"].get("sangrado_mucosas", False),
-            "disnea": session["data"].get("disnea", False)
-        }
+        complete_data = _complete_data(answers)
         
-        lang = session.get("lang", "es")
-        diagnosis_det = run_deterministic_agent(complete_data, lang)
-        diagnosis_prob = run_probabilistic_agent(complete_data, lang)
+        lang = session.lang
+        try:
+            diagnosis = _diagnose(complete_data, lang)
+        except Overloaded:
+            # Undo this answer so the client can resend it after Retry-After
+            session.step = question_step
+            session.asked, session.live = asked, live_before
+            session.history.pop()
+            raise
+        diagnosis_det = diagnosis["deterministic"]
+        diagnosis_prob = diagnosis["probabilistic"]
         
         t = TRANSLATIONS.get(lang, TRANSLATIONS["es"])
         result_message = t["evaluation_complete_detailed"]
         
-        session["messages"].append({
-            "role": "assistant",
-            "content": result_message.strip()
-        })
+        session.history.append(RESULT_ENTRY)
         
         return {
             "completed": True,
@@ -354,11 +631,37 @@ def process_answer(session_id: str, answer: str) -> dict:
                 "deterministic": diagnosis_det,
                 "probabilistic": diagnosis_prob
             },
-            "message": result_message.strip()
+            "message": result_message.strip(),
+            "live": live,
+            "early_stop": stop_reason
         }
 
 def get_session_messages(session_id: str) -> List[dict]:
     """Get all messages from a session"""
-    if session_id not in sessions:
+    session = sessions.get(session_id)
+    if session is None:
         return []
-    return sessions[session_id]["messages"]
+    return session_messages(session)
+
+def current_question(session: ChatSession) -> Optional[dict]:
+    """Payload of the question the session is waiting for, None once finished"""
+    question = _advance(session)
+    return _question_payload(question) if question is not None else None
+
+def session_messages(session: ChatSession) -> List[dict]:
+    """Message history of a session object"""
+    messages = []
+    for entry in session.history:
+        if isinstance(entry, str):
+            messages.append({"role": "user", "content": entry})
+        elif entry == RESULT_ENTRY:
+            t = TRANSLATIONS.get(session.lang, TRANSLATIONS["es"])
+            messages.append({"role": "assistant", "content": t["evaluation_complete_detailed"].strip()})
+        else:
+            question = session.flow[entry]
+            messages.append({
+                "role": "assistant",
+                "content": question.question,
+                "options": list(question.options) if question.options is not None else None
+            })
+    return messages
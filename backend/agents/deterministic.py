@@ -5,7 +5,14 @@ y Lógica de Puntuación Ponderada (COVIDENGUE Score).
 """
 
 import json
-import os
+from functools import lru_cache
+
+import numpy as np
+
+from backend.agents.knowledge_base import KB_PATH, get_kb
+from backend.agents.metrics import DETERMINISTIC_STAGE_SECONDS, timed
+from backend.agents.response_cache import ResponseCache, cache_size_from_env
+from backend.agents.rule_engine import CLASE_COVID, CLASE_DENGUE, obtener_reglas_compiladas
 
 # Translations for diagnostic messages
 TRANSLATIONS = {
@@ -91,13 +98,116 @@ SYMPTOM_NAMES = {
     }
 }
 
-# Ruta al archivo de conocimiento
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-KB_PATH = os.path.join(BASE_DIR, 'data', 'reglas_infectologia.json')
+# ====== TRAZA ESTRUCTURADA ======
+# El motor registra la traza como eventos (código, parámetros...) neutrales al
+# idioma. Sólo se redacta a texto si la respuesta lo pide, y cada línea
+# redactada queda en caché por idioma y versión de la KB.
+CAMPOS_EVENTO = {
+    "inicio": (),
+    "evaluando_alarmas": (),
+    "alarma": ("regla", "condicion"),
+    "calculando_scores": (),
+    "regla_diferencial": ("regla", "sintoma", "peso_covid", "peso_dengue"),
+    "fiebre": ("banda", "temperatura", "peso_dengue"),
+    "regla_contexto": ("regla", "condicion", "peso_covid", "peso_dengue"),
+    "scores_finales": ("dengue", "covid"),
+}
+
+PLANTILLAS_FIEBRE = {
+    "hiperpirexia": "hyperpyrexia",
+    "alta": "high_fever",
+    "baja": "low_fever",
+}
+
+def estructurar_traza(eventos):
+    """Convierte los eventos de la traza en diccionarios con campos nombrados."""
+    return [
+        {"evento": evento[0], **dict(zip(CAMPOS_EVENTO[evento[0]], evento[1:]))}
+        for evento in eventos
+    ]
+
+@lru_cache(maxsize=4096)
+def _renderizar_evento(evento, lang, reglas):
+    t = TRANSLATIONS.get(lang, TRANSLATIONS["es"])
+    nombres = SYMPTOM_NAMES.get(lang, SYMPTOM_NAMES["es"])
+    codigo = evento[0]
+
+    if codigo == "inicio":
+        return t["start"]
+    if codigo == "evaluando_alarmas":
+        return f"\n{t['evaluating_alarms']}"
+    if codigo == "alarma":
+        _, regla_id, condicion = evento
+        regla = reglas.por_id[regla_id]
+        # Get translated message if available
+        mensaje = regla.get(f'mensaje_{lang}', regla.get('mensaje'))
+        return f"  {t['alarm_activated']}: {nombres.get(condicion, condicion)} -> {mensaje}"
+    if codigo == "calculando_scores":
+        return f"\n{t['calculating_scores']}"
+    if codigo == "regla_diferencial":
+        _, _, sintoma, peso_covid, peso_dengue = evento
+        return f"  -> {nombres.get(sintoma, sintoma)}: COVID({peso_covid:+}) | Dengue({peso_dengue:+})"
+    if codigo == "fiebre":
+        _, banda, temp, peso = evento
+        return f"  -> {t[PLANTILLAS_FIEBRE[banda]].format(temp=temp, weight=peso)}"
+    if codigo == "regla_contexto":
+        _, regla_id, _, peso_covid, peso_dengue = evento
+        regla = reglas.por_id[regla_id]
+        # Get translated description if available
+        desc = regla.get(f'descripcion_{lang}', regla.get('descripcion'))
+        return f"  -> {desc}: COVID({peso_covid:+}) | Dengue({peso_dengue:+})"
+    if codigo == "scores_finales":
+        _, dengue, covid = evento
+        return f"\n{t['final_scores'].format(dengue=dengue, covid=covid)}"
+    return str(evento)
+
+def renderizar_traza(eventos, lang="es", reglas=None):
+    """Redacta la traza de eventos como texto legible en el idioma pedido."""
+    return "\n".join(_renderizar_evento(evento, lang, reglas) for evento in eventos)
+
+def con_temperatura(eventos, temperatura):
+    """Eventos de la traza con la temperatura del paciente en el evento de fiebre."""
+    return [
+        ("fiebre", evento[1], temperatura, evento[3]) if evento[0] == "fiebre" else evento
+        for evento in eventos
+    ]
+
+@timed(DETERMINISTIC_STAGE_SECONDS, "traza")
+def formatear_diagnostico(diagnostico, eventos, formato_traza="text", lang="es", reglas=None):
+    """
+    Copia del diagnóstico con la traza en el formato pedido: "text" la redacta
+    en `razonamiento`, "structured" la devuelve como lista en `traza` y "none"
+    la omite.
+    """
+    diagnostico = dict(diagnostico)
+    if formato_traza == "structured":
+        del diagnostico['razonamiento']
+        diagnostico['traza'] = estructurar_traza(eventos)
+    elif formato_traza == "none":
+        del diagnostico['razonamiento']
+    else:
+        diagnostico['razonamiento'] = renderizar_traza(eventos, lang, reglas)
+    return diagnostico
+
+# ====== CACHÉ DE DIAGNÓSTICOS ======
+# El diagnóstico depende sólo de las condiciones de la KB que se cumplen, de la
+# banda de fiebre y del idioma; la temperatura exacta sólo aparece en la traza.
+# Se guarda (diagnóstico, eventos) por esa clave canónica y la caché se vacía
+# sola cuando cambia la versión de la KB.
+cache_diagnosticos = ResponseCache(max_entries=cache_size_from_env())
 
 class AgenteDiagnosticoHibrido:
-    def __init__(self, ruta_kb=KB_PATH, lang="es"):
-        self.kb = self.cargar_conocimiento(ruta_kb)
+    def __init__(self, ruta_kb=KB_PATH, lang="es", kb=None, kb_version=None):
+        # La KB por defecto se comparte en caché a nivel de proceso y se recarga
+        # sola si el archivo cambia; otras rutas se leen explícitamente.
+        if kb is None and ruta_kb == KB_PATH:
+            snapshot = get_kb()
+            kb, kb_version = snapshot.data, snapshot.version
+        self.kb = kb if kb is not None else self.cargar_conocimiento(ruta_kb)
+        self.kb_version = kb_version
+        self.reglas = obtener_reglas_compiladas(self.kb, kb_version)
+        # (vector, temperatura, puntaje) precalculados en lote, ver run_deterministic_batch
+        self.puntaje = None
         self.lang = lang
         self.t = TRANSLATIONS.get(lang, TRANSLATIONS["es"])
         self.score_covid = 0
@@ -105,7 +215,8 @@ class AgenteDiagnosticoHibrido:
         self.evidencia = {}
         self.traza = []
 
-    def cargar_conocimiento(self, ruta):
+    @staticmethod
+    def cargar_conocimiento(ruta):
         try:
             with open(ruta, 'r', encoding='utf-8') as f:
                 return json.load(f)
@@ -113,6 +224,7 @@ class AgenteDiagnosticoHibrido:
             print(f"Error cargando KB: {e}")
             return {}
 
+    @timed(DETERMINISTIC_STAGE_SECONDS, "percibir")
     def percibir_paciente(self, datos_paciente):
         """
         Recibe un diccionario con los síntomas del paciente.
@@ -139,6 +251,18 @@ class AgenteDiagnosticoHibrido:
         # Zona endémica: Corrientes + Verano
         self.evidencia['zona_endemica'] = (lugar == 'Corrientes' and estacion == 'Verano')
         self.evidencia['corrientes_no_verano'] = (lugar == 'Corrientes' and estacion != 'Verano')
+
+        # Hechos base, para que la KB pueda combinarlos en condiciones compuestas
+        # ({"todas": [...]} / {"alguna": [...]}) sin tocar este mapeo
+        self.evidencia.update({
+            'fiebre': bool(datos_paciente.get('fiebre', False)),
+            'viaje_brasil': bool(datos_paciente.get('viaje_brasil', False)),
+            'contacto_dengue': bool(datos_paciente.get('contacto_dengue', False)),
+            'asma': bool(datos_paciente.get('asma', False)),
+            'hipertension': bool(datos_paciente.get('hipertension', False)),
+            'lugar_corrientes': lugar == 'Corrientes',
+            'estacion_verano': estacion == 'Verano',
+        })
         
         # Lógica difusa para fiebre
         # Si el frontend envía temperatura numérica, usarla; sino, asumir valores típicos
@@ -151,112 +275,272 @@ class AgenteDiagnosticoHibrido:
 
         self.score_covid = 0
         self.score_dengue = 0
-        self.traza = [self.t["start"]]
+        self.traza = [("inicio",)]
+
+    def temperatura(self):
+        """Temperatura para la lógica difusa (fiebre sin valor = fiebre alta típica)."""
+        temp = self.evidencia.get('fiebre_valor', 36.5)
+        # Si temp es None, usar default
+        return 38.5 if temp is None else temp
 
-    def inferir_diagnostico(self):
+    def clave_canonica(self, vector):
+        """
+        Codificación canónica del paciente: máscara de condiciones de la KB,
+        banda de fiebre e idioma.
+        """
+        reglas = self.reglas
+        banda = int(reglas.banda_fiebre(self.temperatura())) if reglas.aplica_fiebre else 0
+        return np.packbits(vector).tobytes(), banda, self.lang
+
+    @timed(DETERMINISTIC_STAGE_SECONDS, "inferir")
+    def inferir_diagnostico(self, formato_traza="text", solo_cache=False):
+        """
+        Ejecuta la inferencia. La traza se registra como eventos neutrales al
+        idioma y sólo se redacta si `formato_traza` es "text"; con "structured"
+        se devuelve la lista de eventos y con "none" se omite.
+        Con `solo_cache` devuelve None si el diagnóstico no está en caché.
+        """
+        reglas = self.reglas
+        entrada = clave = None
+        if self.puntaje is None:
+            vector = reglas.vector(self.evidencia)
+            if cache_diagnosticos.enabled and self.kb_version is not None:
+                clave = self.clave_canonica(vector)
+                entrada = cache_diagnosticos.get(clave, self.kb_version, count_miss=not solo_cache)
+
+        if entrada is None:
+            if solo_cache:
+                return None
+            if self.puntaje is None:
+                temp = self.temperatura()
+                puntaje = {k: v[0] for k, v in reglas.puntuar(vector, [temp]).items()}
+            else:
+                vector, temp, puntaje = self.puntaje
+            entrada = self.evaluar(vector, temp, puntaje)
+            if clave is not None:
+                cache_diagnosticos.put(clave, entrada, self.kb_version)
+
+        diagnostico, eventos = entrada
+        self.traza = con_temperatura(eventos, self.temperatura())
+        self.score_dengue, self.score_covid = self.traza[-1][1:]
+        return formatear_diagnostico(diagnostico, self.traza, formato_traza, self.lang, reglas)
+
+    @timed(DETERMINISTIC_STAGE_SECONDS, "alarmas")
+    def evaluar_alarmas(self, columnas, diagnostico):
+        """Registra las alarmas activadas y devuelve sus mensajes."""
+        reglas = self.reglas
+        alertas = []
+        self.traza.append(("evaluando_alarmas",))
+        for i in reglas.reglas_activas('alarmas', columnas):
+            regla = reglas.alarmas[i]
+            # Get translated message if available
+            mensaje = regla.get(f'mensaje_{self.lang}', regla.get('mensaje'))
+            alertas.append(mensaje)
+            # Get translated action if available
+            accion = regla.get(f'accion_{self.lang}', regla.get('accion'))
+            diagnostico['accion'] = accion
+            self.traza.append(("alarma", reglas.ids_alarmas[i], reglas.claves[reglas.cond_alarmas[i]]))
+        return alertas
+
+    @timed(DETERMINISTIC_STAGE_SECONDS, "diferencial")
+    def evaluar_diferencial(self, columnas):
+        reglas = self.reglas
+        self.traza.append(("calculando_scores",))
+        for i in reglas.reglas_activas('diferenciales', columnas):
+            regla = reglas.diferenciales[i]
+            self.traza.append(("regla_diferencial", reglas.ids_diferenciales[i],
+                               reglas.claves[reglas.cond_diferenciales[i]],
+                               regla['peso_covid'], regla['peso_dengue']))
+
+    @timed(DETERMINISTIC_STAGE_SECONDS, "fiebre")
+    def evaluar_fiebre(self, temp, indice_banda):
+        reglas = self.reglas
+        banda = reglas.bandas_fiebre[indice_banda]
+        peso_extra = int(reglas.peso_fiebre[indice_banda])
+        if banda in ('hiperpirexia', 'alta') or (banda == 'baja' and peso_extra > 0):
+            self.traza.append(("fiebre", banda, temp, peso_extra))
+
+    @timed(DETERMINISTIC_STAGE_SECONDS, "contexto")
+    def evaluar_contexto(self, columnas):
+        reglas = self.reglas
+        for i in reglas.reglas_activas('contexto', columnas):
+            regla = reglas.contexto[i]
+            self.traza.append(("regla_contexto", reglas.ids_contexto[i],
+                               reglas.claves[reglas.cond_contexto[i]],
+                               regla['peso_covid'], regla['peso_dengue']))
+
+    def evaluar(self, vector, temp, puntaje):
+        """
+        Aplica las reglas a partir del vector de condiciones y del puntaje ya
+        calculado. Devuelve (diagnóstico sin traza redactada, eventos). Cada
+        etapa recorre sólo las reglas indexadas bajo las condiciones verdaderas.
+        """
         diagnostico = {
             "clasificacion": self.t["indeterminate"],
             "justificacion": "",
             "accion": self.t["clinical_control"],
-            "razonamiento": ""
+            "razonamiento": "",
+            "kb_version": self.kb_version
         }
 
+        reglas = self.reglas
+        self.score_covid = int(puntaje["score_covid"])
+        self.score_dengue = int(puntaje["score_dengue"])
+
         # 1. Evaluación de Signos de Alarma (Reglas Deterministas de Alta Prioridad)
-        es_grave = False
-        alertas = []
-        
-        self.traza.append(f"\n{self.t['evaluating_alarms']}")
-        if self.kb:
-            for regla in self.kb.get('reglas_signos_alarma', []):
-                if self.evidencia.get(regla['condicion']) is True:
-                    # Get translated message if available
-                    mensaje = regla.get(f'mensaje_{self.lang}', regla.get('mensaje'))
-                    alertas.append(mensaje)
-                    # Get translated action if available
-                    accion = regla.get(f'accion_{self.lang}', regla.get('accion'))
-                    diagnostico['accion'] = accion
-                    es_grave = True
-                    # Translate condition name
-                    condition_name = SYMPTOM_NAMES.get(self.lang, SYMPTOM_NAMES["es"]).get(regla['condicion'], regla['condicion'])
-                    self.traza.append(f"  {self.t['alarm_activated']}: {condition_name} -> {mensaje}")
+        es_grave = bool(puntaje["grave"])
+        columnas = np.flatnonzero(vector)
+        alertas = self.evaluar_alarmas(columnas, diagnostico)
 
         # 2. Evaluación Diferencial (Reglas Ponderadas / Probabilísticas)
-        self.traza.append(f"\n{self.t['calculating_scores']}")
-        if self.kb:
-            for regla in self.kb.get('reglas_diagnostico_diferencial', []):
-                sintoma = regla['sintoma']
-                if self.evidencia.get(sintoma) is True:
-                    self.score_covid += regla['peso_covid']
-                    self.score_dengue += regla['peso_dengue']
-                    # Translate symptom name
-                    symptom_name = SYMPTOM_NAMES.get(self.lang, SYMPTOM_NAMES["es"]).get(sintoma, sintoma)
-                    self.traza.append(f"  -> {symptom_name}: COVID({regla['peso_covid']:+}) | Dengue({regla['peso_dengue']:+})")
-
-            # 3. Lógica Difusa para Fiebre
-            temp = self.evidencia.get('fiebre_valor', 36.5)
-            # Si temp es None, usar default
-            if temp is None:
-                temp = 38.5  # Fiebre alta típica
-            logica_fiebre = self.kb.get('logica_difusa_fiebre', {})
-            
-            if temp >= logica_fiebre.get('hiperpirexia', {}).get('min', 39.6):
-                peso_extra = logica_fiebre['hiperpirexia']['peso_extra_dengue']
-                self.score_dengue += peso_extra
-                self.traza.append(f"  -> {self.t['hyperpyrexia'].format(temp=temp, weight=peso_extra)}")
-            elif temp >= logica_fiebre.get('alta', {}).get('min', 38.0):
-                peso_extra = logica_fiebre['alta']['peso_extra_dengue']
-                self.score_dengue += peso_extra
-                self.traza.append(f"  -> {self.t['high_fever'].format(temp=temp, weight=peso_extra)}")
-            elif temp >= logica_fiebre.get('baja', {}).get('min', 37.0):
-                peso_extra = logica_fiebre['baja']['peso_extra_dengue']
-                if peso_extra > 0:
-                    self.score_dengue += peso_extra
-                    self.traza.append(f"  -> {self.t['low_fever'].format(temp=temp, weight=peso_extra)}")
-            
-            # 4. Evaluación de Contexto Epidemiológico
-            for regla in self.kb.get('reglas_contexto_epidemiologico', []):
-                condicion = regla['condicion']
-                if self.evidencia.get(condicion) is True:
-                    self.score_covid += regla['peso_covid']
-                    self.score_dengue += regla['peso_dengue']
-                    # Get translated description if available
-                    desc = regla.get(f'descripcion_{self.lang}', regla.get('descripcion'))
-                    self.traza.append(f"  -> {desc}: COVID({regla['peso_covid']:+}) | Dengue({regla['peso_dengue']:+})")
-
-        self.traza.append(f"\n{self.t['final_scores'].format(dengue=self.score_dengue, covid=self.score_covid)}")
+        self.evaluar_diferencial(columnas)
+
+        # 3. Lógica Difusa para Fiebre
+        self.evaluar_fiebre(temp, int(puntaje["banda_fiebre"]))
+
+        # 4. Evaluación de Contexto Epidemiológico
+        self.evaluar_contexto(columnas)
+
+        self.traza.append(("scores_finales", self.score_dengue, self.score_covid))
 
         # 4. Conclusión Final
         if es_grave:
             # Determinar la enfermedad base aunque sea caso grave
             if self.score_dengue > self.score_covid:
                 enfermedad_base = "DENGUE"
+                diagnostico['codigo'] = "GRAVE_DENGUE"
             elif self.score_covid > self.score_dengue:
                 enfermedad_base = "COVID-19"
+                diagnostico['codigo'] = "GRAVE_COVID"
             else:
                 enfermedad_base = self.t["dengue_covid_indeterminate"]
+                diagnostico['codigo'] = "GRAVE_INDETERMINADO"
             
             diagnostico['clasificacion'] = self.t["severe_case"].format(disease=enfermedad_base)
             diagnostico['justificacion'] = f"{self.t['medical_emergency']} - {' '.join(alertas)} {self.t['scores'].format(dengue=self.score_dengue, covid=self.score_covid)}"
-        elif self.score_dengue > self.score_covid + 3:
+        elif puntaje["clase"] == CLASE_DENGUE:
             diagnostico['clasificacion'] = self.t["high_probability_dengue"]
+            diagnostico['codigo'] = "DENGUE"
             diagnostico['justificacion'] = self.t["dengue_justification"].format(dengue=self.score_dengue, covid=self.score_covid)
             diagnostico['accion'] = self.t["dengue_action"]
-        elif self.score_covid > self.score_dengue + 3:
+        elif puntaje["clase"] == CLASE_COVID:
             diagnostico['clasificacion'] = self.t["high_probability_covid"]
+            diagnostico['codigo'] = "COVID"
             diagnostico['justificacion'] = self.t["covid_justification"].format(covid=self.score_covid, dengue=self.score_dengue)
             diagnostico['accion'] = self.t["covid_action"]
         else:
             diagnostico['clasificacion'] = self.t["dual_suspicion"]
+            diagnostico['codigo'] = "DUAL"
             diagnostico['justificacion'] = self.t["dual_justification"].format(dengue=self.score_dengue, covid=self.score_covid)
             diagnostico['accion'] = self.t["dual_action"]
 
-        diagnostico['razonamiento'] = "\n".join(self.traza)
-        return diagnostico
+        return diagnostico, tuple(self.traza)
 
-def run_deterministic_agent(patient_data, lang="es"):
+def run_deterministic_agent(patient_data, lang="es", trace_format="text"):
     """
     Wrapper para mantener compatibilidad con la API existente.
     """
     agente = AgenteDiagnosticoHibrido(lang=lang)
     agente.percibir_paciente(patient_data)
-    return agente.inferir_diagnostico()
+    return agente.inferir_diagnostico(trace_format)
+
+def diagnostico_en_cache(patient_data, lang="es", trace_format="text"):
+    """Diagnóstico servido desde la caché, o None si no está (no evalúa reglas)."""
+    agente = AgenteDiagnosticoHibrido(lang=lang)
+    agente.percibir_paciente(patient_data)
+    return agente.inferir_diagnostico(trace_format, solo_cache=True)
+
+@timed(DETERMINISTIC_STAGE_SECONDS, "en_curso")
+def puntaje_en_curso(patient_data):
+    """
+    Scores que daría el agente con los datos disponibles hasta ahora (chat):
+    un producto del vector de condiciones por los pesos de la KB compilada, más
+    la banda de fiebre. Devuelve {"score_dengue", "score_covid", "alarma"}.
+    """
+    agente = AgenteDiagnosticoHibrido()
+    agente.percibir_paciente(patient_data)
+    reglas = agente.reglas
+    vector = reglas.vector(agente.evidencia)
+    covid, dengue = (int(x) for x in vector.astype(np.int64) @ reglas.pesos)
+
+    extra_fiebre = 0
+    if reglas.aplica_fiebre:
+        extra_fiebre = int(reglas.peso_fiebre[reglas.banda_fiebre(agente.temperatura())])
+    return {
+        "score_dengue": dengue + extra_fiebre,
+        "score_covid": covid,
+        "alarma": bool((vector & reglas.mascara_alarma).any()),
+    }
+
+def _agentes_puntuados(patients_data, lang="es"):
+    """
+    Agentes (o la excepción de cada paciente inválido) con una única versión
+    de la KB y los puntajes de todo el lote ya calculados con un producto de
+    matrices sobre la KB compilada.
+    """
+    snapshot = get_kb()
+    agentes = []
+    for patient_data in patients_data:
+        try:
+            agente = AgenteDiagnosticoHibrido(
+                lang=patient_data.get('language') or lang,
+                kb=snapshot.data, kb_version=snapshot.version
+            )
+            agente.percibir_paciente(patient_data)
+            agentes.append(agente)
+        except Exception as e:
+            agentes.append(e)
+
+    validos = [a for a in agentes if not isinstance(a, Exception)]
+    if validos:
+        reglas = validos[0].reglas
+        matriz = reglas.matriz([a.evidencia for a in validos])
+        temperaturas = [a.evidencia.get('fiebre_valor', 36.5) for a in validos]
+        temperaturas = [38.5 if t is None else t for t in temperaturas]
+        puntajes = reglas.puntuar(matriz, temperaturas)
+        for i, agente in enumerate(validos):
+            agente.puntaje = (matriz[i], temperaturas[i], {k: v[i] for k, v in puntajes.items()})
+    return agentes
+
+def run_deterministic_batch(patients_data, lang="es", trace_format="text"):
+    """
+    Ejecuta el agente sobre un lote de pacientes con una única versión de la
+    KB. Los scores de toda la cohorte se calculan con un producto de matrices
+    sobre la KB compilada. Cada paciente puede indicar su propio 'language' y
+    'trace_format'; los errores se informan por paciente sin interrumpir el lote.
+    """
+    formatos = [p.get('trace_format') or trace_format for p in patients_data]
+    agentes = _agentes_puntuados(patients_data, lang)
+
+    resultados = []
+    for agente, formato in zip(agentes, formatos):
+        if isinstance(agente, Exception):
+            resultados.append({"error": str(agente)})
+            continue
+        try:
+            resultados.append(agente.inferir_diagnostico(formato))
+        except Exception as e:
+            resultados.append({"error": str(e)})
+    return resultados
+
+def escenarios_deterministas(patients_data, lang="es"):
+    """
+    Variantes de un mismo paciente (análisis "qué pasaría si"), puntuadas en un
+    único producto de matrices. Devuelve, por variante, {"codigo",
+    "clasificacion", "score_dengue", "score_covid", "alarma"} o {"error"}.
+    """
+    agentes = _agentes_puntuados(patients_data, lang)
+    escenarios = []
+    for agente in agentes:
+        if isinstance(agente, Exception):
+            escenarios.append({"error": str(agente)})
+            continue
+        diagnostico = agente.inferir_diagnostico("none")
+        escenarios.append({
+            "codigo": diagnostico.get("codigo"),
+            "clasificacion": diagnostico["clasificacion"],
+            "score_dengue": agente.score_dengue,
+            "score_covid": agente.score_covid,
+            "alarma": bool(agente.puntaje[2]["grave"]),
+        })
+    return escenarios
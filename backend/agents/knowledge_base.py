@@ -0,0 +1,90 @@
+"""
+Process-wide cache for the medical knowledge base (reglas_infectologia.json).
+
+The file is parsed once and shared by every agent. At most once per
+`check_interval` seconds the file's mtime is checked; when it changes the
+content hash is compared and, if different, the KB is re-parsed and swapped in
+atomically, so rule edits are picked up without restarting the server.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KB_PATH = os.path.join(BASE_DIR, 'data', 'reglas_infectologia.json')
+
+
+class KBSnapshot(NamedTuple):
+    data: dict
+    version: str  # "<metadata.version>+<sha256 prefix>"
+    sha256: str
+    mtime: float
+    loaded_at: float
+
+
+class KnowledgeBaseCache:
+    def __init__(self, path: str = KB_PATH, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._snapshot: Optional[KBSnapshot] = None
+        self._next_check = 0.0
+
+    def get(self) -> KBSnapshot:
+        """Return the current KB snapshot, reloading it if the file changed"""
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() < self._next_check:
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is None or time.monotonic() >= self._next_check:
+                self._refresh()
+                self._next_check = time.monotonic() + self.check_interval
+            return self._snapshot
+
+    def _refresh(self):
+        current = self._snapshot
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if current is not None and mtime == current.mtime:
+                return
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+            sha256 = hashlib.sha256(raw).hexdigest()
+            if current is not None and sha256 == current.sha256:
+                self._snapshot = current._replace(mtime=mtime)
+                return
+            data = json.loads(raw.decode('utf-8'))
+        except Exception as e:
+            print(f"Error loading KB: {e}")
+            if current is None:
+                self._snapshot = KBSnapshot({}, "unavailable", "", 0.0, time.time())
+            return
+
+        version = f"{data.get('metadata', {}).get('version', 'unknown')}+{sha256[:12]}"
+        self._snapshot = KBSnapshot(data, version, sha256, mtime, time.time())
+        if current is not None:
+            self.reloads += 1
+
+    def info(self) -> dict:
+        """Summary of the active KB for health endpoints"""
+        snapshot = self.get()
+        return {
+            "version": snapshot.version,
+            "sha256": snapshot.sha256,
+            "loaded_at": snapshot.loaded_at,
+            "reloads": self.reloads,
+        }
+
+
+kb_cache = KnowledgeBaseCache()
+
+
+def get_kb() -> KBSnapshot:
+    """Current snapshot of the shared knowledge base"""
+    return kb_cache.get()
@@ -0,0 +1,264 @@
+"""
+Async diagnosis pipeline.
+
+Both agents are dispatched at once, each to its own bounded pool, so the
+latency of /diagnose is set by the slower agent instead of the sum of both,
+and requests do not take slots from Starlette's default threadpool. Each agent
+has its own timeout: when it expires the response carries an error entry for
+that agent and the result of the other one.
+
+An agent can run in worker processes instead of threads (`processes`), each
+loading its model once, so CPU-bound inference does not compete for the GIL
+with the request handlers.
+
+Admission control: every agent accepts at most `workers + max_queue` calls in
+flight. Past that, `Overloaded` is raised right away so the API can answer 503
+with a Retry-After header instead of letting latency grow without bound.
+
+A timed-out call cannot be interrupted; it keeps its worker until it finishes
+and still counts towards the queue, which is why the pools are bounded.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Optional
+
+from backend.agents.deterministic import run_deterministic_agent
+from backend.agents.probabilistic import run_probabilistic_agent
+
+# Patient used to warm up every worker before taking traffic
+WARMUP_PATIENT = {
+    "fiebre": True, "temperatura": 38.5, "tos": True, "dolor_garganta": False,
+    "dolor_retroocular": True, "mialgia": True, "anosmia": False, "asma": False,
+    "hipertension": False, "viaje_brasil": False, "contacto_dengue": False,
+    "lugar": "Corrientes", "estacion": "Verano", "dolor_abdominal_intenso": False,
+    "sangrado_mucosas": False, "disnea": False,
+}
+
+
+class Overloaded(Exception):
+    """An agent queue is full; the caller should retry after `retry_after` seconds"""
+
+    def __init__(self, agent: str, retry_after: int):
+        super().__init__(f"{agent} agent queue is full, retry in {retry_after}s")
+        self.agent = agent
+        self.retry_after = retry_after
+
+
+def _timed_call(agent: Callable, submitted_at: float, *args):
+    """Runs in the worker: returns (seconds waited in the queue, seconds running, agent result)"""
+    started = time.time()
+    result = agent(*args)
+    return started - submitted_at, time.time() - started, result
+
+
+def _load_models():
+    """Initializer of worker processes: importing the agents loads their models once"""
+    import backend.agents.deterministic  # noqa: F401
+    import backend.agents.probabilistic  # noqa: F401
+
+
+class AgentMetrics:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_flight = 0
+        self.completed = 0
+        self.timed_out = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            "workers": self.capacity,
+            "in_flight": self.in_flight,
+            "queue_depth": max(0, self.in_flight - self.capacity),
+            "completed": self.completed,
+            "timed_out": self.timed_out,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait_seconds": {
+                "count": self.wait_count,
+                "sum": self.wait_total,
+                "avg": self.wait_total / self.wait_count if self.wait_count else 0.0,
+                "max": self.wait_max,
+            },
+        }
+
+
+class DiagnosisPipeline:
+    def __init__(self, agents: Dict[str, Callable], max_workers: int = 4,
+                 timeouts: Optional[Dict[str, float]] = None, default_timeout: float = 5.0,
+                 processes: Optional[Dict[str, int]] = None, max_queue: int = 64,
+                 retry_after: int = 1):
+        self.agents = agents
+        self.max_workers = max_workers
+        self.processes = {name: n for name, n in (processes or {}).items() if n > 0}
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.timeouts = {name: (timeouts or {}).get(name, default_timeout) for name in agents}
+        self.metrics = {
+            name: AgentMetrics(self.processes.get(name, max_workers)) for name in agents
+        }
+        self._lock = threading.Lock()
+        self._executors: Dict[str, object] = {}
+
+    def start(self, warmup: bool = True):
+        """Create one pool per agent and warm each worker up with a sample diagnosis"""
+        if self._executors:
+            return
+        for name in self.agents:
+            if name in self.processes:
+                self._executors[name] = ProcessPoolExecutor(
+                    max_workers=self.processes[name],
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_load_models,
+                )
+            else:
+                self._executors[name] = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix=f"codex-{name}"
+                )
+        if warmup:
+            futures = [
+                self._executors[name].submit(agent, dict(WARMUP_PATIENT), "es", "text")
+                for name, agent in self.agents.items()
+                for _ in range(self.metrics[name].capacity)
+            ]
+            for future in futures:
+                future.exception()
+
+    def stop(self):
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._executors = {}
+
+    def _submit(self, name: str, patient: dict, lang: str, trace_format: str) -> Future:
+        """Admit a call into the agent queue or raise Overloaded"""
+        if not self._executors:
+            self.start(warmup=False)
+        metrics = self.metrics[name]
+        with self._lock:
+            if metrics.in_flight >= metrics.capacity + self.max_queue:
+                metrics.rejected += 1
+                raise Overloaded(name, self.retry_after)
+            metrics.in_flight += 1
+        try:
+            future = self._executors[name].submit(
+                _timed_call, self.agents[name], time.time(), patient, lang, trace_format
+            )
+        except Exception:
+            with self._lock:
+                metrics.in_flight -= 1
+            raise
+        future.add_done_callback(lambda f: self._finish(name, f))
+        return future
+
+    def _finish(self, name: str, future: Future):
+        metrics = self.metrics[name]
+        with self._lock:
+            metrics.in_flight -= 1
+            if future.cancelled() or future.exception() is not None:
+                return
+            waited = future.result()[0]
+            metrics.wait_count += 1
+            metrics.wait_total += waited
+            metrics.wait_max = max(metrics.wait_max, waited)
+
+    def _count(self, name: str, outcome: str):
+        with self._lock:
+            metrics = self.metrics[name]
+            setattr(metrics, outcome, getattr(metrics, outcome) + 1)
+
+    def _timeout_result(self, name: str) -> dict:
+        self._count(name, "timed_out")
+        return {"error": f"{name} agent timed out after {self.timeouts[name]}s", "timeout": True}
+
+    async def _await(self, name: str, future: Future, timings: Optional[dict] = None) -> dict:
+        try:
+            _, seconds, result = await asyncio.wait_for(asyncio.wrap_future(future), self.timeouts[name])
+        except asyncio.TimeoutError:
+            return self._timeout_result(name)
+        except Exception as e:
+            self._count(name, "failed")
+            return {"error": str(e)}
+        self._count(name, "completed")
+        if timings is not None:
+            timings[name] = seconds
+        return result
+
+    def _submit_all(self, patient: dict, lang: str, trace_format: str) -> Dict[str, Future]:
+        # All agents are admitted or none: a rejection cancels what was already queued
+        futures = {}
+        try:
+            for name in self.agents:
+                futures[name] = self._submit(name, patient, lang, trace_format)
+        except Overloaded:
+            for future in futures.values():
+                future.cancel()
+            raise
+        return futures
+
+    async def diagnose(self, patient: dict, lang: str = "es", trace_format: str = "text",
+                       timings: Optional[dict] = None) -> dict:
+        """
+        Run all agents concurrently; returns {agent_name: result}. May raise
+        Overloaded. `timings`, if given, receives {agent_name: seconds running}.
+        """
+        futures = self._submit_all(patient, lang, trace_format)
+        results = await asyncio.gather(*(self._await(name, f, timings) for name, f in futures.items()))
+        return dict(zip(futures, results))
+
+    def diagnose_sync(self, patient: dict, lang: str = "es", trace_format: str = "text",
+                      timings: Optional[dict] = None) -> dict:
+        """Blocking variant of diagnose() for sync handlers"""
+        futures = self._submit_all(patient, lang, trace_format)
+        deadline = time.monotonic() + max(self.timeouts.values())
+        results = {}
+        for name, future in futures.items():
+            try:
+                timeout = min(self.timeouts[name], max(0.0, deadline - time.monotonic()))
+                _, seconds, results[name] = future.result(timeout=timeout)
+                self._count(name, "completed")
+                if timings is not None:
+                    timings[name] = seconds
+            except FutureTimeoutError:
+                future.cancel()
+                results[name] = self._timeout_result(name)
+            except Exception as e:
+                self._count(name, "failed")
+                results[name] = {"error": str(e)}
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_queue": self.max_queue,
+                "timeouts": dict(self.timeouts),
+                "agents": {
+                    name: dict(metrics.snapshot(), mode="process" if name in self.processes else "thread")
+                    for name, metrics in self.metrics.items()
+                },
+            }
+
+
+pipeline = DiagnosisPipeline(
+    agents={
+        "deterministic": run_deterministic_agent,
+        "probabilistic": run_probabilistic_agent,
+    },
+    max_workers=int(os.environ.get("CODEX_AGENT_WORKERS", 4)),
+    timeouts={
+        "deterministic": float(os.environ.get("CODEX_DETERMINISTIC_TIMEOUT", 5.0)),
+        "probabilistic": float(os.environ.get("CODEX_PROBABILISTIC_TIMEOUT", 5.0)),
+    },
+    processes={"probabilistic": int(os.environ.get("CODEX_INFERENCE_PROCESSES", 0))},
+    max_queue=int(os.environ.get("CODEX_AGENT_MAX_QUEUE", 64)),
+    retry_after=int(os.environ.get("CODEX_RETRY_AFTER", 1)),
+)
@@ -3,15 +3,22 @@ Red Bayesiana Dual COVID-19 vs Dengue
 Modelo completo con TODOS los síntomas del conocimiento médico
 """
 
-try:
-    from pgmpy.models import DiscreteBayesianNetwork as BayesianNetwork
-except ImportError:
-    from pgmpy.models import BayesianNetwork
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
 
-from pgmpy.factors.discrete import TabularCPD
-from pgmpy.inference import VariableElimination
 import numpy as np
 
+from backend.agents.knowledge_base import BASE_DIR
+from backend.agents.metrics import PROBABILISTIC_QUERY_SECONDS, timed
+from backend.agents.bayes_numpy import (
+    NODOS_EVIDENCIA, NO_OBSERVADO, POTENCIAS_3, MotorBayesNumpy, cotas_completaciones,
+    indice_parcial, resumir_conjunta, todas_las_configuraciones, verificar_exactitud,
+)
+
 # Translations for probabilistic analysis
 TRANSLATIONS = {
     "es": {
@@ -58,7 +65,7 @@ SYMPTOM_NAMES = {
 # - Nodos Enfermedad: COVID, Dengue (ambos dependen del contexto)
 # - Nodos Síntomas: Cada síntoma depende de COVID y/o Dengue
 
-model = BayesianNetwork([
+ESTRUCTURA = [
     # Contexto epidemiológico influye en ambas enfermedades
     ('Estacion', 'Dengue'),
     ('Lugar', 'Dengue'),
@@ -82,18 +89,20 @@ model = BayesianNetwork([
     ('COVID', 'Anosmia'),
     ('Dengue', 'Disnea'),
     ('COVID', 'Disnea')
-])
+]
 
 # ====== DEFINICIÓN DE CPDs ======
+# Cada CPD se define con los argumentos de TabularCPD. Los objetos de pgmpy sólo
+# se construyen si hace falta la red (verificación o backend de respaldo).
 
 # --- Contexto Epidemiológico (Prior Probabilities) ---
-cpd_estacion = TabularCPD(variable='Estacion', variable_card=2, values=[[0.5], [0.5]])
-cpd_lugar = TabularCPD(variable='Lugar', variable_card=2, values=[[0.5], [0.5]])
-cpd_viaje = TabularCPD(variable='Viaje', variable_card=2, values=[[0.8], [0.2]])
-cpd_contacto = TabularCPD(variable='Contacto', variable_card=2, values=[[0.9], [0.1]])
+cpd_estacion = dict(variable='Estacion', variable_card=2, values=[[0.5], [0.5]])
+cpd_lugar = dict(variable='Lugar', variable_card=2, values=[[0.5], [0.5]])
+cpd_viaje = dict(variable='Viaje', variable_card=2, values=[[0.8], [0.2]])
+cpd_contacto = dict(variable='Contacto', variable_card=2, values=[[0.9], [0.1]])
 
 # --- COVID (Prevalencia Base 2025: ~5% en población general) ---
-cpd_covid = TabularCPD(variable='COVID', variable_card=2, values=[[0.95], [0.05]])
+cpd_covid = dict(variable='COVID', variable_card=2, values=[[0.95], [0.05]])
 
 # --- DENGUE (Depende de Contexto Epidemiológico) ---
 # Parents: Contacto, Estacion, Lugar, Viaje (orden alfabético)
@@ -117,8 +126,8 @@ for contacto in [0, 1]:
                 values_dengue.append([1 - p_dengue, p_dengue])
 
 flat_dengue = np.array(values_dengue).T.tolist()
-cpd_dengue = TabularCPD(
-    variable='Dengue', 
+cpd_dengue = dict(
+    variable='Dengue',
     variable_card=2, 
     values=flat_dengue,
     evidence=['Contacto', 'Estacion', 'Lugar', 'Viaje'],
@@ -130,7 +139,7 @@ cpd_dengue = TabularCPD(
 #          P(Síntoma | COVID=0,Dengue=1), P(Síntoma | COVID=1,Dengue=1)
 
 # FIEBRE: Muy común en ambas (90% Dengue, 80% COVID)
-cpd_fiebre = TabularCPD(
+cpd_fiebre = dict(
     variable='Fiebre', variable_card=2,
     values=[
         [0.95, 0.20, 0.10, 0.05],  # P(NoFiebre) cols: (D0,C0),(D0,C1),(D1,C0),(D1,C1)
@@ -141,7 +150,7 @@ cpd_fiebre = TabularCPD(
 )
 
 # TOS: Característico de COVID (70%), raro en Dengue (10%)
-cpd_tos = TabularCPD(
+cpd_tos = dict(
     variable='Tos', variable_card=2,
     values=[
         [0.90, 0.30, 0.85, 0.25],  # P(NoTos)
@@ -152,7 +161,7 @@ cpd_tos = TabularCPD(
 )
 
 # DOLOR DE GARGANTA: Moderado en COVID (50%), poco en Dengue (20%)
-cpd_garganta = TabularCPD(
+cpd_garganta = dict(
     variable='DolorGarganta', variable_card=2,
     values=[
         [0.85, 0.50, 0.75, 0.40],  # P(No)
@@ -163,7 +172,7 @@ cpd_garganta = TabularCPD(
 )
 
 # DOLOR RETROOCULAR: MUY específico de Dengue (70%), raro en COVID (5%)
-cpd_retroocular = TabularCPD(
+cpd_retroocular = dict(
     variable='DolorRetroocular', variable_card=2,
     values=[
         [0.98, 0.93, 0.25, 0.20],  # P(No)
@@ -174,7 +183,7 @@ cpd_retroocular = TabularCPD(
 )
 
 # MIALGIA: Muy intenso en Dengue (80%), moderado en COVID (40%)
-cpd_mialgia = TabularCPD(
+cpd_mialgia = dict(
     variable='Mialgia', variable_card=2,
     values=[
         [0.90, 0.60, 0.15, 0.10],  # P(No)
@@ -185,7 +194,7 @@ cpd_mialgia = TabularCPD(
 )
 
 # ANOSMIA: MUY específico de COVID (60%), no ocurre en Dengue
-cpd_anosmia = TabularCPD(
+cpd_anosmia = dict(
     variable='Anosmia', variable_card=2,
     values=[
         [0.99, 0.35, 0.97, 0.30],  # P(No)
@@ -196,7 +205,7 @@ cpd_anosmia = TabularCPD(
 )
 
 # DISNEA: Complicación de COVID (30%), raro en Dengue (10%)
-cpd_disnea = TabularCPD(
+cpd_disnea = dict(
     variable='Disnea', variable_card=2,
     values=[
         [0.95, 0.65, 0.88, 0.60],  # P(No)
@@ -206,27 +215,252 @@ cpd_disnea = TabularCPD(
     evidence_card=[2, 2]
 )
 
-# Agregar CPDs al modelo
-model.add_cpds(
+DEFINICION_CPDS = [
     cpd_estacion, cpd_lugar, cpd_viaje, cpd_contacto,
     cpd_covid, cpd_dengue,
     cpd_fiebre, cpd_tos, cpd_garganta, cpd_retroocular,
     cpd_mialgia, cpd_anosmia, cpd_disnea
+]
+
+# ====== RED DE PGMPY (CARGA PEREZOSA) ======
+# Importar pgmpy y construir la red cuesta segundos por worker. Sólo se hace al
+# compilar el artefacto o si el backend de respaldo (pgmpy) está activo.
+_red = None
+_lock_red = threading.Lock()
+
+def obtener_red():
+    """Devuelve (model, inference), construyendo la red de pgmpy la primera vez."""
+    global _red
+    if _red is None:
+        with _lock_red:
+            if _red is None:
+                try:
+                    from pgmpy.models import DiscreteBayesianNetwork as BayesianNetwork
+                except ImportError:
+                    from pgmpy.models import BayesianNetwork
+                from pgmpy.factors.discrete import TabularCPD
+                from pgmpy.inference import VariableElimination
+
+                model = BayesianNetwork(ESTRUCTURA)
+                model.add_cpds(*(TabularCPD(**definicion) for definicion in DEFINICION_CPDS))
+                # Validar modelo
+                assert model.check_model()
+                _red = (model, VariableElimination(model))
+    return _red
+
+def __getattr__(nombre):
+    # `model` e `inference` siguen disponibles como atributos del módulo
+    if nombre == "model":
+        return obtener_red()[0]
+    if nombre == "inference":
+        return obtener_red()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {nombre!r}")
+
+@timed(PROBABILISTIC_QUERY_SECONDS, "pgmpy")
+def _conjunta_pgmpy(evidence):
+    """P(Dengue, COVID | e) por VariableElimination, ejes [Dengue, COVID]."""
+    conjunta = obtener_red()[1].query(variables=['Dengue', 'COVID'], evidence=evidence, joint=True)
+    orden = [conjunta.variables.index(v) for v in ['Dengue', 'COVID']]
+    return np.transpose(conjunta.values, orden)
+
+def _tabla_pgmpy():
+    """Tabla de posteriores (2048, 3) desde la conjunta exacta de VariableElimination."""
+    variables = NODOS_EVIDENCIA + ['Dengue', 'COVID']
+    conjunta = obtener_red()[1].query(variables=variables, joint=True, show_progress=False)
+    orden = [conjunta.variables.index(v) for v in variables]
+    valores = np.transpose(conjunta.values, orden).reshape(2 ** len(NODOS_EVIDENCIA), 2, 2)
+    return resumir_conjunta(valores)
+
+# ====== ARTEFACTO COMPILADO ======
+# La red se compila una vez en un .npz versionado con las CPTs del motor NumPy,
+# la tabla de posteriores, las tablas de evidencia parcial del chat y el
+# resultado de la verificación contra pgmpy. Los
+# workers sólo leen ese archivo al arrancar; la versión es un hash de la
+# estructura y de las CPDs, así que cualquier cambio en la red invalida el
+# artefacto y se recompila solo.
+FORMATO_ARTEFACTO = 2
+RUTA_ARTEFACTO = os.environ.get(
+    "CODEX_MODEL_ARTIFACT", os.path.join(BASE_DIR, 'data', 'modelo_bayesiano.npz')
 )
+CAMPOS_MOTOR = ["priors_contexto", "cpt_dengue", "prior_covid", "cpt_sintomas"]
 
-# Validar modelo
-assert model.check_model()
+def version_modelo():
+    """Hash de la estructura y de las CPDs de la red."""
+    contenido = json.dumps(
+        {"formato": FORMATO_ARTEFACTO, "estructura": ESTRUCTURA, "cpds": DEFINICION_CPDS},
+        sort_keys=True
+    )
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()[:16]
 
-# Motor de inferencia
-inference = VariableElimination(model)
+VERSION_MODELO = version_modelo()
 
-def run_probabilistic_agent(patient_data, lang="es"):
+def compilar_tablas_parciales(motor):
     """
-    Ejecuta inferencia bayesiana usando TODOS los síntomas disponibles
+    Tablas indexadas por evidencia parcial (índice en base 3, ver indice_parcial),
+    en una única pasada del motor NumPy (~0.6 s, 13 MB):
+
+    - posteriores (3^11, 3): P(Dengue=1 | e), P(COVID=1 | e), P(ambos | e),
+      marginalizando los nodos no observados;
+    - ganancias (3^11, 11): ganancia de información de observar cada nodo;
+    - cotas (3^11, 4): mínimo y máximo de P(Dengue=1) y de P(COVID=1) entre
+      todas las respuestas posibles a los nodos no observados.
     """
-    t = TRANSLATIONS.get(lang, TRANSLATIONS["es"])
+    conjunta = motor.conjunta_parcial()
+    posteriores = resumir_conjunta(conjunta)
+    minimos, maximos = cotas_completaciones(posteriores[:, :2])
+    return {
+        "parciales_posteriores": posteriores.astype(np.float32),
+        "parciales_ganancias": motor.ganancias_informacion(conjunta),
+        "parciales_cotas": np.stack(
+            [minimos[:, 0], maximos[:, 0], minimos[:, 1], maximos[:, 1]], axis=1
+        ).astype(np.float32),
+    }
+
+def compilar_artefacto():
+    """
+    Construye el contenido del artefacto: CPTs del motor NumPy, verificación
+    contra VariableElimination, tabla de los 2048 posteriores y tablas de
+    evidencia parcial del chat. Si pgmpy no está instalado el motor NumPy se usa
+    sin verificar.
+    """
+    motor = MotorBayesNumpy.desde_definiciones(DEFINICION_CPDS)
+    try:
+        error, exacto = verificar_exactitud(motor, obtener_red()[1])
+        verificado = True
+    except ImportError:
+        error, exacto, verificado = float('nan'), True, False
+        print("pgmpy no disponible: motor NumPy sin verificar")
+
+    backend = "numpy" if exacto else "pgmpy"
+    if not exacto:
+        print(f"Motor NumPy descartado (error {error:.2e}), usando pgmpy")
+    tabla = motor.posteriores(todas_las_configuraciones()) if exacto else _tabla_pgmpy()
+
+    datos = dict(motor.tablas())
+    datos.update(compilar_tablas_parciales(motor))
+    datos.update(
+        tabla_posteriores=tabla,
+        version=np.array(VERSION_MODELO),
+        backend=np.array(backend),
+        error_motor=np.array(error),
+        verificado=np.array(verificado),
+    )
+    return datos
+
+def guardar_artefacto(datos, ruta=RUTA_ARTEFACTO):
+    """Escribe el artefacto de forma atómica (archivo temporal + rename)."""
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, 'wb') as f:
+        np.savez(f, **datos)
+    os.replace(temporal, ruta)
+
+def cargar_artefacto(ruta=RUTA_ARTEFACTO):
+    """Contenido del artefacto, o None si no existe o es de otra versión."""
+    try:
+        with np.load(ruta, allow_pickle=False) as archivo:
+            if str(archivo['version']) != VERSION_MODELO:
+                return None
+            return {campo: archivo[campo] for campo in archivo.files}
+    except (OSError, KeyError, ValueError):
+        return None
+
+def inicializar_modelo(ruta=RUTA_ARTEFACTO):
+    """Carga el artefacto o, si no sirve, lo compila e intenta guardarlo."""
+    inicio = time.perf_counter()
+    datos = cargar_artefacto(ruta) if ruta else None
+    origen = "artefacto"
+    if datos is None:
+        datos = compilar_artefacto()
+        origen = "compilado"
+        if ruta:
+            try:
+                guardar_artefacto(datos, ruta)
+            except OSError as e:
+                print(f"No se pudo guardar el artefacto del modelo: {e}")
+    return datos, origen, time.perf_counter() - inicio
+
+_datos_modelo, _origen_modelo, _segundos_carga = inicializar_modelo()
+
+# ====== MOTOR DE INFERENCIA VECTORIZADO ======
+# La red tiene forma fija, por lo que los posteriores se calculan como productos
+# y sumas de los CPDs en NumPy sobre lotes de evidencia. VariableElimination se
+# mantiene como referencia: si el motor NumPy no reproduce sus resultados se usa
+# pgmpy como backend.
+motor_numpy = MotorBayesNumpy(**{campo: _datos_modelo[campo] for campo in CAMPOS_MOTOR})
+ERROR_MOTOR_NUMPY = float(_datos_modelo['error_motor'])
+BACKEND = str(_datos_modelo['backend'])
+
+# ====== MODO COMPILADO: TABLA DE POSTERIORES ======
+# run_probabilistic_agent observa siempre los 11 nodos que no son enfermedad,
+# por lo que sólo existen 2^11 = 2048 configuraciones de evidencia. Se enumeran
+# una única vez al compilar el artefacto y cada diagnóstico pasa a ser una
+# lectura O(1) de la tabla, indexada por la máscara de bits de la evidencia.
+MODO_COMPILADO = True
+TABLA_POSTERIORES = _datos_modelo['tabla_posteriores']
+_tablas_parciales = {
+    nombre: _datos_modelo[f'parciales_{nombre}'] for nombre in ("posteriores", "ganancias", "cotas")
+}
+
+ESTADO_MODELO = {
+    "cargado": True,
+    "version": VERSION_MODELO,
+    "origen": _origen_modelo,
+    "backend": BACKEND,
+    "verificado": bool(_datos_modelo['verificado']),
+    "segundos_carga": round(_segundos_carga, 4),
+}
+
+def indice_evidencia(evidence):
+    """Máscara de bits de la evidencia, o None si algún nodo no fue observado."""
+    indice = 0
+    for nodo in NODOS_EVIDENCIA:
+        valor = evidence.get(nodo)
+        if valor is None:
+            return None
+        indice = (indice << 1) | int(valor)
+    return indice
+
+@timed(PROBABILISTIC_QUERY_SECONDS, "consulta")
+def consultar_posteriores(evidence):
+    """
+    Devuelve (P(Dengue=1 | e), P(COVID=1 | e), P(Dengue=1, COVID=1 | e)). Usa la
+    tabla compilada cuando la evidencia es completa y recurre a inferencia en
+    vivo si es parcial.
+    """
+    indice = indice_evidencia(evidence) if MODO_COMPILADO else None
+    if indice is not None:
+        prob_dengue, prob_covid, prob_both = TABLA_POSTERIORES[indice]
+        return float(prob_dengue), float(prob_covid), float(prob_both)
+
+    if BACKEND == "numpy":
+        fila = [evidence.get(nodo, NO_OBSERVADO) for nodo in NODOS_EVIDENCIA]
+        prob_dengue, prob_covid, prob_both = motor_numpy.posteriores(fila)[0]
+    else:
+        # Una única consulta conjunta: ambas marginales y la coinfección salen
+        # del mismo factor, sin repetir la eliminación de variables.
+        prob_dengue, prob_covid, prob_both = resumir_conjunta(_conjunta_pgmpy(evidence))
+    return float(prob_dengue), float(prob_covid), float(prob_both)
+
+@timed(PROBABILISTIC_QUERY_SECONDS, "lote")
+def posteriores_lote(matriz_evidencia):
+    """
+    Posteriores (N, 3) para una matriz de evidencia (N, 11) con columnas en el
+    orden NODOS_EVIDENCIA y valores 0, 1 o NO_OBSERVADO.
+    """
+    matriz_evidencia = np.atleast_2d(np.asarray(matriz_evidencia, dtype=np.int8))
+    if BACKEND == "numpy":
+        return motor_numpy.posteriores(matriz_evidencia)
+
+    filas = []
+    for fila in matriz_evidencia:
+        evidence = {nodo: int(v) for nodo, v in zip(NODOS_EVIDENCIA, fila) if v != NO_OBSERVADO}
+        filas.append(resumir_conjunta(_conjunta_pgmpy(evidence)))
+    return np.array(filas).reshape(-1, 3)
+
+def evidencia_paciente(patient_data):
+    """Mapea los datos del paciente a la evidencia completa de la red."""
     evidence = {}
-    
+
     # --- Contexto Epidemiológico ---
     evidence['Estacion'] = 1 if patient_data.get('estacion') == 'Verano' else 0
     evidence['Lugar'] = 1 if patient_data.get('lugar') == 'Corrientes' else 0
@@ -241,57 +475,219 @@ def run_probabilistic_agent(patient_data, lang="es"):
     evidence['Mialgia'] = 1 if patient_data.get('mialgia', False) else 0
     evidence['Anosmia'] = 1 if patient_data.get('anosmia', False) else 0
     evidence['Disnea'] = 1 if patient_data.get('disnea', False) else 0
-    
-    try:
-        # Inferir ambas enfermedades
-        result_dengue = inference.query(variables=['Dengue'], evidence=evidence)
-        result_covid = inference.query(variables=['COVID'], evidence=evidence)
-        
-        prob_dengue = float(result_dengue.values[1])
-        prob_covid = float(result_covid.values[1])
-        
-        # Probabilidad de coinfección (eventos independientes)
-        prob_both = prob_dengue * prob_covid
-        
-        # Análisis cualitativo: síntomas activados y resumen numérico
-        sintomas_usados = [k for k, v in evidence.items() if v == 1 and k not in ['Estacion', 'Lugar', 'Viaje', 'Contacto']]
-        
+    return evidence
+
+def matriz_de_evidencias(evidencias):
+    """Matriz de evidencia (N, 11) a partir de una lista de diccionarios de evidencia."""
+    return np.array(
+        [[e.get(nodo, NO_OBSERVADO) for nodo in NODOS_EVIDENCIA] for e in evidencias],
+        dtype=np.int8
+    ).reshape(-1, len(NODOS_EVIDENCIA))
+
+# ====== GANANCIA DE INFORMACIÓN PARA EL CHAT ADAPTATIVO ======
+# Campo del paciente y valor que pone el nodo en 1, en orden NODOS_EVIDENCIA
+CAMPO_NODO = {
+    'Estacion': ('estacion', 'Verano'),
+    'Lugar': ('lugar', 'Corrientes'),
+    'Viaje': ('viaje_brasil', True),
+    'Contacto': ('contacto_dengue', True),
+    'Fiebre': ('fiebre', True),
+    'Tos': ('tos', True),
+    'DolorGarganta': ('dolor_garganta', True),
+    'DolorRetroocular': ('dolor_retroocular', True),
+    'Mialgia': ('mialgia', True),
+    'Anosmia': ('anosmia', True),
+    'Disnea': ('disnea', True),
+}
+NODO_DE_CAMPO = {campo: nodo for nodo, (campo, _) in CAMPO_NODO.items()}
+
+def tablas_parciales():
+    """
+    Tablas de evidencia parcial del artefacto (ver compilar_tablas_parciales):
+    {"posteriores", "ganancias", "cotas"}, indexadas por indice_parcial.
+    """
+    return _tablas_parciales
+
+def fila_parcial(respuestas):
+    """
+    Evidencia parcial (lista en orden NODOS_EVIDENCIA) a partir de las
+    respuestas disponibles; los campos ausentes o en None quedan NO_OBSERVADO.
+    """
+    fila = []
+    for nodo in NODOS_EVIDENCIA:
+        campo, positivo = CAMPO_NODO[nodo]
+        valor = respuestas.get(campo)
+        fila.append(NO_OBSERVADO if valor is None else int(valor == positivo))
+    return fila
+
+# Peso de cada nodo en el índice parcial: observar el nodo con valor v suma
+# (v + 1) * POTENCIA_NODO[nodo], lo que permite actualizar el índice respuesta a respuesta
+POTENCIA_NODO = {nodo: int(p) for nodo, p in zip(NODOS_EVIDENCIA, POTENCIAS_3)}
+
+def valor_nodo(nodo, respuesta):
+    """Valor 0/1 del nodo para la respuesta de su campo."""
+    return int(respuesta == CAMPO_NODO[nodo][1])
+
+def ganancias_parciales(respuestas, indice=None):
+    """
+    {nodo: bits esperados} para los nodos aún no observados. `indice` es el
+    índice parcial de las respuestas, si ya se conoce.
+    """
+    if indice is None:
+        indice = indice_parcial(fila_parcial(respuestas))
+    fila = tablas_parciales()["ganancias"][indice]
+    return {nodo: float(g) for nodo, g in zip(NODOS_EVIDENCIA, fila) if g == g}
+
+def posterior_parcial(indice):
+    """(P(Dengue=1 | e), P(COVID=1 | e), P(ambos | e)) de la evidencia parcial `indice`."""
+    return tuple(float(p) for p in tablas_parciales()["posteriores"][indice])
+
+def enfermedad_decidida(indice, umbral):
+    """
+    "Dengue" o "COVID" si su posterior queda >= umbral y la de la otra <= 1 - umbral
+    para cualquier respuesta a los nodos aún no observados; None si no.
+    """
+    min_d, max_d, min_c, max_c = tablas_parciales()["cotas"][indice]
+    if min_d >= umbral and max_c <= 1 - umbral:
+        return "Dengue"
+    if min_c >= umbral and max_d <= 1 - umbral:
+        return "COVID"
+    return None
+
+# ====== ANÁLISIS "QUÉ PASARÍA SI" ======
+def _logit(p):
+    p = np.clip(np.asarray(p, dtype=np.float64), 1e-12, 1 - 1e-12)
+    return np.log(p / (1 - p))
+
+@timed(PROBABILISTIC_QUERY_SECONDS, "que_pasaria")
+def analisis_que_pasaria(patient_data):
+    """
+    Posteriores del paciente y de cada variante con un único nodo invertido
+    (lecturas de la tabla compilada, con la máscara de bits XOR cada nodo), y
+    contribución de cada hallazgo: su log-razón de verosimilitud dado el resto
+    de la evidencia, en nats, que sale de los CPDs sin observar el nodo:
+
+        log [P(x | D=1, e_-x) / P(x | D=0, e_-x)] = logit P(D=1 | e) - logit P(D=1 | e_-x)
+
+    Las 11 evidencias con un nodo sin observar se evalúan en un único lote.
+    Devuelve (base (3,), invertidos (11, 3), contribuciones (11, 2) [Dengue, COVID]).
+    """
+    evidence = evidencia_paciente(patient_data)
+    fila = np.array([evidence[nodo] for nodo in NODOS_EVIDENCIA], dtype=np.int8)
+    identidad = np.eye(len(fila), dtype=bool)
+
+    if MODO_COMPILADO:
+        mascara = indice_evidencia(evidence)
+        bits = 1 << np.arange(len(fila) - 1, -1, -1)
+        base = TABLA_POSTERIORES[mascara]
+        invertidos = TABLA_POSTERIORES[mascara ^ bits]
+        sin_nodo = posteriores_lote(np.where(identidad, NO_OBSERVADO, fila))
+    else:
+        filas = np.vstack([fila, np.where(identidad, 1 - fila, fila), np.where(identidad, NO_OBSERVADO, fila)])
+        posteriores = posteriores_lote(filas)
+        base, invertidos, sin_nodo = posteriores[0], posteriores[1:len(fila) + 1], posteriores[len(fila) + 1:]
+
+    contribuciones = _logit(base[:2]) - _logit(sin_nodo[:, :2])
+    return np.asarray(base), np.asarray(invertidos), contribuciones
+
+def armar_resultado(patient_data, evidence, posteriores, lang="es", trace_format="text"):
+    """
+    Construye la respuesta del agente a partir de la evidencia y de
+    (P(Dengue=1), P(COVID=1), P(Dengue=1, COVID=1)) ya calculados.
+    Los textos explicativos sólo se redactan con trace_format="text".
+    """
+    t = TRANSLATIONS.get(lang, TRANSLATIONS["es"])
+    prob_dengue, prob_covid, prob_both = (float(p) for p in posteriores)
+
+    # Análisis cualitativo: síntomas activados y resumen numérico
+    sintomas_usados = [k for k, v in evidence.items() if v == 1 and k not in ['Estacion', 'Lugar', 'Viaje', 'Contacto']]
+
+    detalle_componentes = {
+        "contexto": {
+            "Estacion": evidence['Estacion'],
+            "Lugar": evidence['Lugar'],
+            "Viaje": evidence['Viaje'],
+            "Contacto": evidence['Contacto'],
+        },
+        "sintomas": {
+            "Fiebre": evidence['Fiebre'],
+            "Tos": evidence['Tos'],
+            "DolorGarganta": evidence['DolorGarganta'],
+            "DolorRetroocular": evidence['DolorRetroocular'],
+            "Mialgia": evidence['Mialgia'],
+            "Anosmia": evidence['Anosmia'],
+            "Disnea": evidence['Disnea'],
+        },
+    }
+
+    resultado = {
+        "dengue_probability": round(prob_dengue * 100, 2),
+        "covid_probability": round(prob_covid * 100, 2),
+        "both_probability": round(prob_both * 100, 2),
+    }
+    if trace_format == "text":
         # Translate symptom names for display
         symptom_translations = SYMPTOM_NAMES.get(lang, SYMPTOM_NAMES["es"])
         sintomas_usados_translated = [symptom_translations.get(s, s) for s in sintomas_usados]
+        resultado["analysis"] = t["bayesian_inference"].format(count=len(sintomas_usados), symptoms=', '.join(sintomas_usados_translated))
+        detalle_componentes["nota_metodo"] = t["note"]
 
-        detalle_componentes = {
-            "contexto": {
-                "Estacion": evidence['Estacion'],
-                "Lugar": evidence['Lugar'],
-                "Viaje": evidence['Viaje'],
-                "Contacto": evidence['Contacto'],
-            },
-            "sintomas": {
-                "Fiebre": evidence['Fiebre'],
-                "Tos": evidence['Tos'],
-                "DolorGarganta": evidence['DolorGarganta'],
-                "DolorRetroocular": evidence['DolorRetroocular'],
-                "Mialgia": evidence['Mialgia'],
-                "Anosmia": evidence['Anosmia'],
-                "Disnea": evidence['Disnea'],
-            },
-            "nota_metodo": t["note"]
-        }
-
-        return {
-            "dengue_probability": round(prob_dengue * 100, 2),
-            "covid_probability": round(prob_covid * 100, 2),
-            "both_probability": round(prob_both * 100, 2),
-            "analysis": t["bayesian_inference"].format(count=len(sintomas_usados), symptoms=', '.join(sintomas_usados_translated)),
-            "sintomas_evaluados": sintomas_usados,
-            "contexto_epidemiologico": {
-                "lugar": patient_data.get('lugar', t["unknown"]),
-                "estacion": patient_data.get('estacion', t["unknown"]),
-                "viaje_brasil": patient_data.get('viaje_brasil', False),
-                "contacto_dengue": patient_data.get('contacto_dengue', False)
-            },
-            "detalles_componentes": detalle_componentes
-        }
+    resultado.update({
+        "sintomas_evaluados": sintomas_usados,
+        "contexto_epidemiologico": {
+            "lugar": patient_data.get('lugar', t["unknown"]),
+            "estacion": patient_data.get('estacion', t["unknown"]),
+            "viaje_brasil": patient_data.get('viaje_brasil', False),
+            "contacto_dengue": patient_data.get('contacto_dengue', False)
+        },
+        "detalles_componentes": detalle_componentes
+    })
+    return resultado
+
+def run_probabilistic_agent(patient_data, lang="es", trace_format="text"):
+    """
+    Ejecuta inferencia bayesiana usando TODOS los síntomas disponibles
+    """
+    evidence = evidencia_paciente(patient_data)
+    
+    try:
+        # Inferir ambas enfermedades y la coinfección exacta P(Dengue=1, COVID=1 | e):
+        # con síntomas observados las enfermedades dejan de ser independientes
+        posteriores = consultar_posteriores(evidence)
+        return armar_resultado(patient_data, evidence, posteriores, lang, trace_format)
     except Exception as e:
         return {"error": str(e), "evidence": evidence}
+
+def run_probabilistic_batch(patients_data, lang="es", trace_format="text"):
+    """
+    Inferencia bayesiana sobre un lote de pacientes en una sola pasada
+    vectorizada. Cada paciente puede indicar su propio 'language' y
+    'trace_format'.
+    """
+    evidencias = [evidencia_paciente(p) for p in patients_data]
+    try:
+        posteriores = posteriores_lote(matriz_de_evidencias(evidencias))
+    except Exception as e:
+        return [{"error": str(e), "evidence": ev} for ev in evidencias]
+
+    resultados = []
+    for patient_data, evidence, fila in zip(patients_data, evidencias, posteriores):
+        try:
+            resultados.append(armar_resultado(
+                patient_data, evidence, fila,
+                patient_data.get('language') or lang,
+                patient_data.get('trace_format') or trace_format
+            ))
+        except Exception as e:
+            resultados.append({"error": str(e), "evidence": evidence})
+    return resultados
+
+if __name__ == "__main__":
+    # python -m backend.agents.probabilistic --compilar [ruta]
+    if len(sys.argv) >= 2 and sys.argv[1] == "--compilar":
+        ruta = sys.argv[2] if len(sys.argv) > 2 else RUTA_ARTEFACTO
+        datos = compilar_artefacto()
+        guardar_artefacto(datos, ruta)
+        print(f"Artefacto {VERSION_MODELO} ({datos['backend']}) guardado en {ruta}")
+    else:
+        print(json.dumps(ESTADO_MODELO, indent=2))
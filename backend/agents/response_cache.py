@@ -0,0 +1,90 @@
+"""
+LRU cache for agent results keyed by a canonical encoding of the patient.
+
+Entries are tagged with the version of the data they were computed from (KB
+version, model version). When a lookup arrives with a different version the
+whole cache is dropped, so edits to the KB or the CPTs are never served stale.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._version: Optional[Hashable] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _check_version(self, version: Hashable):
+        # Called with the lock held
+        if version != self._version:
+            if self._entries:
+                self._entries.clear()
+                self.invalidations += 1
+            self._version = version
+
+    def get(self, key: Hashable, version: Hashable, count_miss: bool = True) -> Optional[Any]:
+        """
+        Cached value for `key` computed under `version`, or None. Probes whose
+        miss is followed by a regular lookup pass count_miss=False so the miss
+        is not counted twice.
+        """
+        with self._lock:
+            self._check_version(version)
+            value = self._entries.get(key)
+            if value is None:
+                if count_miss:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, version: Hashable):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "version": self._version,
+            }
+
+
+def cache_size_from_env(default: int = 4096) -> int:
+    """Cache capacity from CODEX_RESPONSE_CACHE_SIZE (0 disables caching)"""
+    return int(os.environ.get("CODEX_RESPONSE_CACHE_SIZE", default))
@@ -0,0 +1,263 @@
+"""
+Motor de Reglas Compilado
+Compila la KB (reglas_infectologia.json) en vectores de pesos y máscaras sobre
+un layout fijo de condiciones, de modo que puntuar un paciente es un producto
+escalar y puntuar una cohorte es un producto de matrices.
+
+Layout: cada clave de condición de la KB ('sintoma' o 'condicion') ocupa una
+columna. La evidencia de un paciente es un vector booleano sobre esas columnas.
+
+Una condición es un hecho de la evidencia ("tos") o una condición compuesta
+{"todas": [...]} (Y) / {"alguna": [...]} (O) de hechos u otras condiciones
+compuestas. Todas se compilan en una red de coincidencia (RedCondiciones) y
+un índice inverso columna -> reglas por sección: evaluar un paciente recorre
+sólo sus hechos verdaderos y las reglas que éstos activan, no toda la KB.
+"""
+
+import numpy as np
+
+from backend.agents.metrics import DETERMINISTIC_STAGE_SECONDS, timed
+
+# Bandas de la lógica difusa de fiebre, de menor a mayor temperatura
+BANDAS_FIEBRE = ['baja', 'alta', 'hiperpirexia']
+UMBRALES_POR_DEFECTO = {'baja': 37.0, 'alta': 38.0, 'hiperpirexia': 39.6}
+
+# Clasificación del diagnóstico diferencial
+CLASE_DUAL, CLASE_DENGUE, CLASE_COVID = 0, 1, 2
+MARGEN_CLASIFICACION = 3
+
+
+OPERADORES = ('todas', 'alguna')
+
+
+def clave_condicion(condicion):
+    """Clave canónica (texto) de una condición simple o compuesta."""
+    if isinstance(condicion, str):
+        return condicion
+    if (not isinstance(condicion, dict) or len(condicion) != 1
+            or next(iter(condicion)) not in OPERADORES):
+        raise ValueError(f"Condición inválida: {condicion!r} (se espera un hecho, "
+                         f"{{'todas': [...]}} o {{'alguna': [...]}})")
+    operador, partes = next(iter(condicion.items()))
+    if not isinstance(partes, list) or not partes:
+        raise ValueError(f"Condición inválida: {condicion!r} (lista vacía)")
+    return f"{operador}({', '.join(clave_condicion(p) for p in partes)})"
+
+
+class RedCondiciones:
+    """
+    Red de coincidencia compilada. Cada condición distinta es un nodo: los
+    hechos son las hojas y cada nodo 'todas'/'alguna' lleva la cuenta de
+    cuántos hijos se activaron. Activar un paciente propaga sólo sus hechos
+    verdaderos hacia los padres, así que el costo depende de los hallazgos
+    presentes y no del tamaño de la KB.
+    """
+
+    def __init__(self):
+        self.claves = []       # nodo -> clave canónica
+        self.requeridos = []   # nodo -> hijos activos necesarios (1 para hechos y 'alguna')
+        self.padres = []       # nodo -> nodos compuestos que lo usan
+        self.por_clave = {}
+        self.por_hecho = {}    # hecho -> nodo hoja
+
+    def compilar(self, condicion):
+        """Nodo de `condicion`, creándolo (con sus subcondiciones) si no existe."""
+        clave = clave_condicion(condicion)
+        nodo = self.por_clave.get(clave)
+        if nodo is not None:
+            return nodo
+        if isinstance(condicion, str):
+            hijos, requeridos = [], 1
+        else:
+            operador, partes = next(iter(condicion.items()))
+            hijos = list(dict.fromkeys(self.compilar(p) for p in partes))
+            requeridos = len(hijos) if operador == 'todas' else 1
+        nodo = len(self.claves)
+        self.claves.append(clave)
+        self.requeridos.append(requeridos)
+        self.padres.append([])
+        self.por_clave[clave] = nodo
+        if isinstance(condicion, str):
+            self.por_hecho[condicion] = nodo
+        for hijo in hijos:
+            self.padres[hijo].append(nodo)
+        return nodo
+
+    def activar(self, hechos):
+        """Nodos verdaderos dados los hechos verdaderos de un paciente."""
+        activos = []
+        cuenta = {}
+        pendientes = [self.por_hecho[h] for h in hechos if h in self.por_hecho]
+        while pendientes:
+            nodo = pendientes.pop()
+            activos.append(nodo)
+            for padre in self.padres[nodo]:
+                n = cuenta.get(padre, 0) + 1
+                cuenta[padre] = n
+                if n == self.requeridos[padre]:
+                    pendientes.append(padre)
+        return activos
+
+
+class ReglasCompiladas:
+    def __init__(self, kb):
+        kb = kb or {}
+        self.alarmas = list(kb.get('reglas_signos_alarma', []))
+        self.diferenciales = list(kb.get('reglas_diagnostico_diferencial', []))
+        self.contexto = list(kb.get('reglas_contexto_epidemiologico', []))
+
+        # Identificador estable de cada regla (para trazas estructuradas)
+        self.por_id = {}
+        self.ids_alarmas = self._registrar_ids('alarma', self.alarmas)
+        self.ids_diferenciales = self._registrar_ids('diferencial', self.diferenciales)
+        self.ids_contexto = self._registrar_ids('contexto', self.contexto)
+
+        # Layout de condiciones: una columna por clave distinta
+        self.red = RedCondiciones()
+        nodos = []
+        for regla in self.alarmas + self.contexto:
+            nodos.append(self.red.compilar(regla['condicion']))
+        for regla in self.diferenciales:
+            nodos.append(self.red.compilar(regla['sintoma']))
+        nodos = list(dict.fromkeys(nodos))
+        self.claves = [self.red.claves[nodo] for nodo in nodos]
+        self.columna = {clave: i for i, clave in enumerate(self.claves)}
+        # Columna de cada nodo de la red (-1 si es una subcondición sin reglas propias)
+        self.columna_nodo = np.full(len(self.red.claves), -1, dtype=np.intp)
+        self.columna_nodo[nodos] = np.arange(len(nodos))
+
+        # Columna de la condición de cada regla, por sección
+        self.cond_alarmas = self._columnas(self.alarmas, 'condicion')
+        self.cond_diferenciales = self._columnas(self.diferenciales, 'sintoma')
+        self.cond_contexto = self._columnas(self.contexto, 'condicion')
+
+        # Índice inverso: columna -> reglas de cada sección, en orden de la KB
+        self.indice = {
+            seccion: self._indexar(columnas)
+            for seccion, columnas in (('alarmas', self.cond_alarmas),
+                                      ('diferenciales', self.cond_diferenciales),
+                                      ('contexto', self.cond_contexto))
+        }
+
+        # Vectores de pesos por condición (reglas que comparten condición se suman)
+        k = len(self.claves)
+        self.peso_covid = np.zeros(k, dtype=np.int64)
+        self.peso_dengue = np.zeros(k, dtype=np.int64)
+        for reglas, columnas in ((self.diferenciales, self.cond_diferenciales),
+                                 (self.contexto, self.cond_contexto)):
+            for regla, col in zip(reglas, columnas):
+                self.peso_covid[col] += regla['peso_covid']
+                self.peso_dengue[col] += regla['peso_dengue']
+        self.pesos = np.stack([self.peso_covid, self.peso_dengue], axis=1)
+
+        self.mascara_alarma = np.zeros(k, dtype=bool)
+        self.mascara_alarma[self.cond_alarmas] = True
+
+        # Fiebre: umbrales ordenados; banda 0 = sin fiebre, banda i = BANDAS_FIEBRE[i-1]
+        self.aplica_fiebre = bool(kb)
+        logica = kb.get('logica_difusa_fiebre', {})
+        bandas = sorted(
+            BANDAS_FIEBRE,
+            key=lambda b: logica.get(b, {}).get('min', UMBRALES_POR_DEFECTO[b])
+        )
+        self.bandas_fiebre = [None] + bandas
+        self.umbrales_fiebre = np.array(
+            [logica.get(b, {}).get('min', UMBRALES_POR_DEFECTO[b]) for b in bandas], dtype=np.float64
+        )
+        self.peso_fiebre = np.array(
+            [0] + [logica.get(b, {}).get('peso_extra_dengue', 0) for b in bandas], dtype=np.int64
+        )
+
+    def _registrar_ids(self, seccion, reglas):
+        ids = []
+        for i, regla in enumerate(reglas):
+            regla_id = regla.get('id', f'{seccion}_{i}')
+            self.por_id[regla_id] = regla
+            ids.append(regla_id)
+        return ids
+
+    def _columnas(self, reglas, campo):
+        return np.array([self.columna[clave_condicion(r[campo])] for r in reglas], dtype=np.intp)
+
+    def _indexar(self, columnas):
+        indice = [[] for _ in self.claves]
+        for i, col in enumerate(columnas):
+            indice[col].append(i)
+        return indice
+
+    def activas(self, evidencia):
+        """Columnas (ordenadas) de las condiciones verdaderas para un paciente."""
+        hechos = [hecho for hecho, valor in evidencia.items() if valor is True]
+        columnas = self.columna_nodo[self.red.activar(hechos)]
+        return np.sort(columnas[columnas >= 0])
+
+    def vector(self, evidencia):
+        """Vector booleano (K,) de condiciones verdaderas para un paciente."""
+        vector = np.zeros(len(self.claves), dtype=bool)
+        vector[self.activas(evidencia)] = True
+        return vector
+
+    def reglas_activas(self, seccion, columnas):
+        """
+        Índices (en orden de la KB) de las reglas de `seccion` ('alarmas',
+        'diferenciales' o 'contexto') cuya condición está en `columnas`.
+        """
+        indice = self.indice[seccion]
+        activas = [i for col in columnas for i in indice[col]]
+        activas.sort()
+        return activas
+
+    def matriz(self, evidencias):
+        """Matriz booleana (N, K) para una lista de evidencias."""
+        return np.array([self.vector(e) for e in evidencias], dtype=bool).reshape(-1, len(self.claves))
+
+    def banda_fiebre(self, temperaturas):
+        """Índice de banda de fiebre para cada temperatura (0 = sin banda)."""
+        return np.searchsorted(self.umbrales_fiebre, temperaturas, side='right')
+
+    @timed(DETERMINISTIC_STAGE_SECONDS, "puntuacion")
+    def puntuar(self, matriz, temperaturas):
+        """
+        Puntúa una cohorte: `matriz` (N, K) booleana y `temperaturas` (N,).
+        Devuelve un diccionario de arrays (N,) con score_covid, score_dengue,
+        banda de fiebre, gravedad y clase del diagnóstico diferencial.
+        """
+        matriz = np.atleast_2d(matriz)
+        scores = matriz.astype(np.int64) @ self.pesos
+        score_covid = scores[:, 0]
+        score_dengue = scores[:, 1]
+
+        if self.aplica_fiebre:
+            banda = self.banda_fiebre(np.asarray(temperaturas, dtype=np.float64))
+            score_dengue = score_dengue + self.peso_fiebre[banda]
+        else:
+            banda = np.zeros(matriz.shape[0], dtype=np.intp)
+
+        clase = np.select(
+            [score_dengue > score_covid + MARGEN_CLASIFICACION,
+             score_covid > score_dengue + MARGEN_CLASIFICACION],
+            [CLASE_DENGUE, CLASE_COVID],
+            default=CLASE_DUAL
+        )
+        return {
+            "score_covid": score_covid,
+            "score_dengue": score_dengue,
+            "banda_fiebre": banda,
+            "grave": (matriz & self.mascara_alarma).any(axis=1),
+            "clase": clase,
+        }
+
+
+_cache_compiladas = {}
+
+
+def obtener_reglas_compiladas(kb, version=None):
+    """Reglas compiladas de la KB, reutilizadas mientras no cambie su versión."""
+    if version is None:
+        return ReglasCompiladas(kb)
+    compiladas = _cache_compiladas.get(version)
+    if compiladas is None:
+        compiladas = ReglasCompiladas(kb)
+        _cache_compiladas.clear()
+        _cache_compiladas[version] = compiladas
+    return compiladas
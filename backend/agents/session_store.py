@@ -0,0 +1,369 @@
+"""
+Bounded stores for chat sessions.
+
+Sessions expire after `ttl_seconds` without activity and, once `max_sessions`
+are live, the least recently used one is evicted. A background thread sweeps
+expired sessions periodically.
+
+Three backends share the same interface (get/put/delete/sweep/stats):
+- SessionStore: in-process, keeps session objects as they are. Single worker.
+- SQLiteSessionStore: a WAL-mode SQLite file shared by every worker on a host.
+- RedisSessionStore: any server speaking the Redis protocol (requires the
+  optional `redis` package).
+The shared backends persist sessions through `encode`/`decode` callables, so
+callers must `put` a session back after mutating it.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+
+class SessionStore:
+    def __init__(self, ttl_seconds: float = 1800, max_sessions: int = 10000,
+                 sweep_interval: float = 60):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.sweep_interval = sweep_interval
+        self.created = 0
+        self.evicted = 0
+        self.expired = 0
+        self._sessions: "OrderedDict[str, list]" = OrderedDict()  # id -> [session, last_access]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def get(self, session_id: str) -> Optional[Any]:
+        """Return a live session and mark it as recently used"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if now - entry[1] > self.ttl_seconds:
+                del self._sessions[session_id]
+                self.expired += 1
+                return None
+            entry[1] = now
+            self._sessions.move_to_end(session_id)
+            return entry[0]
+
+    def put(self, session_id: str, session: Any):
+        """Insert or update a session, evicting the least recently used if full"""
+        with self._lock:
+            if session_id in self._sessions:
+                self._sessions[session_id] = [session, time.monotonic()]
+                self._sessions.move_to_end(session_id)
+                return
+            self._sessions[session_id] = [session, time.monotonic()]
+            self.created += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def sweep(self) -> int:
+        """Remove expired sessions; returns how many were removed"""
+        deadline = time.monotonic() - self.ttl_seconds
+        removed = 0
+        with self._lock:
+            while self._sessions:
+                session_id, entry = next(iter(self._sessions.items()))
+                if entry[1] >= deadline:
+                    break
+                del self._sessions[session_id]
+                removed += 1
+            self.expired += removed
+        return removed
+
+    def start_sweeper(self):
+        """Start the background sweeping thread (idempotent)"""
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+        self._stop.clear()
+        self._sweeper = threading.Thread(target=self._sweep_loop, name="session-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join(timeout=self.sweep_interval)
+            self._sweeper = None
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval):
+            self.sweep()
+
+    def stats(self) -> dict:
+        """Counters for live, created, evicted and expired sessions"""
+        return {
+            "live": len(self._sessions),
+            "created": self.created,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "max_sessions": self.max_sessions,
+            "ttl_seconds": self.ttl_seconds,
+            "backend": "memory",
+        }
+
+
+class _SweeperMixin:
+    """Background sweeping thread shared by the external backends"""
+
+    def start_sweeper(self):
+        if getattr(self, "_sweeper", None) is not None and self._sweeper.is_alive():
+            return
+        self._stop = threading.Event()
+        self._sweeper = threading.Thread(target=self._sweep_loop, name="session-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        if getattr(self, "_sweeper", None) is not None:
+            self._stop.set()
+            self._sweeper.join(timeout=self.sweep_interval)
+            self._sweeper = None
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Session sweep failed: {e}")
+
+
+class SQLiteSessionStore(_SweeperMixin):
+    """
+    Sessions in a SQLite database in WAL mode, so several worker processes on
+    the same host can read and write concurrently. Counters are kept in the
+    database as well and are therefore shared by all workers.
+    """
+
+    def __init__(self, path: str, encode: Callable[[Any], str], decode: Callable[[str], Any],
+                 ttl_seconds: float = 1800, max_sessions: int = 10000, sweep_interval: float = 60):
+        self.path = path
+        self.encode = encode
+        self.decode = decode
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.sweep_interval = sweep_interval
+        self._local = threading.local()
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, data TEXT NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions(last_access)")
+            conn.execute("CREATE TABLE IF NOT EXISTS session_counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.executemany(
+                "INSERT OR IGNORE INTO session_counters VALUES (?, 0)",
+                [("created",), ("evicted",), ("expired",)]
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _count(self, conn, name, amount):
+        if amount:
+            conn.execute("UPDATE session_counters SET value = value + ? WHERE name = ?", (amount, name))
+
+    def __len__(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def get(self, session_id: str) -> Optional[Any]:
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute("SELECT data, last_access FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > self.ttl_seconds:
+            with self._transaction() as conn:
+                if conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount:
+                    self._count(conn, "expired", 1)
+            return None
+        conn.execute("UPDATE sessions SET last_access = ? WHERE id = ?", (now, session_id))
+        return self.decode(row[0])
+
+    def put(self, session_id: str, session: Any):
+        data = self.encode(session)
+        now = time.time()
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE sessions SET data = ?, last_access = ? WHERE id = ?", (data, now, session_id)
+            ).rowcount
+            if updated:
+                return
+            conn.execute("INSERT INTO sessions VALUES (?, ?, ?)", (session_id, data, now))
+            self._count(conn, "created", 1)
+            excess = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] - self.max_sessions
+            if excess > 0:
+                evicted = conn.execute(
+                    "DELETE FROM sessions WHERE id IN "
+                    "(SELECT id FROM sessions ORDER BY last_access LIMIT ?)", (excess,)
+                ).rowcount
+                self._count(conn, "evicted", evicted)
+
+    def delete(self, session_id: str):
+        self._connect().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def sweep(self) -> int:
+        with self._transaction() as conn:
+            removed = conn.execute(
+                "DELETE FROM sessions WHERE last_access < ?", (time.time() - self.ttl_seconds,)
+            ).rowcount
+            self._count(conn, "expired", removed)
+        return removed
+
+    def stats(self) -> dict:
+        counters = dict(self._connect().execute("SELECT name, value FROM session_counters").fetchall())
+        return {
+            "live": len(self),
+            "created": counters.get("created", 0),
+            "evicted": counters.get("evicted", 0),
+            "expired": counters.get("expired", 0),
+            "max_sessions": self.max_sessions,
+            "ttl_seconds": self.ttl_seconds,
+            "backend": "sqlite",
+        }
+
+
+class RedisSessionStore(_SweeperMixin):
+    """
+    Sessions in a Redis-protocol server. Each session is a key whose expiry is
+    the idle TTL (refreshed on access); a sorted set ordered by last access
+    implements LRU eviction and live counts across all workers and hosts.
+    """
+
+    def __init__(self, encode: Callable[[Any], str], decode: Callable[[str], Any],
+                 url: str = "redis://localhost:6379/0", client=None, prefix: str = "codex:session",
+                 ttl_seconds: float = 1800, max_sessions: int = 10000, sweep_interval: float = 60):
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise RuntimeError("The redis session backend requires the 'redis' package") from e
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.encode = encode
+        self.decode = decode
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.sweep_interval = sweep_interval
+        self._lru_key = f"{prefix}s:lru"
+        self._counters_key = f"{prefix}s:counters"
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}:{session_id}"
+
+    def __len__(self) -> int:
+        return self.client.zcard(self._lru_key)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def get(self, session_id: str) -> Optional[Any]:
+        ttl = max(1, int(self.ttl_seconds))
+        pipe = self.client.pipeline()
+        pipe.get(self._key(session_id))
+        pipe.expire(self._key(session_id), ttl)
+        data, _ = pipe.execute()
+        if data is None:
+            if self.client.zrem(self._lru_key, session_id):
+                self.client.hincrby(self._counters_key, "expired", 1)
+            return None
+        self.client.zadd(self._lru_key, {session_id: time.time()})
+        return self.decode(data.decode("utf-8") if isinstance(data, bytes) else data)
+
+    def put(self, session_id: str, session: Any):
+        pipe = self.client.pipeline()
+        pipe.set(self._key(session_id), self.encode(session), ex=max(1, int(self.ttl_seconds)))
+        pipe.zadd(self._lru_key, {session_id: time.time()})
+        _, added = pipe.execute()
+        if not added:
+            return
+        self.client.hincrby(self._counters_key, "created", 1)
+        excess = self.client.zcard(self._lru_key) - self.max_sessions
+        if excess > 0:
+            oldest = [member for member, _ in self.client.zpopmin(self._lru_key, excess)]
+            if oldest:
+                ids = [m.decode("utf-8") if isinstance(m, bytes) else m for m in oldest]
+                self.client.delete(*[self._key(i) for i in ids])
+                self.client.hincrby(self._counters_key, "evicted", len(ids))
+
+    def delete(self, session_id: str):
+        pipe = self.client.pipeline()
+        pipe.delete(self._key(session_id))
+        pipe.zrem(self._lru_key, session_id)
+        pipe.execute()
+
+    def sweep(self) -> int:
+        # Session keys expire on their own; drop their LRU entries and count them
+        removed = self.client.zremrangebyscore(self._lru_key, "-inf", time.time() - self.ttl_seconds)
+        if removed:
+            self.client.hincrby(self._counters_key, "expired", removed)
+        return removed
+
+    def stats(self) -> dict:
+        counters = {
+            (k.decode("utf-8") if isinstance(k, bytes) else k): int(v)
+            for k, v in self.client.hgetall(self._counters_key).items()
+        }
+        return {
+            "live": len(self),
+            "created": counters.get("created", 0),
+            "evicted": counters.get("evicted", 0),
+            "expired": counters.get("expired", 0),
+            "max_sessions": self.max_sessions,
+            "ttl_seconds": self.ttl_seconds,
+            "backend": "redis",
+        }
+
+
+def create_session_store(encode: Callable[[Any], str], decode: Callable[[str], Any], **limits):
+    """
+    Build the session store selected by CODEX_SESSION_BACKEND ("memory",
+    "sqlite" or "redis"). CODEX_SESSION_URL is the SQLite file path or the
+    Redis URL.
+    """
+    backend = os.environ.get("CODEX_SESSION_BACKEND", "memory")
+    url = os.environ.get("CODEX_SESSION_URL")
+    if backend == "sqlite":
+        return SQLiteSessionStore(url or "codex_sessions.db", encode, decode, **limits)
+    if backend == "redis":
+        return RedisSessionStore(encode, decode, url=url or "redis://localhost:6379/0", **limits)
+    if backend != "memory":
+        raise ValueError(f"Unknown session backend: {backend}")
+    return SessionStore(**limits)
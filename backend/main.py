@@ -1,11 +1,44 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional
-from backend.agents.deterministic import run_deterministic_agent
-from backend.agents.probabilistic import run_probabilistic_agent
+from pydantic import BaseModel, ValidationError
+from typing import Any, Optional, List
+from backend.agents.deterministic import (
+    run_deterministic_batch, diagnostico_en_cache, cache_diagnosticos, escenarios_deterministas
+)
+from backend.agents.probabilistic import (
+    run_probabilistic_agent, run_probabilistic_batch, analisis_que_pasaria,
+    CAMPO_NODO, NODO_DE_CAMPO, ESTADO_MODELO
+)
+from backend.agents.knowledge_base import kb_cache
+from backend.agents.pipeline import Overloaded, pipeline
+from backend.agents.audit import audit_log, diagnosis_record
+from backend.agents.aggregates import WINDOWS, aggregates
+from backend.agents import bulk, metrics
+import codecs
+import logging
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from backend.agents.conversational import sessions
+    sessions.start_sweeper()
+    pipeline.start()
+    audit_log.start()
+    aggregates.start()
+    yield
+    pipeline.stop()
+    sessions.stop_sweeper()
+    audit_log.stop()
+    aggregates.stop()
 
-app = FastAPI(title="Agente Infectólogo Dual", version="1.0")
+app = FastAPI(title="Agente Infectólogo Dual", version="1.0", lifespan=lifespan)
 
 # Enable CORS
 app.add_middleware(
@@ -16,6 +49,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency histograms, only when CODEX_METRICS=1
+if metrics.ENABLED:
+    app.add_middleware(metrics.RouteTimingMiddleware, histogram=metrics.HTTP_REQUEST_SECONDS)
+
 class PatientData(BaseModel):
     fiebre: bool
     temperatura: Optional[float] = None
@@ -34,47 +71,316 @@ class PatientData(BaseModel):
     sangrado_mucosas: Optional[bool] = False
     disnea: Optional[bool] = False
     language: Optional[str] = "es"  # Language for results
+    trace_format: Optional[str] = "text"  # "text", "structured" or "none"
 
 @app.get("/")
 def read_root():
     return {"status": "Online", "system": "Agente Infectólogo TP4"}
 
+@app.get("/health")
+def health():
+    """Liveness check with the active knowledge base version"""
+    return {"status": "ok", "kb": kb_cache.info()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Prometheus scrape endpoint: stage/route latency histograms and pool, cache and session counters"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/ready")
+def ready():
+    """Readiness check: the Bayesian model artifact and the knowledge base are loaded"""
+    kb = kb_cache.info()
+    is_ready = ESTADO_MODELO["cargado"] and kb["version"] != "unavailable"
+    body = {"ready": is_ready, "model": ESTADO_MODELO, "kb": kb}
+    return body if is_ready else JSONResponse(status_code=503, content=body)
+
+def overloaded_error(e: Overloaded) -> HTTPException:
+    """503 with Retry-After when an agent queue is full"""
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+# Failures of the cache-hit fast path of /diagnose (served through the pools instead)
+fast_path_errors = 0
+
 @app.post("/diagnose")
-def diagnose(patient: PatientData):
+async def diagnose(patient: PatientData):
+    """
+    Run both agents concurrently on the agent pool. If one of them fails or
+    exceeds its timeout, its entry carries an "error" and the other result is
+    still returned. Answers 503 with Retry-After when the agent queues are full.
+    Every answer is recorded in the audit log, off the request path, and
+    counted in the epidemiological aggregates.
+    """
+    started = time.perf_counter()
     # Convert to dict for agents
     patient_dict = patient.dict()
     lang = patient_dict.get('language', 'es')
-    
-    # 1. Deterministic Analysis
+    trace_format = patient_dict.get('trace_format') or "text"
+
+    # Cache hit: answer inline without dispatching to the agent pools. A cache
+    # lookup plus a posterior table lookup is cheap enough to run on the event
+    # loop, so the thread hand-offs to the pools are skipped. This deliberately
+    # bypasses the pipeline's admission control and per-agent timeouts, and a
+    # hit reports no pool wait time. A failure here is logged and counted, and
+    # the request falls back to the pools.
+    timings = {}
+    results = None
+    try:
+        det_result = diagnostico_en_cache(patient_dict, lang, trace_format)
+        if det_result is not None:
+            timings["deterministic"] = time.perf_counter() - started
+            results = {
+                "deterministic": det_result,
+                "probabilistic": run_probabilistic_agent(patient_dict, lang, trace_format)
+            }
+            timings["probabilistic"] = time.perf_counter() - started - timings["deterministic"]
+    except Exception as e:
+        global fast_path_errors
+        fast_path_errors += 1
+        results = None
+        logger.exception("Cached diagnosis fast path failed, using the agent pools: %r", e)
+
+    if results is None:
+        try:
+            results = await pipeline.diagnose(patient_dict, lang, trace_format, timings)
+        except Overloaded as e:
+            raise overloaded_error(e)
+    aggregates.observe(patient_dict, results)
+    if audit_log.enabled:
+        await audit_log.push_async(diagnosis_record(
+            "diagnose", patient_dict, results, timings, time.perf_counter() - started
+        ))
+    return {
+        "deterministic": results["deterministic"],
+        "probabilistic": results["probabilistic"]
+    }
+
+@app.get("/diagnose/stats")
+def diagnose_stats():
+    """Per-agent pool counters (queue depth, wait time, outcomes) and response cache hit rate"""
+    return dict(pipeline.stats(), cache=dict(cache_diagnosticos.stats(), fast_path_errors=fast_path_errors),
+                bulk=bulk.active_jobs(), audit=audit_log.stats())
+
+@app.get("/diagnose/aggregates")
+def diagnose_aggregates(window: Optional[str] = Query(None, pattern=f"^({'|'.join(WINDOWS)})$")):
+    """
+    Rolling counts of classifications, alarm signs and average posterior
+    probabilities by lugar and estacion, over the last minute, hour and day
+    (or only `window`), merged across workers
+    """
+    return aggregates.query(window)
+
+# Findings flipped by /diagnose/whatif: the Bayesian network's evidence fields
+# (in NODOS_EVIDENCIA order) followed by the alarm signs and comorbidities that
+# only the deterministic agent reads
+WHATIF_FINDINGS = [campo for campo, _ in CAMPO_NODO.values()] + [
+    "dolor_abdominal_intenso", "sangrado_mucosas", "asma", "hipertension"
+]
+WHATIF_FLIP = {"lugar": ("Corrientes", "Otro"), "estacion": ("Verano", "Invierno")}
+
+def flipped_value(field: str, value):
+    if field in WHATIF_FLIP:
+        positive, negative = WHATIF_FLIP[field]
+        return negative if value == positive else positive
+    return not value
+
+def _percent(p) -> float:
+    return round(float(p) * 100, 2)
+
+@app.post("/diagnose/whatif")
+def diagnose_whatif(patient: PatientData):
+    """
+    What-if analysis for one patient: posteriors, deterministic scores and
+    classification of the patient and of every single-finding flip, plus each
+    network finding's log-likelihood-ratio contribution (nats, given the rest
+    of the evidence; positive pushes the disease up). The deterministic agent
+    scores all variants in one batch and the posteriors come from the compiled
+    table in one lookup.
+    """
+    patient_dict = patient.dict()
+    variants = [patient_dict] + [
+        dict(patient_dict, **{field: flipped_value(field, patient_dict.get(field))})
+        for field in WHATIF_FINDINGS
+    ]
+    scenarios = escenarios_deterministas(variants, patient_dict.get("language") or "es")
+    base, flipped, contributions = analisis_que_pasaria(patient_dict)
+    nodes = list(CAMPO_NODO)
+
+    def entry(scenario, posteriors):
+        return dict(
+            dengue_probability=_percent(posteriors[0]),
+            covid_probability=_percent(posteriors[1]),
+            both_probability=_percent(posteriors[2]),
+            **scenario
+        )
+
+    base_entry = entry(scenarios[0], base)
+    findings = []
+    for field, scenario in zip(WHATIF_FINDINGS, scenarios[1:]):
+        node = NODO_DE_CAMPO.get(field)
+        i = nodes.index(node) if node else None
+        result = entry(scenario, flipped[i] if node else base)
+        findings.append(dict(
+            field=field,
+            node=node,
+            value=patient_dict.get(field),
+            flipped_value=flipped_value(field, patient_dict.get(field)),
+            flipped=result,
+            delta={
+                "dengue_probability": round(result["dengue_probability"] - base_entry["dengue_probability"], 2),
+                "covid_probability": round(result["covid_probability"] - base_entry["covid_probability"], 2),
+            },
+            log_lr=None if node is None else {
+                "dengue": round(float(contributions[i, 0]), 4),
+                "covid": round(float(contributions[i, 1]), 4),
+            },
+        ))
+    return {"model_version": ESTADO_MODELO["version"], "base": base_entry, "findings": findings}
+
+MAX_BATCH_SIZE = 5000
+
+@app.post("/diagnose/batch")
+def diagnose_batch(patients: List[Any]):
+    """
+    Diagnose a list of patients in one request. Each item is validated on its
+    own, so invalid items are reported with their index without failing the
+    rest of the batch. Both agents run once over all valid patients.
+    """
+    if len(patients) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {MAX_BATCH_SIZE} patients)")
+
+    results = [None] * len(patients)
+    valid_indices = []
+    valid_patients = []
+    for i, raw in enumerate(patients):
+        try:
+            valid_patients.append(PatientData(**raw).dict())
+            valid_indices.append(i)
+        except (ValidationError, TypeError) as e:
+            results[i] = {"index": i, "error": str(e)}
+
     try:
-        det_result = run_deterministic_agent(patient_dict, lang)
+        det_results = run_deterministic_batch(valid_patients)
     except Exception as e:
-        det_result = {"error": str(e)}
+        det_results = [{"error": str(e)}] * len(valid_patients)
 
-    # 2. Probabilistic Analysis
     try:
-        prob_result = run_probabilistic_agent(patient_dict, lang)
+        prob_results = run_probabilistic_batch(valid_patients)
     except Exception as e:
-        prob_result = {"error": str(e)}
-    
+        prob_results = [{"error": str(e)}] * len(valid_patients)
+
+    for i, det_result, prob_result in zip(valid_indices, det_results, prob_results):
+        results[i] = {
+            "index": i,
+            "deterministic": det_result,
+            "probabilistic": prob_result
+        }
+
     return {
-        "deterministic": det_result,
-        "probabilistic": prob_result
+        "count": len(patients),
+        "errors": len(patients) - len(valid_indices),
+        "results": results
     }
 
+BULK_PROCESSES = int(os.environ.get("CODEX_BULK_PROCESSES", 0))
+BULK_SPOOL_BYTES = 8 * 1024 * 1024
+
+@app.post("/diagnose/stream")
+async def diagnose_stream(
+    request: Request,
+    input_format: str = Query("csv", pattern="^(csv|jsonl)$"),
+    output_format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    start: int = Query(0, ge=0),
+    language: str = Query("es", pattern="^(es|en)$"),
+    trace_format: str = Query("none", pattern="^(none|text|structured)$"),
+    chunk_size: int = Query(bulk.DEFAULT_CHUNK_SIZE, ge=1, le=MAX_BATCH_SIZE),
+    columns: List[str] = Query([], alias="map"),
+):
+    """
+    Score a CSV or JSONL file of patients (request body) and stream one result
+    per record as NDJSON or CSV. The upload is spooled to disk past 8 MB and
+    scored chunk by chunk, so memory stays constant. Each result carries the
+    index of its record; `start` resumes after the last index received.
+    Columns are renamed with `map=column=field` (repeatable).
+    """
+    try:
+        mapping = bulk.parse_mapping(columns)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    spool = tempfile.SpooledTemporaryFile(max_size=BULK_SPOOL_BYTES)
+    async for data in request.stream():
+        spool.write(data)
+    spool.seek(0)
+
+    def results():
+        text = codecs.getreader("utf-8-sig")(spool)
+        try:
+            scored = bulk.score_records(
+                bulk.read_records(text, input_format), mapping, language, trace_format,
+                chunk_size, BULK_PROCESSES, start
+            )
+            yield from bulk.render(scored, output_format)
+        finally:
+            spool.close()
+
+    media_type = "application/x-ndjson" if output_format == "ndjson" else "text/csv"
+    return StreamingResponse(results(), media_type=media_type)
+
 # ===== CONVERSATIONAL ENDPOINTS =====
 from backend.agents.conversational import (
-    create_session, process_answer, get_next_question, get_session_messages
+    create_session, process_answer, get_next_question, get_session_messages, sessions,
+    apply_answer, current_question, session_messages
 )
 
+def _service_metrics():
+    """Agent pool, diagnosis cache, chat session and audit log counters for /metrics"""
+    pool = pipeline.stats()["agents"]
+    cache = cache_diagnosticos.stats()
+    chat = sessions.stats()
+    audit = audit_log.stats()
+    return [
+        ("codex_agent_in_flight", "gauge", "Agent calls admitted and not finished.",
+         [({"agent": name}, a["in_flight"]) for name, a in pool.items()]),
+        ("codex_agent_queue_depth", "gauge", "Agent calls waiting for a worker.",
+         [({"agent": name}, a["queue_depth"]) for name, a in pool.items()]),
+        ("codex_agent_calls_total", "counter", "Agent calls by outcome.",
+         [({"agent": name, "outcome": outcome}, a[outcome]) for name, a in pool.items()
+          for outcome in ("completed", "timed_out", "failed", "rejected")]),
+        ("codex_agent_wait_seconds", "summary", "Time agent calls waited in the queue for a worker.",
+         [({"agent": name}, (a["wait_seconds"]["sum"], a["wait_seconds"]["count"]))
+          for name, a in pool.items()]),
+        ("codex_diagnosis_cache_lookups_total", "counter", "Diagnosis cache lookups by result.",
+         [({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"])]),
+        ("codex_diagnosis_cache_entries", "gauge", "Entries in the diagnosis cache.",
+         [({}, cache["entries"])]),
+        ("codex_diagnosis_cache_fast_path_errors_total", "counter",
+         "Cache-hit fast path failures of /diagnose, served through the agent pools instead.",
+         [({}, fast_path_errors)]),
+        ("codex_chat_sessions", "gauge", "Live chat sessions.",
+         [({"backend": chat.get("backend", "memory")}, chat.get("live", 0))]),
+        ("codex_audit_records_total", "counter", "Audit records by outcome.",
+         [({"outcome": outcome}, audit[outcome])
+          for outcome in ("written", "dropped", "spilled", "blocked", "failed")]),
+        ("codex_audit_buffered", "gauge", "Audit records waiting in the ring buffer.",
+         [({}, audit["buffered"])]),
+    ]
+
+metrics.collectors.append(_service_metrics)
+
 @app.post("/chat/start")
 def start_chat(request: dict = None):
-    """Initialize a new chat session"""
+    """
+    Initialize a new chat session. Optional "mode" ("fixed" or "adaptive"
+    question ordering) and "early_stop" (end once the result is decisive).
+    """
     lang = "es"  # default
     if request and "language" in request:
         lang = request["language"] if request["language"] in ["es", "en"] else "es"
+    mode = request.get("mode") if request else None
+    early_stop = request.get("early_stop") if request else None
     
-    session_id = create_session(lang)
+    session_id = create_session(lang, mode, early_stop)
     first_question = get_next_question(session_id)
     
     return {
@@ -87,7 +393,10 @@ def send_message(session_id: str, message: dict):
     """Process a user message in the chat"""
     answer = message.get("answer", "")
     
-    result = process_answer(session_id, answer)
+    try:
+        result = process_answer(session_id, answer)
+    except Overloaded as e:
+        raise overloaded_error(e)
     
     return result
 
@@ -96,3 +405,87 @@ def get_history(session_id: str):
     """Get chat history"""
     messages = get_session_messages(session_id)
     return {"messages": messages}
+
+@app.get("/chat/stats")
+def chat_stats():
+    """Live, evicted and expired session counters"""
+    return sessions.stats()
+
+def _ws_open(session_id: str, resumed: bool):
+    """Load a session for a WebSocket; returns (session, first message)"""
+    session = sessions.get(session_id)
+    if session is None:
+        return None, {"type": "error", "error": "Session not found"}
+    step = session.step
+    question = current_question(session)
+    if session.step != step:
+        sessions.put(session_id, session)
+    message = {"type": "session", "session_id": session_id, "question": question,
+               "completed": question is None}
+    if resumed:
+        message["messages"] = session_messages(session)
+    return session, message
+
+def _ws_answer(session_id: str, session, answer: str) -> dict:
+    result = apply_answer(session, answer)
+    if "error" not in result:
+        # Write-through, so a reconnect (to any worker) resumes from here
+        sessions.put(session_id, session)
+    return result
+
+@app.websocket("/chat/ws")
+async def chat_websocket(websocket: WebSocket, session_id: Optional[str] = None):
+    """
+    Whole triage session over one connection. The session is loaded once and
+    kept in the handler instead of being looked up on every answer; each
+    answer is written through to the session store, so after a reconnect the
+    client resumes with its session id (`?session_id=` or a "resume" message).
+
+    Client messages: {"type": "start", "language", "mode", "early_stop"},
+    {"type": "resume", "session_id"} and {"type": "answer", "answer"}.
+    Server messages: "session" (id and current question, plus the history on
+    resume), "question" and "diagnosis" (same fields as the HTTP answers) and
+    "error" (with "retry_after" when the agent queues are full).
+    """
+    await websocket.accept()
+    session = None
+    if session_id:
+        session, message = await run_in_threadpool(_ws_open, session_id, True)
+        await websocket.send_json(message)
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except ValueError:
+                await websocket.send_json({"type": "error", "error": "Invalid JSON"})
+                continue
+            kind = message.get("type") if isinstance(message, dict) else None
+
+            if kind == "start":
+                lang = message.get("language") if message.get("language") in ["es", "en"] else "es"
+                session_id = await run_in_threadpool(
+                    create_session, lang, message.get("mode"), message.get("early_stop")
+                )
+                session, reply = await run_in_threadpool(_ws_open, session_id, False)
+            elif kind == "resume":
+                session_id = str(message.get("session_id", ""))
+                session, reply = await run_in_threadpool(_ws_open, session_id, True)
+            elif kind == "answer":
+                if session is None:
+                    reply = {"type": "error", "error": "No session: send start or resume first"}
+                else:
+                    try:
+                        result = await run_in_threadpool(
+                            _ws_answer, session_id, session, str(message.get("answer", ""))
+                        )
+                    except Overloaded as e:
+                        result = {"error": str(e), "retry_after": e.retry_after}
+                    if "error" in result:
+                        reply = dict(result, type="error")
+                    else:
+                        reply = dict(result, type="diagnosis" if result["completed"] else "question")
+            else:
+                reply = {"type": "error", "error": f"Unknown message type: {kind}"}
+            await websocket.send_json(reply)
+    except WebSocketDisconnect:
+        pass
@@ -0,0 +1,266 @@
+"""
+Benchmark suite for CoDeX.
+
+Levels:
+- agents in isolation: run_deterministic_agent (with and without the
+  diagnosis cache), run_probabilistic_agent and both batch entry points;
+- end to end: POST /diagnose through the ASGI app in process;
+- chat: full sessions driven through /chat/start and /chat/{id}/message.
+
+Each scenario reports throughput, latency percentiles and peak traced memory
+(tracemalloc, measured in a separate pass so it does not skew timings) as
+JSON, so runs from different commits can be compared:
+
+    python -m benchmarks.bench --output before.json
+    python -m benchmarks.bench --output after.json --compare before.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+try:
+    import httpx
+except ImportError:  # required by the ASGI and chat scenarios, see main()
+    httpx = None
+
+from benchmarks.patients import patients as make_patients
+
+warnings.filterwarnings("ignore", category=FutureWarning)
+
+API_FIELDS = (
+    "fiebre", "temperatura", "tos", "dolor_garganta", "dolor_retroocular", "mialgia",
+    "anosmia", "asma", "hipertension", "viaje_brasil", "contacto_dengue", "lugar",
+    "estacion", "dolor_abdominal_intenso", "sangrado_mucosas", "disnea", "language",
+)
+
+
+def summarize(latencies_ns: List[int], seconds: float, units: int) -> dict:
+    latencies = np.asarray(latencies_ns, dtype=np.float64) / 1e3
+    return {
+        "n": len(latencies_ns),
+        "units": units,
+        "seconds": round(seconds, 6),
+        "throughput_per_s": round(units / seconds, 2) if seconds else None,
+        "latency_us": {
+            "p50": round(float(np.percentile(latencies, 50)), 2),
+            "p90": round(float(np.percentile(latencies, 90)), 2),
+            "p99": round(float(np.percentile(latencies, 99)), 2),
+            "mean": round(float(latencies.mean()), 2),
+            "max": round(float(latencies.max()), 2),
+        },
+    }
+
+
+def peak_memory_kb(run: Callable[[], None]) -> float:
+    """Peak memory traced while `run()` executes"""
+    tracemalloc.start()
+    try:
+        run()
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def bench_calls(fn: Callable, items: list, warmup: int, units_per_item: int = 1) -> dict:
+    for item in items[:warmup]:
+        fn(item)
+    latencies = []
+    start = time.perf_counter()
+    for item in items:
+        t0 = time.perf_counter_ns()
+        fn(item)
+        latencies.append(time.perf_counter_ns() - t0)
+    result = summarize(latencies, time.perf_counter() - start, len(items) * units_per_item)
+    result["peak_memory_kb"] = peak_memory_kb(lambda: [fn(item) for item in items])
+    return result
+
+
+def agent_scenarios(pats: List[dict], warmup: int, batch_size: int) -> Dict[str, dict]:
+    from backend.agents.deterministic import (
+        cache_diagnosticos, run_deterministic_agent, run_deterministic_batch
+    )
+    from backend.agents.probabilistic import run_probabilistic_agent, run_probabilistic_batch
+
+    results = {}
+    max_entries = cache_diagnosticos.max_entries
+    try:
+        cache_diagnosticos.max_entries = 0
+        cache_diagnosticos.clear()
+        results["deterministic_uncached"] = bench_calls(
+            lambda p: run_deterministic_agent(p, p["language"]), pats, warmup)
+    finally:
+        cache_diagnosticos.max_entries = max_entries
+    results["deterministic"] = bench_calls(
+        lambda p: run_deterministic_agent(p, p["language"]), pats, warmup)
+    results["deterministic"]["cache"] = cache_diagnosticos.stats()
+    results["probabilistic"] = bench_calls(
+        lambda p: run_probabilistic_agent(p, p["language"]), pats, warmup)
+
+    batches = [pats[i:i + batch_size] for i in range(0, len(pats), batch_size)]
+    for name, fn in (("deterministic_batch", run_deterministic_batch),
+                     ("probabilistic_batch", run_probabilistic_batch)):
+        results[name] = bench_calls(fn, batches, 1)
+        results[name]["units"] = len(pats)
+        results[name]["throughput_per_s"] = round(len(pats) / results[name]["seconds"], 2)
+        results[name]["batch_size"] = batch_size
+    return results
+
+
+async def _asgi_scenarios(pats: List[dict], warmup: int, sessions: int, seed: int,
+                          concurrency: int) -> Dict[str, dict]:
+    from backend.main import app
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            bodies = [{k: p[k] for k in API_FIELDS if k in p} for p in pats]
+
+            async def diagnose(body):
+                response = await client.post("/diagnose", json=body)
+                response.raise_for_status()
+
+            for body in bodies[:warmup]:
+                await diagnose(body)
+            results["asgi_diagnose"] = await _bench_async(diagnose, bodies, concurrency)
+
+            rng = random.Random(seed)
+            message_latencies = []
+
+            async def chat_session(lang):
+                start = await client.post("/chat/start", json={"language": lang})
+                payload = start.json()
+                session_id, question = payload["session_id"], payload["question"]
+                while question is not None:
+                    answer = _chat_answer(question, rng)
+                    t0 = time.perf_counter_ns()
+                    reply = (await client.post(f"/chat/{session_id}/message",
+                                               json={"answer": answer})).json()
+                    message_latencies.append(time.perf_counter_ns() - t0)
+                    question = None if reply.get("completed") else reply.get("next_question")
+
+            languages = ["es", "en"] * (sessions // 2 + 1)
+            results["chat_session"] = await _bench_async(chat_session, languages[:sessions], concurrency)
+            results["chat_message"] = summarize(
+                message_latencies, sum(message_latencies) / 1e9, len(message_latencies))
+    return results
+
+
+async def _bench_async(fn, items: list, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(latencies):
+        async def timed(item):
+            async with semaphore:
+                t0 = time.perf_counter_ns()
+                await fn(item)
+                latencies.append(time.perf_counter_ns() - t0)
+        await asyncio.gather(*(timed(item) for item in items))
+
+    latencies = []
+    start = time.perf_counter()
+    await run(latencies)
+    result = summarize(latencies, time.perf_counter() - start, len(items))
+
+    # Second pass with tracing on, only for the memory peak
+    tracemalloc.start()
+    try:
+        await run([])
+        result["peak_memory_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+    result["concurrency"] = concurrency
+    return result
+
+
+def _chat_answer(question: dict, rng: random.Random) -> str:
+    if question["type"] == "number":
+        return f"{rng.gauss(38.6, 0.7):.1f}"
+    return rng.choice(question["options"])
+
+
+def metadata(args) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    from backend.agents.probabilistic import BACKEND, VERSION_MODELO
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "patients": args.patients,
+        "seed": args.seed,
+        "probabilistic_backend": BACKEND,
+        "model_version": VERSION_MODELO,
+    }
+
+
+def compare(base: dict, current: dict) -> str:
+    """Text table of throughput and p99 ratios (current / base) per scenario"""
+    lines = [f"{'scenario':<24}{'throughput':>14}{'ratio':>8}{'p99 us':>12}{'ratio':>8}"]
+    for name, result in current["scenarios"].items():
+        old = base.get("scenarios", {}).get(name)
+        throughput, p99 = result["throughput_per_s"], result["latency_us"]["p99"]
+        if old is None:
+            lines.append(f"{name:<24}{throughput:>14}{'new':>8}{p99:>12}{'new':>8}")
+            continue
+        lines.append(
+            f"{name:<24}{throughput:>14}{throughput / old['throughput_per_s']:>8.2f}"
+            f"{p99:>12}{p99 / old['latency_us']['p99']:>8.2f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--patients", type=int, default=4096, help="synthetic patients per scenario")
+    parser.add_argument("--sessions", type=int, default=200, help="chat sessions to run")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--concurrency", type=int, default=1, help="in-flight ASGI requests")
+    parser.add_argument("--skip-asgi", action="store_true", help="only benchmark the agents")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--compare", help="previous JSON result to compare against")
+    args = parser.parse_args(argv)
+    if httpx is None and not args.skip_asgi:
+        parser.error("the ASGI and chat scenarios need httpx (pip install -r requirements.txt); "
+                     "pass --skip-asgi to run only the agents")
+
+    pats = make_patients(args.patients, args.seed)
+    scenarios = agent_scenarios(pats, args.warmup, args.batch_size)
+    if not args.skip_asgi:
+        scenarios.update(asyncio.run(_asgi_scenarios(
+            pats, args.warmup, args.sessions, args.seed, args.concurrency)))
+
+    report = {"meta": metadata(args), "scenarios": scenarios}
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print(compare(json.load(f), report), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,515 @@
+"""
+Load generator for CoDeX: drives a running server over HTTP with simulated
+triage users, to find how much traffic one host can serve.
+
+Each simulated user holds its own keep-alive connection (raw HTTP/1.1 over
+asyncio streams, so thousands of clients fit in one process) and runs one of:
+- "diagnose": a form submission to POST /diagnose;
+- "chat": a full session through /chat/start and /chat/{id}/message, with a
+  log-normal think time before every answer, polling /chat/{id}/history after
+  some answers (--history-prob).
+Patients come from benchmarks.patients and chat answers follow the patient.
+
+Closed loop (--users N): N users repeat scenarios for --duration seconds.
+Open loop (--rate R1,R2,...): users arrive as a Poisson process at each rate
+for --step-seconds, whatever the server's response times, so queueing shows
+up as latency and errors instead of a lower offered load. A step is marked
+saturated when its error rate, a route p99 or client-side shedding
+(--max-clients in flight) crosses the limits.
+
+The report (JSON) has per-route latency histograms and percentiles, status
+counts and error rates, throughput per step, and a timeline of requests,
+errors and server RSS (process_resident_memory_bytes from /metrics, which
+with several workers is the worker that answered; pass --pid to sum the RSS
+of a process tree from /proc instead):
+
+    uvicorn backend.main:app --workers 4 &
+    python -m benchmarks.load --users 2000 --duration 60 --output closed.json
+    python -m benchmarks.load --rate 50,100,200,400 --step-seconds 30 --output open.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from backend.agents.metrics import LATENCY_BUCKETS
+from benchmarks.bench import API_FIELDS
+from benchmarks.patients import iter_patients
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+ROUTES = ("POST /diagnose", "POST /chat/start", "POST /chat/{id}/message", "GET /chat/{id}/history")
+
+
+class HTTPError(Exception):
+    pass
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection, reopened when idle or closed by the server"""
+
+    def __init__(self, host: str, port: int, keepalive: float):
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.last_used = 0.0
+
+    async def _open(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def request(self, method: str, path: str, body: Optional[bytes] = None) -> Tuple[int, bytes]:
+        # The server drops idle connections (uvicorn: after 5 s), so reconnect before that
+        if self.writer is not None and time.monotonic() - self.last_used > self.keepalive:
+            self.close()
+        reused = self.writer is not None
+        try:
+            return await self._exchange(method, path, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            if not reused:
+                raise
+        return await self._exchange(method, path, body)  # stale keep-alive: retry once on a new socket
+
+    async def _exchange(self, method: str, path: str, body: Optional[bytes]) -> Tuple[int, bytes]:
+        if self.writer is None:
+            await self._open()
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+        if body is not None:
+            head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        self.writer.write(head.encode("ascii") + b"\r\n" + (body or b""))
+        await self.writer.drain()
+
+        status_line = await self.reader.readuntil(b"\r\n")
+        parts = status_line.split(None, 2)
+        if len(parts) < 2:
+            raise HTTPError(f"Bad status line: {status_line!r}")
+        status = int(parts[1])
+        headers = {}
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            payload = b"".join(chunks)
+        else:
+            payload = await self.reader.readexactly(int(headers.get("content-length", 0)))
+
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        self.last_used = time.monotonic()
+        return status, payload
+
+
+class Step:
+    """Results of one load level (the whole run in closed loop)"""
+
+    def __init__(self, name: str, offered_rate: Optional[float]):
+        self.name = name
+        self.offered_rate = offered_rate
+        self.started = time.monotonic()
+        self.ended: Optional[float] = None
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.arrivals = 0
+        self.shed = 0
+        self.scenarios: Counter = Counter()
+
+
+class Recorder:
+    def __init__(self):
+        self.t0 = time.monotonic()
+        self.steps: List[Step] = []
+        self.step: Optional[Step] = None
+        self.timeline: Dict[int, dict] = {}
+
+    def begin(self, name: str, offered_rate: Optional[float] = None):
+        if self.step is not None:
+            self.step.ended = time.monotonic()
+        self.step = Step(name, offered_rate)
+        self.steps.append(self.step)
+
+    def finish(self):
+        if self.step is not None and self.step.ended is None:
+            self.step.ended = time.monotonic()
+
+    def _second(self) -> dict:
+        second = int(time.monotonic() - self.t0)
+        return self.timeline.setdefault(second, {"t": second, "requests": 0, "errors": 0})
+
+    def record(self, route: str, seconds: float, status):
+        self.step.latencies[route].append(seconds)
+        self.step.statuses[route][status] += 1
+        slot = self._second()
+        slot["requests"] += 1
+        if not (isinstance(status, int) and status < 400):
+            slot["errors"] += 1
+
+    def rss(self, value: int):
+        self._second()["rss_bytes"] = value
+
+
+async def call(conn: Connection, rec: Recorder, route: str, method: str, path: str,
+               payload=None, timeout: float = 30.0):
+    """Timed request; returns the decoded JSON body, or None on any failure"""
+    body = json.dumps(payload).encode("utf-8") if payload is not None else None
+    start = time.perf_counter()
+    try:
+        status, data = await asyncio.wait_for(conn.request(method, path, body), timeout)
+    except asyncio.TimeoutError:
+        conn.close()
+        rec.record(route, time.perf_counter() - start, "timeout")
+        return None
+    except (OSError, asyncio.IncompleteReadError, HTTPError, ValueError) as e:
+        conn.close()
+        rec.record(route, time.perf_counter() - start, type(e).__name__)
+        return None
+    rec.record(route, time.perf_counter() - start, status)
+    if status >= 400:
+        return None
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
+
+
+def think_time(rng: random.Random, mean: float) -> float:
+    """Log-normal pause with the given mean (people mostly answer fast, some linger)"""
+    if mean <= 0:
+        return 0.0
+    sigma = 0.6
+    return rng.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+
+
+def chat_answer(question: dict, patient: dict) -> str:
+    """Answer a chat question as the simulated patient would"""
+    field, options = question.get("question_id"), question.get("options") or []
+    if question["type"] == "number":
+        return str(patient.get("temperatura") or 38.5)
+    if field == "lugar":
+        return options[0] if patient.get("lugar") == "Corrientes" else options[1]
+    if field == "estacion":
+        return options[0] if patient.get("estacion") == "Verano" else options[1]
+    return options[0] if patient.get(field) else options[1]
+
+
+async def run_diagnose(conn: Connection, rec: Recorder, patient: dict, args):
+    body = {k: patient[k] for k in API_FIELDS if k in patient}
+    await call(conn, rec, "POST /diagnose", "POST", "/diagnose", body, args.timeout)
+
+
+async def run_chat(conn: Connection, rec: Recorder, patient: dict, rng: random.Random, args):
+    start = await call(conn, rec, "POST /chat/start", "POST", "/chat/start",
+                       {"language": patient["language"], "mode": args.chat_mode}, args.timeout)
+    if start is None:
+        return
+    session_id, question = start["session_id"], start["question"]
+    while question is not None:
+        await asyncio.sleep(think_time(rng, args.think_time))
+        reply = await call(conn, rec, "POST /chat/{id}/message", "POST", f"/chat/{session_id}/message",
+                           {"answer": chat_answer(question, patient)}, args.timeout)
+        if reply is None or "error" in reply:
+            return
+        if rng.random() < args.history_prob:
+            await call(conn, rec, "GET /chat/{id}/history", "GET", f"/chat/{session_id}/history",
+                       timeout=args.timeout)
+        question = None if reply.get("completed") else reply.get("next_question")
+
+
+class Workload:
+    def __init__(self, args):
+        self.args = args
+        url = urlsplit(args.url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.rec = Recorder()
+        self.rng = random.Random(args.seed)
+        self.patients = iter_patients(10 ** 9, args.seed)
+        weights = dict(item.split("=") for item in args.mix.split(","))
+        self.scenarios = list(weights)
+        self.weights = [float(w) for w in weights.values()]
+        self.in_flight = 0
+
+    def connection(self) -> Connection:
+        return Connection(self.host, self.port, self.args.keepalive)
+
+    async def scenario(self, conn: Connection, rng: random.Random):
+        name = rng.choices(self.scenarios, self.weights)[0]
+        self.rec.step.scenarios[name] += 1
+        patient = next(self.patients)
+        if name == "diagnose":
+            await run_diagnose(conn, self.rec, patient, self.args)
+        elif name == "chat":
+            await run_chat(conn, self.rec, patient, rng, self.args)
+        else:
+            raise ValueError(f"Unknown scenario: {name}")
+
+    async def closed_loop(self):
+        self.rec.begin(f"closed:{self.args.users}")
+        deadline = time.monotonic() + self.args.duration
+
+        async def user(i: int):
+            rng = random.Random(self.args.seed * 100003 + i)
+            conn = self.connection()
+            await asyncio.sleep(rng.random() * self.args.ramp_up)  # stagger the start
+            while time.monotonic() < deadline:
+                await self.scenario(conn, rng)
+                await asyncio.sleep(think_time(rng, self.args.think_time))
+            conn.close()
+
+        await asyncio.gather(*(user(i) for i in range(self.args.users)))
+
+    async def open_loop(self, rates: List[float]):
+        tasks = set()
+
+        async def arrival(seed: int):
+            conn = self.connection()
+            try:
+                await self.scenario(conn, random.Random(seed))
+            finally:
+                conn.close()
+                self.in_flight -= 1
+
+        for rate in rates:
+            self.rec.begin(f"open:{rate:g}/s", rate)
+            step_end = time.monotonic() + self.args.step_seconds
+            next_arrival = time.monotonic()
+            while True:
+                next_arrival += self.rng.expovariate(rate)
+                if next_arrival >= step_end:
+                    break
+                await asyncio.sleep(max(0.0, next_arrival - time.monotonic()))
+                step = self.rec.step
+                step.arrivals += 1
+                if self.in_flight >= self.args.max_clients:
+                    step.shed += 1
+                    continue
+                self.in_flight += 1
+                task = asyncio.ensure_future(arrival(self.rng.getrandbits(32)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.sleep(max(0.0, step_end - time.monotonic()))
+        if tasks:  # let sessions that are still running finish, recorded apart
+            self.rec.begin("drain")
+            await asyncio.wait(tasks, timeout=self.args.drain_seconds)
+            for task in tasks:
+                task.cancel()
+
+    async def sample_rss(self):
+        conn = self.connection()
+        while True:
+            if self.args.pid:
+                value = process_tree_rss(self.args.pid)
+            else:
+                try:
+                    status, data = await asyncio.wait_for(conn.request("GET", "/metrics"), self.args.timeout)
+                    value = parse_rss(data.decode("utf-8")) if status == 200 else None
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, HTTPError):
+                    conn.close()
+                    value = None
+            if value is not None:
+                self.rec.rss(value)
+            await asyncio.sleep(self.args.sample_interval)
+
+    async def run(self) -> Recorder:
+        sampler = asyncio.ensure_future(self.sample_rss())
+        try:
+            if self.args.rate:
+                await self.open_loop([float(r) for r in self.args.rate.split(",")])
+            else:
+                await self.closed_loop()
+        finally:
+            self.rec.finish()
+            sampler.cancel()
+        return self.rec
+
+
+def parse_rss(text: str) -> Optional[int]:
+    for line in text.splitlines():
+        if line.startswith("process_resident_memory_bytes"):
+            return int(float(line.split()[-1]))
+    return None
+
+
+def process_tree_rss(pid: int) -> Optional[int]:
+    """RSS in bytes of `pid` and all its descendants (Linux /proc)"""
+    children = defaultdict(list)
+    rss = {}
+    page = os.sysconf("SC_PAGE_SIZE")
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children[int(fields[1])].append(int(entry))
+        rss[int(entry)] = int(fields[21]) * page
+    if pid not in rss:
+        return None
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        total += rss.get(current, 0)
+        pending.extend(children.get(current, ()))
+    return total
+
+
+def route_summary(latencies: List[float], statuses: Counter, seconds: float) -> dict:
+    values = np.asarray(latencies, dtype=np.float64) * 1e3
+    errors = sum(n for status, n in statuses.items() if not (isinstance(status, int) and status < 400))
+    counts = np.bincount(np.searchsorted(LATENCY_BUCKETS, values / 1e3, side="left"),
+                         minlength=len(LATENCY_BUCKETS) + 1)
+    bounds = [f"{b:g}" for b in LATENCY_BUCKETS] + ["+Inf"]
+    return {
+        "count": len(values),
+        "throughput_per_s": round(len(values) / seconds, 2) if seconds else None,
+        "errors": errors,
+        "error_rate": round(errors / len(values), 4) if len(values) else 0.0,
+        "statuses": {str(status): n for status, n in sorted(statuses.items(), key=lambda s: str(s[0]))},
+        "latency_ms": {
+            "p50": round(float(np.percentile(values, 50)), 3),
+            "p90": round(float(np.percentile(values, 90)), 3),
+            "p99": round(float(np.percentile(values, 99)), 3),
+            "mean": round(float(values.mean()), 3),
+            "max": round(float(values.max()), 3),
+        } if len(values) else None,
+        # Non-cumulative counts per upper bound in seconds (Prometheus bounds)
+        "histogram": {bound: int(n) for bound, n in zip(bounds, counts) if n},
+    }
+
+
+def report(rec: Recorder, args) -> dict:
+    steps = []
+    for step in rec.steps:
+        seconds = (step.ended or time.monotonic()) - step.started
+        routes = {route: route_summary(step.latencies[route], step.statuses[route], seconds)
+                  for route in ROUTES if step.latencies.get(route)}
+        requests = sum(r["count"] for r in routes.values())
+        errors = sum(r["errors"] for r in routes.values())
+        worst_p99 = max((r["latency_ms"]["p99"] for r in routes.values()), default=0.0)
+        error_rate = errors / requests if requests else 0.0
+        steps.append({
+            "step": step.name,
+            "offered_rate": step.offered_rate,
+            "seconds": round(seconds, 3),
+            "arrivals": step.arrivals,
+            "shed": step.shed,
+            "scenarios": dict(step.scenarios),
+            "requests": requests,
+            "throughput_per_s": round(requests / seconds, 2) if seconds else None,
+            "errors": errors,
+            "error_rate": round(error_rate, 4),
+            "saturated": step.offered_rate is not None and bool(
+                step.shed or error_rate > args.max_error_rate or worst_p99 > args.slo_ms),
+            "routes": routes,
+        })
+    saturation = next((s["step"] for s in steps if s["saturated"]), None)
+    return {
+        "meta": {
+            "url": args.url,
+            "mode": "open" if args.rate else "closed",
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "args": vars(args),
+        },
+        "saturation": saturation,
+        "steps": steps,
+        "timeline": [rec.timeline[t] for t in sorted(rec.timeline)],
+    }
+
+
+def summary(result: dict) -> str:
+    """Text table per step and route (stderr)"""
+    lines = []
+    for step in result["steps"]:
+        lines.append(f"{step['step']}: {step['requests']} requests, {step['throughput_per_s']} req/s, "
+                     f"error rate {step['error_rate']:.2%}, shed {step['shed']}"
+                     f"{'  [saturated]' if step['saturated'] else ''}")
+        for route, r in step["routes"].items():
+            lat = r["latency_ms"]
+            lines.append(f"  {route:<26}{r['count']:>9}{lat['p50']:>10.1f}{lat['p99']:>10.1f}"
+                         f"{lat['max']:>10.1f} ms  errors {r['errors']}")
+    rss = [s["rss_bytes"] for s in result["timeline"] if "rss_bytes" in s]
+    if rss:
+        lines.append(f"server RSS: {rss[0] / 2 ** 20:.1f} -> {rss[-1] / 2 ** 20:.1f} MiB "
+                     f"(max {max(rss) / 2 ** 20:.1f})")
+    lines.append(f"saturation: {result['saturation'] or 'not reached'}")
+    return "\n".join(lines)
+
+
+def raise_fd_limit():
+    """Thousands of clients need thousands of sockets"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=100, help="closed loop: concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=60, help="closed loop: seconds")
+    parser.add_argument("--ramp-up", type=float, default=5, help="closed loop: spread user starts over N s")
+    parser.add_argument("--rate", help="open loop: comma-separated arrival rates (users/s), one step each")
+    parser.add_argument("--step-seconds", type=float, default=30, help="open loop: seconds per rate")
+    parser.add_argument("--drain-seconds", type=float, default=60,
+                        help="open loop: wait for running sessions after the last step")
+    parser.add_argument("--max-clients", type=int, default=10000, help="open loop: users in flight before shedding")
+    parser.add_argument("--mix", default="diagnose=0.5,chat=0.5", help="scenario weights")
+    parser.add_argument("--think-time", type=float, default=3.0, help="mean seconds before each chat answer")
+    parser.add_argument("--history-prob", type=float, default=0.2, help="chance of polling history after an answer")
+    parser.add_argument("--chat-mode", default="fixed", choices=("fixed", "adaptive"))
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout (s)")
+    parser.add_argument("--keepalive", type=float, default=4.5, help="reconnect after N idle seconds")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="RSS sampling period (s)")
+    parser.add_argument("--pid", type=int, help="sum the RSS of this server process tree instead of /metrics")
+    parser.add_argument("--slo-ms", type=float, default=1000.0, help="p99 above this marks a step saturated")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    raise_fd_limit()
+    result = report(asyncio.run(Workload(args).run()), args)
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    print(summary(result), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import os
+import time
+
+from backend.agents.aggregates import FIELDS, GROUPS, EpiAggregates, RollingWindow, group_index, observation
+
+
+def results(code="DENGUE", dengue=0.8, covid=0.1, both=0.05):
+    return {
+        "deterministic": {"codigo": code},
+        "probabilistic": {"dengue_probability": dengue, "covid_probability": covid, "both_probability": both},
+    }
+
+
+def group(query, window, lugar, estacion):
+    groups = query["windows"][window]["groups"]
+    return next(g for g in groups if g["lugar"] == lugar and g["estacion"] == estacion)
+
+
+CORRIENTES_VERANO = {"lugar": "Corrientes", "estacion": "Verano"}
+OTRO_INVIERNO = {"lugar": "Chaco", "estacion": "Otoño"}  # normalized as the network sees them
+
+
+def test_rolling_window_expires_buckets():
+    window = RollingWindow(1, 60)
+    row = observation(results())
+    window.add(1000.0, 0, row)
+    window.add(1030.5, 0, row)
+    window.advance(1059.9)
+    assert window.totals[0, 0] == 2
+    window.advance(1060.0)  # the bucket of t=1000 left the window
+    assert window.totals[0, 0] == 1
+    window.add(1050.0, 1, row)  # a clock step backwards counts in the current bucket
+    assert window.totals[1, 0] == 1
+    window.advance(1200.0)
+    assert not window.totals.any()
+
+
+def test_rolling_window_memory_is_fixed():
+    window = RollingWindow(1, 60)
+    row = observation(results())
+    shape = window.slots.shape
+    for t in range(0, 10_000, 7):
+        window.add(float(t), t % len(GROUPS), row)
+    assert window.slots.shape == shape == (60, len(GROUPS), len(FIELDS))
+    assert window.ids.shape == (60,)
+    assert window.totals[:, 0].sum() == len(range(9_941, 10_000, 7))
+
+
+def test_observe_and_query_per_group():
+    aggregates = EpiAggregates()
+    now = 10_000.0
+    aggregates.observe(CORRIENTES_VERANO, results("DENGUE", 0.9, 0.1, 0.05), now)
+    aggregates.observe(CORRIENTES_VERANO, results("GRAVE_DENGUE", 0.7, 0.2, 0.15), now + 1)
+    aggregates.observe(OTRO_INVIERNO, results("COVID", 0.1, 0.8, 0.05), now + 2)
+    aggregates.observe(OTRO_INVIERNO, {"deterministic": {"error": "boom"}, "probabilistic": {"error": "boom"}}, now + 3)
+    assert group_index(OTRO_INVIERNO) == GROUPS.index(("Otro", "Invierno"))
+
+    query = aggregates.query(now=now + 3)
+    assert query["workers"] == 1
+    corrientes = group(query, "minute", "Corrientes", "Verano")
+    assert corrientes["count"] == 2 and corrientes["alarms"] == 1 and corrientes["errors"] == 0
+    assert corrientes["classifications"]["DENGUE"] == corrientes["classifications"]["GRAVE_DENGUE"] == 1
+    assert corrientes["avg_probability"] == {"dengue": 0.8, "covid": 0.15, "both": 0.1}
+    otro = group(query, "minute", "Otro", "Invierno")
+    assert otro["count"] == 2 and otro["errors"] == 1 and otro["classifications"]["COVID"] == 1
+    assert otro["avg_probability"] == {"dengue": 0.1, "covid": 0.8, "both": 0.05}
+    empty = group(query, "minute", "Corrientes", "Invierno")
+    assert empty["count"] == 0 and empty["avg_probability"]["dengue"] is None
+    assert query["windows"]["day"]["total"]["count"] == 4
+
+    later = aggregates.query("minute", now=now + 61.5)  # the first two fell out of the minute
+    assert list(later["windows"]) == ["minute"]
+    assert later["windows"]["minute"]["total"]["count"] == 2
+    assert aggregates.query("hour", now=now + 61.5)["windows"]["hour"]["total"]["count"] == 4
+
+
+def test_snapshots_are_merged_across_workers(tmp_path):
+    directory = str(tmp_path)
+    first, second = EpiAggregates(directory), EpiAggregates(directory)
+    second.path = os.path.join(directory, "aggregates-999999.npz")  # another worker's pid
+    now = time.time()
+    first.observe(CORRIENTES_VERANO, results("DENGUE", 0.9, 0.1, 0.05), now)
+    second.observe(CORRIENTES_VERANO, results("DUAL", 0.5, 0.5, 0.35), now)
+    second.observe(OTRO_INVIERNO, results("COVID", 0.1, 0.8, 0.05), now)
+    first.write_snapshot()
+    second.write_snapshot()
+    assert set(os.listdir(directory)) == {"aggregates-999999.npz", f"aggregates-{os.getpid()}.npz"}
+
+    query = first.query("minute", now=now)
+    assert query["workers"] == 2
+    assert query["windows"]["minute"]["total"]["count"] == 3
+    corrientes = group(query, "minute", "Corrientes", "Verano")
+    assert corrientes["count"] == 2 and corrientes["classifications"]["DUAL"] == 1
+    assert corrientes["avg_probability"] == {"dengue": 0.7, "covid": 0.3, "both": 0.2}
+    # Both workers see the same merged totals
+    assert second.query("minute", now=now)["windows"] == query["windows"]
+    # A snapshot's buckets expire like the live ones
+    assert first.query("minute", now=now + 120)["windows"]["minute"]["total"]["count"] == 0
@@ -0,0 +1,128 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from backend.agents.audit import RECORD_FIELDS, AuditLog, JSONLAuditSink, SQLiteAuditSink
+
+
+def record(i):
+    return (float(i), "diagnose", 0, None, "kb", "modelo", "DENGUE", 1.0, 2.0, 3.0, 0.1, 0.1, 0.2, None)
+
+
+def written(db):
+    with sqlite3.connect(db) as conn:
+        return [int(ts) for (ts,) in conn.execute("SELECT ts FROM audit ORDER BY id")]
+
+
+def write_spill(path, ids, torn=False):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in ids:
+            f.write(json.dumps(record(i)) + "\n")
+        if torn:
+            f.write('[99.0, "diagnose"')
+
+
+@pytest.fixture
+def dead_pid():
+    proceso = subprocess.Popen([sys.executable, "-c", "pass"])
+    proceso.wait()
+    return proceso.pid
+
+
+def audit_log(db, **kwargs):
+    kwargs.setdefault("spill_path", f"{db}.spill-{os.getpid()}.jsonl")
+    return AuditLog(SQLiteAuditSink(db), policy="spill", **kwargs)
+
+
+def test_record_layout():
+    assert len(record(0)) == len(RECORD_FIELDS)
+
+
+def test_full_ring_spills_and_drains_in_order(tmp_path):
+    db = str(tmp_path / "audit.db")
+    log = audit_log(db, capacity=8, batch_size=4)
+    for i in range(50):  # writer not started: everything past the ring is spilled
+        assert log.push(record(i))
+    assert log.spilled == 42
+    log.start()
+    log.stop()
+    assert sorted(written(db)) == list(range(50))
+    assert log.written == 50 and log.dropped == 0
+    assert not any(p.name.startswith("audit.db.spill") for p in tmp_path.iterdir())
+
+
+def test_drop_policy_counts_discarded_records(tmp_path):
+    log = AuditLog(SQLiteAuditSink(str(tmp_path / "audit.db")), capacity=4, policy="drop")
+    results = [log.push(record(i)) for i in range(10)]
+    assert results == [True] * 4 + [False] * 6
+    assert log.dropped == 6
+
+
+@pytest.mark.skipif(os.name == "nt", reason="other workers' spill files are only recovered on POSIX")
+def test_spill_files_of_stopped_workers_are_recovered_once(tmp_path, dead_pid):
+    db = str(tmp_path / "audit.db")
+    write_spill(f"{db}.spill-{dead_pid}.jsonl.draining", range(0, 5))
+    write_spill(f"{db}.spill-{dead_pid}.jsonl", range(5, 10), torn=True)
+    write_spill(f"{db}.spill-{dead_pid + 1_000_000}.jsonl.recovering-{dead_pid}-0a1b", range(10, 12))
+    write_spill(f"{db}.spill-{dead_pid + 2_000_000}.jsonl.recovering-{os.getpid()}-dead", range(12, 14))
+    running = f"{db}.spill-{os.getppid()}.jsonl"  # a running worker's file is left alone
+    write_spill(running, range(100, 103))
+
+    # Both logs list the same leftovers before either claims one; the claim
+    # renames make sure each file is still written once.
+    first, second = audit_log(db), audit_log(db)
+    listed = first._leftover_spills()
+    assert listed == second._leftover_spills() and len(listed) == 4
+    second.start()
+    first._leftover_spills = lambda: listed
+    first.start()
+    for log in (first, second):
+        log.stop()
+
+    assert written(db) == list(range(14))
+    assert sorted(os.listdir(tmp_path)) == ["audit.db", "audit.db-shm", "audit.db-wal",
+                                            os.path.basename(running)]
+
+
+def test_claim_of_another_log_in_this_process_is_left_alone(tmp_path, dead_pid):
+    db = str(tmp_path / "audit.db")
+    first, second = audit_log(db), audit_log(db)
+    claim = f"{db}.spill-{dead_pid}.jsonl.recovering-{os.getpid()}-{second._token}"
+    write_spill(claim, range(3))
+    assert first._leftover_spills() == []
+    assert second._leftover_spills() == [claim]
+
+
+@pytest.mark.skipif(os.name == "nt", reason="other workers' spill files are only recovered on POSIX")
+def test_undecodable_spill_lines_are_counted_as_failed(tmp_path, dead_pid):
+    db = str(tmp_path / "audit.db")
+    spill = f"{db}.spill-{dead_pid}.jsonl"
+    write_spill(spill, range(4))
+    lines = open(spill, encoding="utf-8").readlines()
+    lines[1] = "{not json\n"
+    lines[2] = "7\n"
+    with open(spill, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+
+    log = audit_log(db)
+    log.start()
+    log.stop()
+    assert written(db) == [0, 3]
+    assert log.failed == 2
+    assert not os.path.exists(spill) and len(os.listdir(tmp_path)) == 3
+
+
+def test_own_leftover_spill_is_recovered_by_jsonl_sink(tmp_path):
+    directory = tmp_path / "audit"
+    sink = JSONLAuditSink(str(directory))
+    spill = str(directory / f"spill-{os.getpid()}.jsonl")
+    write_spill(spill, range(3))
+    log = AuditLog(sink, policy="spill", spill_path=spill)
+    log.start()
+    log.stop()
+    lines = [json.loads(line) for p in sorted(directory.iterdir()) for line in p.read_text().splitlines()]
+    assert [line["ts"] for line in lines] == [0.0, 1.0, 2.0]
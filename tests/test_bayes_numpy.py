@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("pgmpy")
+
+from backend.agents import probabilistic
+from backend.agents.bayes_numpy import (
+    NODOS_EVIDENCIA, NO_OBSERVADO, MotorBayesNumpy, resumir_conjunta, verificar_exactitud,
+)
+
+
+@pytest.fixture(scope="module")
+def motor():
+    return MotorBayesNumpy.desde_definiciones(probabilistic.DEFINICION_CPDS)
+
+
+def pgmpy_posteriores(fila):
+    evidence = {nodo: int(v) for nodo, v in zip(NODOS_EVIDENCIA, fila) if v != NO_OBSERVADO}
+    return resumir_conjunta(probabilistic._conjunta_pgmpy(evidence))
+
+
+def test_complete_evidence_matches_variable_elimination(motor):
+    error, exacto = verificar_exactitud(motor, probabilistic.obtener_red()[1])
+    assert exacto, error
+
+
+def test_partial_evidence_matches_variable_elimination(motor):
+    filas = np.random.default_rng(0).integers(-1, 2, size=(40, len(NODOS_EVIDENCIA))).astype(np.int8)
+    filas[0] = NO_OBSERVADO  # no evidence at all: the priors
+    esperado = np.array([pgmpy_posteriores(fila) for fila in filas])
+    np.testing.assert_allclose(motor.posteriores(filas), esperado, atol=1e-9)
+
+
+def test_posteriores_lote_matches_compiled_table():
+    filas = np.random.default_rng(1).integers(0, 2, size=(64, len(NODOS_EVIDENCIA))).astype(np.int8)
+    mascaras = filas @ (1 << np.arange(len(NODOS_EVIDENCIA) - 1, -1, -1))
+    np.testing.assert_allclose(
+        probabilistic.posteriores_lote(filas), probabilistic.TABLA_POSTERIORES[mascaras], atol=1e-12
+    )
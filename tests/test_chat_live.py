@@ -0,0 +1,37 @@
+import random
+
+import numpy as np
+
+from backend.agents import probabilistic
+from backend.agents.bayes_numpy import NODOS_EVIDENCIA, indice_parcial
+from backend.agents.conversational import (
+    ANSWER_FIELDS, ChatSession, _complete_data, apply_answer, current_question, get_flow_template,
+)
+from backend.agents.deterministic import escenarios_deterministas, puntaje_en_curso
+
+
+def test_partial_tables_from_the_artifact_match_the_engine():
+    filas = np.random.default_rng(0).integers(-1, 2, size=(200, len(NODOS_EVIDENCIA))).astype(np.int8)
+    tablas = probabilistic.tablas_parciales()
+    indices = [indice_parcial(fila) for fila in filas]
+    np.testing.assert_allclose(tablas["posteriores"][indices], probabilistic.motor_numpy.posteriores(filas),
+                               atol=1e-6)
+
+
+def test_live_feedback_follows_the_answers():
+    rng = random.Random(0)
+    for mode in ("fixed", "adaptive"):
+        session = ChatSession("es", *get_flow_template("es"), mode)
+        while (question := current_question(session)) is not None:
+            answer = rng.choice(question["options"]) if question["options"] else "38.8"
+            live = apply_answer(session, answer)["live"]
+            data = _complete_data(session.answers)
+            escenario = escenarios_deterministas([data])[0]
+            assert (live["score_dengue"], live["score_covid"], live["alarm"]) == (
+                escenario["score_dengue"], escenario["score_covid"], escenario["alarma"])
+            assert puntaje_en_curso(data)["score_dengue"] == escenario["score_dengue"]
+
+            respuestas = {campo: session.answers.get(campo) for campo in ANSWER_FIELDS}
+            esperado = probabilistic.motor_numpy.posteriores(probabilistic.fila_parcial(respuestas))[0]
+            assert abs(live["dengue_probability"] - esperado[0] * 100) <= 0.01
+            assert abs(live["covid_probability"] - esperado[1] * 100) <= 0.01
@@ -0,0 +1,45 @@
+import copy
+
+import numpy as np
+
+from backend.agents import probabilistic
+
+
+def test_round_trip(tmp_path):
+    ruta = str(tmp_path / "modelo.npz")
+    probabilistic.guardar_artefacto(probabilistic._datos_modelo, ruta)
+    datos = probabilistic.cargar_artefacto(ruta)
+    assert str(datos["version"]) == probabilistic.VERSION_MODELO
+    np.testing.assert_array_equal(datos["tabla_posteriores"], probabilistic.TABLA_POSTERIORES)
+    assert list(tmp_path.iterdir()) == [tmp_path / "modelo.npz"]  # no temporary file left
+
+
+def test_other_version_is_rejected(tmp_path):
+    ruta = str(tmp_path / "modelo.npz")
+    probabilistic.guardar_artefacto(dict(probabilistic._datos_modelo, version=np.array("otra")), ruta)
+    assert probabilistic.cargar_artefacto(ruta) is None
+
+
+def test_missing_or_corrupt_artifact_is_rejected(tmp_path):
+    assert probabilistic.cargar_artefacto(str(tmp_path / "no_existe.npz")) is None
+    corrupto = tmp_path / "corrupto.npz"
+    corrupto.write_bytes(b"no es un npz")
+    assert probabilistic.cargar_artefacto(str(corrupto)) is None
+
+
+def test_stale_artifact_is_recompiled_and_replaced(tmp_path, monkeypatch):
+    ruta = str(tmp_path / "modelo.npz")
+    probabilistic.guardar_artefacto(dict(probabilistic._datos_modelo, version=np.array("otra")), ruta)
+    monkeypatch.setattr(probabilistic, "compilar_artefacto", lambda: dict(probabilistic._datos_modelo))
+
+    _, origen, _ = probabilistic.inicializar_modelo(ruta)
+    assert origen == "compilado"
+    _, origen, _ = probabilistic.inicializar_modelo(ruta)
+    assert origen == "artefacto"
+
+
+def test_version_changes_with_the_cpds(monkeypatch):
+    definiciones = copy.deepcopy(probabilistic.DEFINICION_CPDS)
+    definiciones[0]["values"] = [[0.4], [0.6]]
+    monkeypatch.setattr(probabilistic, "DEFINICION_CPDS", definiciones)
+    assert probabilistic.version_modelo() != probabilistic.VERSION_MODELO
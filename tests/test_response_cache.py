@@ -0,0 +1,82 @@
+import random
+
+import pytest
+
+from backend.agents.deterministic import (
+    cache_diagnosticos, diagnostico_en_cache, run_deterministic_agent,
+)
+from backend.agents.response_cache import ResponseCache
+
+BOOLEANOS = (
+    "fiebre", "tos", "dolor_garganta", "dolor_retroocular", "mialgia", "anosmia", "asma",
+    "hipertension", "viaje_brasil", "contacto_dengue", "dolor_abdominal_intenso",
+    "sangrado_mucosas", "disnea",
+)
+
+
+def pacientes(n, seed=0):
+    rng = random.Random(seed)
+    for _ in range(n):
+        paciente = {campo: rng.random() < 0.4 for campo in BOOLEANOS}
+        paciente.update(
+            temperatura=rng.choice([None, 37.2, 38.4, 38.9, 39.8]),
+            lugar=rng.choice(["Corrientes", "Otro"]),
+            estacion=rng.choice(["Verano", "Invierno"]),
+        )
+        yield paciente
+
+
+@pytest.fixture
+def cache():
+    max_entries = cache_diagnosticos.max_entries
+    cache_diagnosticos.max_entries = 4096
+    cache_diagnosticos.clear()
+    yield cache_diagnosticos
+    cache_diagnosticos.max_entries = max_entries
+    cache_diagnosticos.clear()
+
+
+def sin_cache(paciente, lang, formato):
+    max_entries = cache_diagnosticos.max_entries
+    cache_diagnosticos.max_entries = 0
+    try:
+        return run_deterministic_agent(paciente, lang, formato)
+    finally:
+        cache_diagnosticos.max_entries = max_entries
+
+
+@pytest.mark.parametrize("formato", ["text", "structured", "none"])
+@pytest.mark.parametrize("lang", ["es", "en"])
+def test_cached_results_equal_fresh_ones(cache, lang, formato):
+    lista = list(pacientes(150))
+    for paciente in lista + lista:  # second pass is served from the cache
+        assert run_deterministic_agent(paciente, lang, formato) == sin_cache(paciente, lang, formato)
+    assert cache.hits >= len(lista)
+
+
+def test_same_fever_band_shares_an_entry_but_keeps_its_temperature(cache):
+    paciente = next(pacientes(1))
+    paciente.update(fiebre=True, temperatura=38.2)
+    run_deterministic_agent(paciente, "es", "text")
+    otro = dict(paciente, temperatura=38.7)
+    cacheado = diagnostico_en_cache(otro, "es", "text")
+    assert cacheado is not None
+    assert cacheado == sin_cache(otro, "es", "text")
+
+
+def test_version_change_invalidates():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", 1, "v1")
+    assert cache.get("a", "v1") == 1
+    assert cache.get("a", "v2") is None
+    assert cache.invalidations == 1
+
+
+def test_lru_eviction():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", 1, "v")
+    cache.put("b", 2, "v")
+    cache.get("a", "v")
+    cache.put("c", 3, "v")
+    assert cache.get("b", "v") is None and cache.get("a", "v") == 1
+    assert cache.evictions == 1
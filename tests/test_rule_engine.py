@@ -0,0 +1,89 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from backend.agents.rule_engine import ReglasCompiladas, clave_condicion
+
+HECHOS = ["fiebre", "sangrado", "vomitos", "tos", "mialgia", "viaje", "contacto"]
+GRAVE = {"todas": ["fiebre", {"alguna": ["sangrado", "vomitos"]}]}
+KB = {
+    "reglas_signos_alarma": [
+        {"id": "grave", "condicion": GRAVE},
+        {"id": "sangrado", "condicion": "sangrado"},
+    ],
+    "reglas_diagnostico_diferencial": [
+        {"sintoma": "tos", "peso_covid": 3, "peso_dengue": 0},
+        {"sintoma": {"todas": ["fiebre", "mialgia"]}, "peso_covid": 0, "peso_dengue": 4},
+        {"sintoma": {"alguna": ["tos", "mialgia"]}, "peso_covid": 1, "peso_dengue": 1},
+    ],
+    "reglas_contexto_epidemiologico": [
+        {"condicion": {"alguna": ["viaje", "contacto"]}, "peso_covid": 0, "peso_dengue": 2},
+        {"condicion": {"todas": [{"alguna": ["vomitos", "sangrado"]}, "fiebre"]}, "peso_covid": 0, "peso_dengue": 1},
+        # Same condition as the first alarm rule: shares its column
+        {"condicion": GRAVE, "peso_covid": -1, "peso_dengue": 0},
+    ],
+}
+
+
+def cumple(condicion, hechos):
+    if isinstance(condicion, str):
+        return condicion in hechos
+    operador, partes = next(iter(condicion.items()))
+    combinar = all if operador == "todas" else any
+    return combinar(cumple(p, hechos) for p in partes)
+
+
+def combinaciones():
+    for n in range(len(HECHOS) + 1):
+        for hechos in itertools.combinations(HECHOS, n):
+            yield set(hechos)
+
+
+@pytest.fixture(scope="module")
+def reglas():
+    return ReglasCompiladas(KB)
+
+
+def test_active_rules_match_direct_evaluation(reglas):
+    secciones = {
+        "alarmas": [r["condicion"] for r in KB["reglas_signos_alarma"]],
+        "diferenciales": [r["sintoma"] for r in KB["reglas_diagnostico_diferencial"]],
+        "contexto": [r["condicion"] for r in KB["reglas_contexto_epidemiologico"]],
+    }
+    for hechos in combinaciones():
+        evidencia = {h: h in hechos for h in HECHOS}
+        columnas = reglas.activas(evidencia)
+        for seccion, condiciones in secciones.items():
+            esperadas = [i for i, c in enumerate(condiciones) if cumple(c, hechos)]
+            assert reglas.reglas_activas(seccion, columnas) == esperadas, (seccion, hechos)
+
+
+def test_scores_match_direct_evaluation(reglas):
+    evidencias = [{h: h in hechos for h in HECHOS} for hechos in combinaciones()]
+    puntajes = reglas.puntuar(reglas.matriz(evidencias), [36.5] * len(evidencias))
+    for i, evidencia in enumerate(evidencias):
+        hechos = {h for h, v in evidencia.items() if v}
+        activas = [r for r in KB["reglas_diagnostico_diferencial"] if cumple(r["sintoma"], hechos)]
+        activas += [r for r in KB["reglas_contexto_epidemiologico"] if cumple(r["condicion"], hechos)]
+        assert puntajes["score_covid"][i] == sum(r["peso_covid"] for r in activas)
+        assert puntajes["score_dengue"][i] == sum(r["peso_dengue"] for r in activas)
+        assert puntajes["grave"][i] == any(cumple(r["condicion"], hechos) for r in KB["reglas_signos_alarma"])
+
+
+def test_only_true_facts_count(reglas):
+    # Non-boolean evidence values (temperatures, strings) are not facts
+    assert reglas.activas({"fiebre": 39.0, "tos": "si", "mialgia": 1}).size == 0
+
+
+def test_identical_conditions_share_a_column(reglas):
+    assert reglas.cond_alarmas[0] == reglas.cond_contexto[2]
+    assert len(reglas.claves) == len(set(reglas.claves))
+
+
+@pytest.mark.parametrize("condicion", [
+    {"ninguna": ["tos"]}, {"todas": []}, {"todas": "tos"}, {"todas": ["tos"], "alguna": ["fiebre"]}, 3,
+])
+def test_invalid_conditions_are_rejected(condicion):
+    with pytest.raises(ValueError):
+        clave_condicion(condicion)
@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from backend.agents import conversational
+from backend.agents.conversational import (
+    ANSWER_FIELDS, apply_answer, current_question, decode_session, encode_session,
+)
+from backend.agents.session_store import SQLiteSessionStore
+
+
+def new_session(lang="es", mode="fixed"):
+    return conversational.ChatSession(lang, *conversational.get_flow_template(lang), mode)
+
+
+def answered(n, **kwargs):
+    session = new_session(**kwargs)
+    for _ in range(n):
+        question = current_question(session)
+        apply_answer(session, question["options"][0] if question["options"] else "38.6")
+    return session
+
+
+def state(session):
+    return (session.lang, session.kb_version, session.step, session.asked, session.live,
+            session.mode, session.early_stop, session.history,
+            [getattr(session.answers, f) for f in ANSWER_FIELDS])
+
+
+@pytest.fixture(autouse=True)
+def fresh_flows():
+    conversational._compile_flow.cache_clear()
+    yield
+    conversational._compile_flow.cache_clear()
+
+
+@pytest.mark.parametrize("mode", ["fixed", "adaptive"])
+def test_round_trip(mode):
+    session = answered(6, mode=mode)
+    decoded = decode_session(encode_session(session))
+    assert state(decoded) == state(session)
+    assert decoded.flow is session.flow  # the shared template, not a copy
+
+
+@pytest.mark.parametrize("mode", ["fixed", "adaptive"])
+def test_decoded_session_continues_like_the_original(mode):
+    session = answered(4, mode=mode)
+    decoded = decode_session(encode_session(session))
+    while True:
+        question = current_question(session)
+        assert current_question(decoded) == question
+        if question is None:
+            break
+        answer = question["options"][-1] if question["options"] else "39.1"
+        assert apply_answer(decoded, answer) == apply_answer(session, answer)
+
+
+def test_legacy_live_state_is_reduced_to_the_partial_index():
+    session = answered(3)
+    raw = json.loads(encode_session(session))
+    raw["live"] = ["kb", 0, 0, 0, session.live]
+    assert decode_session(json.dumps(raw)).live == session.live
+
+
+def test_session_of_an_unloaded_kb_version_is_dropped(monkeypatch):
+    raw = encode_session(answered(3))
+    snapshot = conversational.get_kb()
+    conversational._compile_flow.cache_clear()
+    monkeypatch.setattr(conversational, "get_kb", lambda: snapshot._replace(version="recargada"))
+    assert decode_session(raw) is None
+
+
+def test_session_resumes_on_its_cached_flow_after_a_reload(monkeypatch):
+    session = answered(3)
+    raw = encode_session(session)
+    snapshot = conversational.get_kb()
+    monkeypatch.setattr(conversational, "get_kb", lambda: snapshot._replace(version="recargada"))
+    decoded = decode_session(raw)
+    assert decoded.kb_version == session.kb_version and decoded.flow is session.flow
+    assert new_session().kb_version == "recargada"
+
+
+def test_sqlite_store(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"), encode_session, decode_session)
+    session = answered(5)
+    store.put("s1", session)
+    assert state(store.get("s1")) == state(session)
+    assert store.get("otra") is None
+
+
+def test_redis_store():
+    fakeredis = pytest.importorskip("fakeredis")
+    from backend.agents.session_store import RedisSessionStore
+    store = RedisSessionStore(encode_session, decode_session, client=fakeredis.FakeRedis())
+    session = answered(5, lang="en")
+    store.put("s1", session)
+    assert state(store.get("s1")) == state(session)
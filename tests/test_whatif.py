@@ -0,0 +1,86 @@
+import random
+
+import numpy as np
+import pytest
+
+pytest.importorskip("httpx")
+from fastapi.testclient import TestClient
+
+from backend.agents import probabilistic
+from backend.agents.deterministic import escenarios_deterministas, run_deterministic_batch
+from backend.main import WHATIF_FINDINGS, app, flipped_value
+
+BOOLEANOS = (
+    "fiebre", "tos", "dolor_garganta", "dolor_retroocular", "mialgia", "anosmia", "asma",
+    "hipertension", "viaje_brasil", "contacto_dengue", "dolor_abdominal_intenso",
+    "sangrado_mucosas", "disnea",
+)
+
+
+def pacientes(n, seed=0):
+    rng = random.Random(seed)
+    return [
+        dict(
+            {campo: rng.random() < 0.4 for campo in BOOLEANOS},
+            temperatura=rng.choice([None, 37.4, 38.6, 39.8]),
+            lugar=rng.choice(["Corrientes", "Otro"]),
+            estacion=rng.choice(["Verano", "Invierno"]),
+            trace_format="none",
+        )
+        for _ in range(n)
+    ]
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def logit(p):
+    return np.log(p / (1 - p))
+
+
+@pytest.mark.parametrize("paciente", pacientes(8))
+def test_flips_match_individual_diagnoses(client, paciente):
+    respuesta = client.post("/diagnose/whatif", json=paciente).json()
+    assert [f["field"] for f in respuesta["findings"]] == WHATIF_FINDINGS
+    for finding in respuesta["findings"]:
+        variante = dict(paciente, **{finding["field"]: finding["flipped_value"]})
+        diagnostico = client.post("/diagnose", json=variante).json()
+        flipped = finding["flipped"]
+        for campo in ("dengue_probability", "covid_probability", "both_probability"):
+            assert flipped[campo] == diagnostico["probabilistic"][campo]
+        assert flipped["codigo"] == diagnostico["deterministic"]["codigo"]
+        if finding["node"] is None:
+            assert finding["log_lr"] is None
+            assert flipped["dengue_probability"] == respuesta["base"]["dengue_probability"]
+
+
+@pytest.mark.parametrize("paciente", pacientes(6, seed=1))
+def test_contributions_are_log_likelihood_ratios(paciente):
+    pytest.importorskip("pgmpy")
+    evidence = probabilistic.evidencia_paciente(paciente)
+    base, _, contribuciones = probabilistic.analisis_que_pasaria(paciente)
+    for i, nodo in enumerate(probabilistic.NODOS_EVIDENCIA):
+        resto = {k: v for k, v in evidence.items() if k != nodo}
+        sin_nodo = probabilistic.resumir_conjunta(probabilistic._conjunta_pgmpy(resto))
+        np.testing.assert_allclose(contribuciones[i], logit(base[:2]) - logit(sin_nodo[:2]), atol=1e-6)
+
+
+def test_flipped_posteriors_come_from_the_compiled_table():
+    paciente = pacientes(1, seed=2)[0]
+    base, invertidos, _ = probabilistic.analisis_que_pasaria(paciente)
+    for i, (campo, _) in enumerate(probabilistic.CAMPO_NODO.values()):
+        invertido = flipped_value(campo, paciente.get(campo))
+        esperado = probabilistic.consultar_posteriores(
+            probabilistic.evidencia_paciente(dict(paciente, **{campo: invertido})))
+        np.testing.assert_allclose(invertidos[i], esperado)
+
+
+def test_deterministic_scenarios_agree_with_the_batch():
+    lista = pacientes(30, seed=3)
+    escenarios = escenarios_deterministas(lista)
+    resultados = run_deterministic_batch(lista, trace_format="none")
+    assert [e["codigo"] for e in escenarios] == [r["codigo"] for r in resultados]
+    assert all(e["alarma"] == e["codigo"].startswith("GRAVE_") for e in escenarios)